@@ -54,6 +54,7 @@ kdeDirs['iconActions'] = os.path.join(kdeDirs['icon'], 'hicolor', 'scalable', 'a
 
 app_files = [os.path.join('src', x) for x in os.listdir('src') if x.endswith('.py') or x.endswith('.ui')]
 app_files.append('src/kajonggui.rc')
+app_files.append('src/permutations.bin')
 app_files.append('COPYING')
 app_files.append('COPYING.DOC')
 
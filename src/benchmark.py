@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Wolfgang Rohdewald <wolfgang@rohdewald.de>
+
+Kajongg is free software you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+Measure the hot paths of scoring and robot AI. The hands come from
+scoringtest.py and from robot games played by simulator.py. All caches
+are cleared before every measurement.
+
+Results are compared with the baseline saved by --save, the exit code
+is 1 if a benchmark got slower or needs more memory than the tolerance allows.
+
+The baseline lives in ~/.kajongg/benchmark.json, outside of the sources:
+timings only compare on the machine which measured them. With --baseline,
+any other file can be used, for example one kept in a CI job.
+"""
+
+from __future__ import print_function
+
+import signal
+signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+import unittest
+
+from optparse import OptionParser
+
+import simulator
+import scoringtest
+
+from common import Options, Debug
+from wind import Wind
+from tile import TileList
+from game import PlayingGame
+from hand import Hand, HandCache
+from intelligence import AIDefault
+from permutations import Permutations
+from tilecounts import TileCounts
+from rule import PredefinedRuleset
+
+OPTIONS = None
+
+
+class Corpus:
+
+    """the hand strings used by all benchmarks. discarding holds
+    only those a robot had to discard from"""
+
+    def __init__(self, player, seeds):
+        self.strings = []
+        self.discarding = []
+        self.__fromScoringtest()
+        self.__fromGames(seeds)
+        self.strings = sorted(set(self.strings + self.discarding))
+        self.discarding = sorted(set(self.discarding))
+        self.__removeInvalid(player)
+
+    def __removeInvalid(self, player):
+        """some tests want hands to be rejected"""
+        valid = []
+        for string in self.strings:
+            try:
+                _ = Hand(player, string).score
+            except AssertionError:
+                continue
+            valid.append(string)
+        player.clearCache()
+        self.strings = valid
+
+    def __fromScoringtest(self):
+        """all hands the scoring tests look at"""
+        strings = self.strings
+        realHand = scoringtest.Hand
+
+        def recordingHand(player, string, *args, **kwargs):
+            """record string"""
+            strings.append(string)
+            return realHand(player, string, *args, **kwargs)
+        scoringtest.Hand = recordingHand
+        try:
+            suite = unittest.defaultTestLoader.loadTestsFromModule(scoringtest)
+            unittest.TextTestRunner(stream=io.StringIO()).run(suite)
+        finally:
+            scoringtest.Hand = realHand
+
+    def __fromGames(self, seeds):
+        """the hands robots had to discard from"""
+        strings = self.discarding
+        realSelectDiscard = AIDefault.selectDiscard
+
+        def recordingSelectDiscard(aiInstance, hand):
+            """record the hand"""
+            strings.append(hand.string)
+            return realSelectDiscard(aiInstance, hand)
+        AIDefault.selectDiscard = recordingSelectDiscard
+        try:
+            ruleset = simulator.findRuleset(OPTIONS.ruleset)
+            for seed in seeds:
+                simulator.playGame(ruleset, seed, 'Tester 1')
+        finally:
+            AIDefault.selectDiscard = realSelectDiscard
+
+
+class Benchmark:
+
+    """one hot path. setup prepares what run needs, run returns
+    the number of operations done"""
+
+    name = None
+
+    def __init__(self, player, corpus):
+        self.player = player
+        self.corpus = corpus
+
+    def clearCaches(self):
+        """we want to measure the real work"""
+        self.player.clearCache()
+        HandCache.clear()
+        Permutations.permuteCache.clear()
+        Permutations.colorPermCache.clear()
+        TileCounts.blockCache.clear()
+        TileCounts.groupCache.clear()
+        TileCounts.knittingCache.clear()
+
+    def hands(self, lenOffset=None):
+        """build Hand objects for the corpus"""
+        result = list(Hand(self.player, x) for x in self.corpus.strings)
+        if lenOffset is not None:
+            result = list(x for x in result if x.lenOffset == lenOffset)
+        return result
+
+    def setup(self):
+        """prepare run"""
+        self.clearCaches()
+
+    def run(self):
+        """virtual"""
+        pass
+
+
+class HandBenchmark(Benchmark):
+
+    """Hand construction from strings, up to the score"""
+
+    name = 'Hand'
+
+    def run(self):
+        for string in self.corpus.strings:
+            _ = Hand(self.player, string).score
+        return len(self.corpus.strings)
+
+
+class ArrangeBenchmark(Benchmark):
+
+    """Hand construction for strings with tiles to be arranged"""
+
+    name = 'arrange'
+
+    def run(self):
+        strings = list(x for x in self.corpus.strings if ' R' in ' ' + x)
+        for string in strings:
+            _ = Hand(self.player, string).melds
+        return len(strings)
+
+
+class CallingHandsBenchmark(Benchmark):
+
+    """Hand.callingHands for all hands waiting for one tile"""
+
+    name = 'callingHands'
+
+    def setup(self):
+        self.clearCaches()
+        self.calling = self.hands(lenOffset=0)
+        self.clearCaches()
+
+    def run(self):
+        for hand in self.calling:
+            _ = hand.callingHands
+        return len(self.calling)
+
+
+class WinningTilesBenchmark(Benchmark):
+
+    """StandardMahJongg.winningTileCandidates"""
+
+    name = 'winningTileCandidates'
+
+    def setup(self):
+        self.clearCaches()
+        self.calling = self.hands(lenOffset=0)
+        self.clearCaches()
+
+    def run(self):
+        mjRule = self.player.game.ruleset.standardMJRule
+        for hand in self.calling:
+            mjRule.winningTileCandidates(hand)
+        return len(self.calling)
+
+
+class PermutationsBenchmark(Benchmark):
+
+    """Permutations of the tiles in hand"""
+
+    name = 'Permutations'
+
+    def setup(self):
+        self.clearCaches()
+        self.tileLists = list(TileList(x.tilesInHand) for x in self.hands())
+        self.clearCaches()
+
+    def run(self):
+        for tiles in self.tileLists:
+            _ = Permutations(tiles).variants
+        return len(self.tileLists)
+
+
+class DiscardBenchmark(Benchmark):
+
+    """AIDefault.selectDiscard for all hands with a tile too many"""
+
+    name = 'selectDiscard'
+
+    def setup(self):
+        self.clearCaches()
+        self.discarding = list(Hand(self.player, x) for x in self.corpus.discarding)
+        self.clearCaches()
+
+    def run(self):
+        intelligence = AIDefault(self.player)
+        for hand in self.discarding:
+            intelligence.selectDiscard(hand)
+        return len(self.discarding)
+
+
+class RulesetBenchmark(Benchmark):
+
+    """Ruleset.load for all predefined rulesets"""
+
+    name = 'Ruleset.load'
+
+    def run(self):
+        for rulesetClass in PredefinedRuleset.classes:
+            rulesetClass().load()
+        return len(PredefinedRuleset.classes)
+
+
+BENCHMARKS = [HandBenchmark, ArrangeBenchmark, CallingHandsBenchmark,
+              WinningTilesBenchmark, PermutationsBenchmark, DiscardBenchmark,
+              RulesetBenchmark]
+
+
+def measure(benchmark):
+    """returns operations per second and the peak of
+    allocated KiB for one run"""
+    best = None
+    for _ in range(OPTIONS.repeat):
+        benchmark.setup()
+        start = time.perf_counter()
+        operations = benchmark.run()
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    benchmark.setup()
+    tracemalloc.start()
+    benchmark.run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return operations / max(best, 1e-9), peak // 1024
+
+
+def regressions(name, result, baseline):
+    """returns a list of texts, empty if result is not worse than baseline"""
+    if baseline is None:
+        return []
+    tolerance = OPTIONS.tolerance / 100.0
+    messages = []
+    if result['opsPerSecond'] < baseline['opsPerSecond'] * (1 - tolerance):
+        messages.append('{}: {:.1f} operations/s, baseline is {:.1f}'.format(
+            name, result['opsPerSecond'], baseline['opsPerSecond']))
+    # small absolute slack: the peak of a fast benchmark varies
+    if result['peakKiB'] > baseline['peakKiB'] * (1 + tolerance) + 64:
+        messages.append('{}: {} KiB peak allocation, baseline is {}'.format(
+            name, result['peakKiB'], baseline['peakKiB']))
+    return messages
+
+
+def parse_options():
+    """parse options"""
+    parser = OptionParser()
+    parser.add_option(
+        '', '--ruleset', dest='ruleset', default='DMJL',
+        help='use RULESET for scoring and for recording games', metavar='RULESET')
+    parser.add_option(
+        '', '--games', dest='games', type=int, default=2,
+        help='record the hands of GAMES robot games with one round each', metavar='GAMES')
+    parser.add_option(
+        '', '--repeat', dest='repeat', type=int, default=3,
+        help='measure REPEAT times, take the fastest', metavar='REPEAT')
+    parser.add_option(
+        '', '--only', dest='only',
+        help='run only the comma separated BENCHMARKS', metavar='BENCHMARKS')
+    parser.add_option(
+        '', '--baseline', dest='baseline',
+        default=os.path.expanduser(os.path.join('~', '.kajongg', 'benchmark.json')),
+        help='compare with the results in FILE', metavar='FILE')
+    parser.add_option(
+        '', '--save', dest='save', action='store_true', default=False,
+        help='save the results as new baseline')
+    parser.add_option(
+        '', '--tolerance', dest='tolerance', type=float, default=20.0,
+        help='allowed regression in percent, default is 20', metavar='PERCENT')
+    parser.add_option(
+        '', '--debug', dest='debug',
+        help=Debug.help())
+    return parser.parse_args()
+
+
+def main():
+    """run the benchmarks"""
+    if OPTIONS.debug:
+        msg = Debug.setOptions(OPTIONS.debug)
+        if msg:
+            print(msg)
+            sys.exit(2)
+    Options.rounds = 1
+    benchmarks = BENCHMARKS
+    if OPTIONS.only:
+        wanted = OPTIONS.only.split(',')
+        benchmarks = list(x for x in BENCHMARKS if x.name in wanted)
+    ruleset = simulator.findRuleset(OPTIONS.ruleset)
+    game = PlayingGame(list(tuple([wind, str(wind.char)]) for wind in Wind.all4), ruleset)
+    player = game.players[0]
+    corpus = Corpus(player, range(1, OPTIONS.games + 1))
+    baselines = dict()
+    if os.path.exists(OPTIONS.baseline):
+        with open(OPTIONS.baseline) as baselineFile:
+            baselines = json.load(baselineFile)
+    print('{} hands, baseline {}'.format(len(corpus.strings), OPTIONS.baseline))
+    print('{:<24} {:>12} {:>10} {:>12} {:>9}'.format(
+        'benchmark', 'operations/s', 'peak KiB', 'baseline', 'change'))
+    results = dict()
+    failures = []
+    for benchmarkClass in benchmarks:
+        benchmark = benchmarkClass(player, corpus)
+        opsPerSecond, peakKiB = measure(benchmark)
+        result = dict(opsPerSecond=opsPerSecond, peakKiB=peakKiB)
+        results[benchmark.name] = result
+        baseline = baselines.get(benchmark.name)
+        if baseline:
+            change = '{:+.1f}%'.format(
+                (opsPerSecond / baseline['opsPerSecond'] - 1) * 100)
+            baseValue = '{:.1f}'.format(baseline['opsPerSecond'])
+        else:
+            change = baseValue = ''
+        print('{:<24} {:>12.1f} {:>10} {:>12} {:>9}'.format(
+            benchmark.name, opsPerSecond, peakKiB, baseValue, change))
+        failures.extend(regressions(benchmark.name, result, baseline))
+    if OPTIONS.save:
+        baselines.update(results)
+        os.makedirs(os.path.dirname(os.path.abspath(OPTIONS.baseline)), exist_ok=True)
+        with open(OPTIONS.baseline, 'w') as baselineFile:
+            json.dump(baselines, baselineFile, indent=1, sort_keys=True)
+        print('saved as baseline')
+    elif failures:
+        print()
+        print('\n'.join(failures))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    OPTIONS, ARGS = parse_options()
+    main()
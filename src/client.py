@@ -22,8 +22,7 @@ import datetime
 import weakref
 
 from twisted.spread import pb
-from twisted.internet.task import deferLater
-from twisted.internet.defer import Deferred, succeed, fail
+from twisted.internet.defer import Deferred, DeferredList, succeed, fail
 from util import Duration
 from log import logDebug, logException, logWarning
 from mi18n import i18nc
@@ -35,6 +34,7 @@ from rule import Ruleset
 from game import PlayingGame
 from query import Query
 from move import Move
+from wire import Wire
 from animation import animate, animateAndDo
 from player import PlayingPlayer
 
@@ -58,6 +58,7 @@ class Table(StrMixin):
         self.playOpen = playOpen
         self.autoPlay = autoPlay
         self.wantedGame = wantedGame
+        self.claimWindow = None
 
     def status(self):
         """a status string"""
@@ -75,6 +76,81 @@ class Table(StrMixin):
         return 'Table({})'.format(self.tableid)
 
 
+class ClaimWindow:
+
+    """a robot wants to chow the last discard. Pung, Kong and Mah Jongg
+    have priority, so it waits until the two other players said they
+    do not claim, until one of them claims, or until the claim timeout
+    is nearly over. It learns about the others from the notifications
+    forwarded by the server, see Client.exec_move"""
+
+    def __init__(self, client, result):
+        self._client = weakref.ref(client)
+        self.result = result
+        self.noClaimCount = 0
+        self.deferred = Deferred()
+        self.timer = None
+        for move in client.game.lastMoves():
+            # latest move first. Notifications may have come
+            # before we decided to chow
+            if move.message == Message.Discard:
+                break
+            self.notified(move)
+        if not self.deferred.called:
+            self.timer = Internal.reactor.callLater(
+                client.game.ruleset.claimTimeout * 0.95, self.__timeout)
+
+    @property
+    def client(self):
+        """hide weakref"""
+        return self._client()
+
+    def notified(self, move):
+        """the server forwarded the answer of another player"""
+        if self.deferred.called or not move.notifying:
+            return
+        game = self.client.game
+        if move.message == Message.NoClaim:
+            self.noClaimCount += 1
+            if self.noClaimCount == 2:
+                if Debug.delayChow:
+                    game.debug('everybody said "I am not interested", so {} claims chow now for {}'.format(
+                        game.myself.name, game.lastDiscard.name()))
+                self.close(self.result)
+        elif move.message in (Message.Pung, Message.Kong, Message.MahJongg):
+            if Debug.delayChow:
+                game.debug('{} said {} so {} suppresses Chow for {}'.format(
+                    move.player, move.message, game.myself, game.lastDiscard.name()).replace('  ', ' '))
+            self.close(Message.NoClaim)
+
+    def __timeout(self):
+        """one of those slow humans is still thinking"""
+        self.timer = None
+        client = self.client
+        game = client.game if client else None
+        if game and Debug.delayChow:
+            game.debug('{} must chow now for {} because timeout is over'.format(
+                game.myself.name, game.lastDiscard.name()))
+        self.close(self.result)
+
+    def close(self, answer):
+        """wake up the waiting claimant"""
+        if self.deferred.called:
+            return
+        if self.timer and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+        client = self.client
+        table = client.table if client else None
+        if table and table.claimWindow is self:
+            table.claimWindow = None
+        self.deferred.callback(answer)
+
+    def cancel(self):
+        """the table or the game is gone, nobody waits for our chow"""
+        self.close(Message.NoClaim)
+
+
 class ClientTable(Table):
 
     """the table as seen by the client"""
@@ -221,6 +297,8 @@ class Client(pb.Referenceable):
         """update table list"""
         table = self._tableById(tableid)
         if table:
+            if table.claimWindow:
+                table.claimWindow.cancel()
             self.tables.remove(table)
 
     def reserveGameId(self, gameid):
@@ -234,9 +312,9 @@ class Client(pb.Referenceable):
         return Message.OK
 
     @staticmethod
-    def __findAI(modules, aiName):
-        """list of all alternative AIs defined in altint.py"""
-        for module in modules:
+    def findAI(aiName):
+        """find the AI class named aiName in intelligence.py or altint.py"""
+        for module in (intelligence, altint):
             for key, value in module.__dict__.items():
                 if key == 'AI' + aiName:
                     return value
@@ -244,7 +322,7 @@ class Client(pb.Referenceable):
     def __assignIntelligence(self):
         """assign intelligence to myself. All players already have default intelligence."""
         if self.isHumanClient():
-            aiClass = self.__findAI([intelligence, altint], Options.AI)
+            aiClass = self.findAI(Options.AI)
             if not aiClass:
                 raise Exception('intelligence %s is undefined' % Options.AI)
             self.game.myself.intelligence = aiClass(self.game.myself)
@@ -296,52 +374,30 @@ class Client(pb.Referenceable):
             self.game.rotateWinds()
         self.game.prepareHand()
 
-    def __delayAnswer(self, result, delay, delayStep):
-        """try again, may we chow now?"""
-        if not self.game:
-            # game has been aborted meanwhile
-            return result
-        noClaimCount = 0
-        delay += delayStep
-        for move in self.game.lastMoves():
-            # latest move first
-            if move.message == Message.Discard:
-                break
-            elif move.message == Message.NoClaim and move.notifying:
-                noClaimCount += 1
-                if noClaimCount == 2:
-                    if Debug.delayChow:
-                        self.game.debug('everybody said "I am not interested", so {} claims chow now for {}'.format(
-                            self.game.myself.name, self.game.lastDiscard.name()))
-                    return result
-            elif move.message in (Message.Pung, Message.Kong, Message.MahJongg) and move.notifying:
-                if Debug.delayChow:
-                    self.game.debug('{} said {} so {} suppresses Chow for {}'.format(
-                        move.player, move.message, self.game.myself, self.game.lastDiscard.name()).replace('  ', ' '))
-                return Message.NoClaim
-        if delay < self.game.ruleset.claimTimeout * 0.95:
-            # one of those slow humans is still thinking
-            return deferLater(Internal.reactor, delayStep, self.__delayAnswer, result, delay, delayStep)
-        if Debug.delayChow:
-            self.game.debug('{} must chow now for {} because timeout is over'.format(
-                self.game.myself.name, self.game.lastDiscard.name()))
-        return result
-
     def ask(self, move, answers):
         """this is where the robot AI should go.
         sends answer and one parameter to server"""
-        delay = 0.0
-        delayStep = 0.1
         myself = self.game.myself
         myself.computeSayable(move, answers)
         result = myself.intelligence.selectAnswer(answers)
-        if result[0] == Message.Chow:
+        if result[0] == Message.Chow and Internal.reactor:
+            # without reactor we are simulating, the server
+            # will still prefer pung and kong
             if Debug.delayChow:
                 self.game.debug('{} waits to see if somebody says Pung or Kong before saying chow for {}'.format(
                     self.game.myself.name, self.game.lastDiscard.name()))
-            return deferLater(Internal.reactor, delayStep, self.__delayAnswer, result, delay, delayStep)
+            window = ClaimWindow(self, result)
+            if not window.deferred.called:
+                self.table.claimWindow = window
+            return window.deferred
         return succeed(result)
 
+    def notifyClaimWindow(self, move):
+        """pass notifications to our open claim window"""
+        table = self.table
+        if table and table.claimWindow and table.claimWindow.client is self:
+            table.claimWindow.notified(move)
+
     def thatWasMe(self, player):
         """returns True if player == myself"""
         if not self.game:
@@ -358,6 +414,30 @@ class Client(pb.Referenceable):
 
     def remote_move(self, playerName, command, *dummyArgs, **kwargs):
         """the server sends us info or a question and always wants us to answer"""
+        return self.__move(playerName, command, kwargs).addCallback(self.__jellyMessage)
+
+    def remote_wireMove(self, playerName, messageId, kwargs, zipped):
+        """like remote_move but with the compact encoding, see wire.py"""
+        command, kwargs = Wire.decodeMove(messageId, kwargs, zipped)
+        return self.__move(playerName, command, kwargs).addCallback(self.__wireAnswer)
+
+    def remote_moves(self, moves):
+        """several compact moves at once, see MoveBatch. Returns all answers"""
+        def firstError(failure):
+            """the failure of the move"""
+            return failure.value.subFailure
+        return DeferredList(
+            list(self.remote_wireMove(*x) for x in moves),
+            fireOnOneErrback=True, consumeErrors=True).addCallbacks(
+                lambda results: list(x[1] for x in results), firstError)
+
+    @staticmethod
+    def __wireAnswer(value):
+        """the compact answer"""
+        return Wire.encodeAnswer(Message.OK if value is None else value)
+
+    def __move(self, playerName, command, kwargs):
+        """execute the move, returns a Deferred with our answer"""
         if Internal.scene and not isAlive(Internal.scene):
             return fail()
         if self.game:
@@ -380,7 +460,7 @@ class Client(pb.Referenceable):
                         'wrong token: %s, we have %s' %
                         (move.token, self.game.handId.token()))
         with Duration('Move %s:' % move):
-            return self.exec_move(move).addCallback(self.__jellyMessage)
+            return self.exec_move(move)
 
     def exec_move(self, move):
         """mirror the move of a player as told by the game server"""
@@ -393,6 +473,8 @@ class Client(pb.Referenceable):
         game = self.game
         if game:
             game.moves.append(move)
+        if move.notifying:
+            self.notifyClaimWindow(move)
         answer = action(self, move)
         if not isinstance(answer, Deferred):
             answer = succeed(answer)
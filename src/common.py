@@ -137,6 +137,7 @@ class Debug:
     process = False
     time = False
     sql = False
+    sqlTime = False
     animation = ''  # 'yeysywynG87gfefsfwfn' for tiles and G#g for groups where # is the uid
     animationSpeed = False
     robotAI = False
@@ -150,6 +151,7 @@ class Debug:
     chat = False
     argString = None
     scores = False
+    fullScore = False
     hand = False
     explain = False
     random = False
@@ -271,6 +273,7 @@ class Options:
     host = None
     player = None
     dbPath = None
+    dbProfile = 'fast'
     socket = None
     port = None
     playOpen = False
@@ -278,6 +281,7 @@ class Options:
     AI = 'Default'
     csv = None
     continueServer = False
+    sharedRobots = False
     fixed = False
 
     def __init__(self):
@@ -316,6 +320,8 @@ class __Internal:
     @type db: L{DBHandle}
     @cvar scene: The QGraphicsScene.
     @type scene: L{PlayingScene} or L{ScoringScene}
+    @cvar workers: The worker processes of the game server.
+    @type workers: L{serverworker.Workers}
     """
     # pylint: disable=too-many-instance-attributes
     Preferences = None
@@ -327,6 +333,7 @@ class __Internal:
     app = None
     db = None
     scene = None
+    workers = None
     mainWindow = None
     game = None
     autoPlay = False
@@ -23,13 +23,15 @@ import datetime
 import weakref
 
 from twisted.spread import pb
+from twisted.python.failure import Failure
 from twisted.internet.defer import Deferred
 
 from log import logInfo, logDebug, logException, id4
 from mi18n import i18nE
 from message import Message
-from common import Debug, StrMixin
+from common import Internal, Debug, StrMixin
 from move import Move
+from wire import Wire
 
 
 class Request(StrMixin):
@@ -82,6 +84,8 @@ class Request(StrMixin):
         else:
             answer = rawAnswer
             self.args = None
+        if getattr(self.user, 'wireVersion', 0):
+            answer = Wire.messageName(answer)
         if answer in Message.defined:
             self.answer = Message.defined[answer]
         else:
@@ -131,6 +135,64 @@ class Request(StrMixin):
         return result
 
 
+class MoveBatch:
+
+    """collects the moves for one user within one reactor iteration
+    and sends them with one remote call. The answers are passed
+    to the Deferred of each move"""
+
+    pending = {}
+
+    def __init__(self, server, user):
+        self.server = server
+        self.user = user
+        self.moves = []
+        self.deferreds = []
+
+    @classmethod
+    def add(cls, server, user, aboutName, command, kwargs):
+        """returns a Deferred for the answer or None if user is gone"""
+        if not user.mind:
+            return None
+        if user.wireVersion < 2 or Internal.reactor is None:
+            return server.callMove(user, aboutName, command, kwargs)
+        batch = cls.pending.get(user)
+        if batch is None:
+            batch = cls.pending[user] = cls(server, user)
+            Internal.reactor.callLater(0, batch.send)
+        batch.moves.append((aboutName, command, kwargs))
+        result = Deferred()
+        batch.deferreds.append(result)
+        return result
+
+    def send(self):
+        """the reactor did all other work, now send"""
+        del MoveBatch.pending[self.user]
+        if len(self.moves) == 1:
+            aboutName, command, kwargs = self.moves[0]
+            result = self.server.callMove(self.user, aboutName, command, kwargs)
+        else:
+            if Debug.traffic:
+                logDebug('-> {:<15} {} moves at once'.format(self.user.name[:15], len(self.moves)))
+            result = self.server.callMoves(self.user, self.moves)
+        if result is None:
+            self.failed(Failure(pb.PBConnectionLost()))
+        else:
+            result.addCallbacks(self.answered, self.failed)
+
+    def answered(self, answers):
+        """demultiplex"""
+        if len(self.moves) == 1 or answers is None:
+            answers = [answers] * len(self.deferreds)
+        for deferred, answer in zip(self.deferreds, answers):
+            deferred.callback(answer)
+
+    def failed(self, result):
+        """all moves failed"""
+        for deferred in self.deferreds:
+            deferred.errback(result)
+
+
 class DeferredBlock(StrMixin):
 
     """holds a list of deferreds and waits for each of them individually,
@@ -340,7 +402,11 @@ class DeferredBlock(StrMixin):
                     '{answers} {method}'.format(method=methodName,
                                                 answers=' / '.join(commandText)))
             if self.callbackMethod is not False:
-                self.callbackMethod(self.requests, *self.__callbackArgs)
+                pending = self.table.pendingCallbacks
+                if pending is not None:
+                    pending.append((self.callbackMethod, self.requests, self.__callbackArgs))
+                else:
+                    self.callbackMethod(self.requests, *self.__callbackArgs)
 
     def prettyCallback(self):
         """pretty string for callbackMethod"""
@@ -370,7 +436,7 @@ class DeferredBlock(StrMixin):
         if command.sendScore and about:
             # the clients will compare our status with theirs. This helps
             # very much in finding bugs.
-            kwargs['score'] = str(about.hand)
+            kwargs['score'] = str(about.hand) if Debug.fullScore else about.hand.digest
         if game and game.gameid and 'token' not in kwargs:
             # this lets the client assert that the message is meant for the
             # current hand
@@ -381,7 +447,7 @@ class DeferredBlock(StrMixin):
     def __convertReceivers(self, receivers):
         """try to convert Player to User or Client where possible"""
         for rec in receivers:
-            if rec.__class__.__name__ == 'User':
+            if rec.__class__.__name__.endswith('User'):
                 yield rec
             else:
                 yield self.table.remotes[rec]
@@ -396,7 +462,7 @@ class DeferredBlock(StrMixin):
                     if kwargs[keyword] is not None:
                         kwargs[keyword] = str(kwargs[keyword])
         encodeKwargs()
-        if about.__class__.__name__ == 'User':
+        if about.__class__.__name__.endswith('User'):
             about = self.playerForUser(about)
         if not isinstance(receivers, list):
             receivers = list([receivers])
@@ -420,12 +486,7 @@ class DeferredBlock(StrMixin):
                 defer = Deferred()
                 defer.addCallback(rec.remote_move, command, **kwargs)
             else:
-                defer = self.table.server.callRemote(
-                    rec,
-                    'move',
-                    aboutName,
-                    command.name,
-                    **kwargs)
+                defer = MoveBatch.add(self.table.server, rec, aboutName, command, kwargs)
             if defer:
                 defer.command = command.name
                 defer.notifying = 'notifying' in kwargs
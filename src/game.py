@@ -33,7 +33,7 @@ from log import logError, logWarning, logException, logDebug, i18n
 from common import Internal, IntDict, Debug, Options
 from common import StrMixin, Speeds
 from wind import Wind, East
-from query import Query
+from query import Query, WriteBehind
 from rule import Ruleset
 from tile import Tile, elements
 from sound import Voice
@@ -195,6 +195,18 @@ class Game:
     playerClass = Player
     wallClass = Wall
 
+    # a worker of the game server may only pass those changes
+    # to the front end, see serverworker.py
+    scoreStatement = (
+        "INSERT INTO SCORE "
+        "(game,hand,data,manualrules,player,scoretime,won,prevailing,"
+        "wind,points,payments,balance,rotated,notrotated) "
+        "VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?)")
+    startTimeStatement = (
+        "update game set starttime=?,seed=?,autoplay=?,"
+        "ruleset=?,p0=?,p1=?,p2=?,p3=? where id=?")
+    endTimeStatement = 'UPDATE game set endtime = ? where id = ?'
+
     def __init__(self, names, ruleset, gameid=None,
                  wantedGame=None, client=None):
         """a new game instance. May be shown on a field, comes from database
@@ -237,6 +249,7 @@ class Game:
         # tile names are always lowercase
         self.dangerousTiles = list()
         self.csvTags = []
+        self.eastMJCounts = IntDict()  # (player name, round wind char)
         self.randomGenerator = CountingRandom(self)
         self._setHandSeed()
         self.activePlayer = None
@@ -464,8 +477,7 @@ class Game:
                      self.ruleset.rulesetId])
         args.extend([p.nameid for p in self.players])
         args.append(self.gameid)
-        Query("update game set starttime=?,seed=?,autoplay=?,"
-              "ruleset=?,p0=?,p1=?,p2=?,p3=? where id=?", tuple(args))
+        Query(Game.startTimeStatement, tuple(args), mayDelay=True)
 
     def __useRuleset(self, ruleset):
         """use a copy of ruleset for this game, reusing an existing copy"""
@@ -524,6 +536,8 @@ class Game:
         update score table and balance in status line"""
         self.__payHand()
         self._saveScores()
+        if self.__winner and self.__winner.wind is East:
+            self.eastMJCounts[(self.__winner.name, self.roundWind.char)] += 1
         self.handctr += 1
         self.notRotated += 1
         self.roundHandCount += 1
@@ -534,33 +548,41 @@ class Game:
         update score table and balance in status line"""
         scoretime = datetime.datetime.now().replace(microsecond=0).isoformat()
         logMessage = ''
+        rows = []
         for player in self.players:
             if player.hand:
                 manualrules = '||'.join(x.rule.name
                                         for x in player.hand.usedRules)
             else:
                 manualrules = i18n('Score computed manually')
-            Query(
-                "INSERT INTO SCORE "
-                "(game,hand,data,manualrules,player,scoretime,won,prevailing,"
-                "wind,points,payments, balance,rotated,notrotated) "
-                "VALUES(%d,%d,?,?,%d,'%s',%d,'%s','%s',%d,%d,%d,%d,%d)" %
-                (self.gameid, self.handctr, player.nameid,
-                 scoretime, int(player == self.__winner),
-                 self.roundWind.char, player.wind,
-                 player.handTotal, player.payment, player.balance,
-                 self.rotated, self.notRotated),
-                (player.hand.string, manualrules))
+            rows.append((
+                self.gameid, self.handctr, player.hand.string, manualrules,
+                player.nameid, scoretime, int(player == self.__winner),
+                self.roundWind.char, str(player.wind),
+                player.handTotal, player.payment, player.balance,
+                self.rotated, self.notRotated))
             logMessage += '{player:<12} {hand:>4} {total:>5} {won} | '.format(
                 player=str(player)[:12], hand=player.handTotal,
                 total=player.balance,
                 won='WON' if player == self.winner else '   ')
+        WriteBehind.add(Game.scoreStatement, rows).addErrback(
+            self._scoresNotSaved, self.handctr)
+        self._tagLimitHands()
+        if Debug.scores:
+            self.debug(logMessage)
+
+    def _scoresNotSaved(self, result, handctr):
+        """errback for WriteBehind: we lost the scores of this hand"""
+        logError('game {} hand {}: scores not saved: {}'.format(
+            self.gameid, handctr, result.getErrorMessage()))
+
+    def _tagLimitHands(self):
+        """limit hands go into the csv tags"""
+        for player in self.players:
             for usedRule in player.hand.usedRules:
                 rule = usedRule.rule
                 if rule.score.limits:
                     self.addCsvTag(rule.name.replace(' ', ''))
-        if Debug.scores:
-            self.debug(logMessage)
 
     def maybeRotateWinds(self):
         """rules which make winds rotate"""
@@ -582,12 +604,10 @@ class Game:
             self.rotated = 0
             self.roundHandCount = 0
         if self.finished():
-            endtime = datetime.datetime.now().replace(
-                microsecond=0).isoformat()
-            with Internal.db as transaction:
-                transaction.execute(
-                    'UPDATE game set endtime = "%s" where id = %d' %
-                    (endtime, self.gameid))
+            if Internal.db:
+                endtime = datetime.datetime.now().replace(
+                    microsecond=0).isoformat()
+                Query(Game.endTimeStatement, (endtime, self.gameid), mayDelay=True)
         elif not self.belongsToPlayer():
             # the game server already told us the new placement and winds
             winds = [player.wind for player in self.players]
@@ -816,25 +836,30 @@ class PlayingGame(Game):
                 if Debug.sound:
                     logDebug('myself %s gets no voice' % (myself.name))
 
-    def writeCsv(self):
-        """write game summary to Options.csv"""
-        if self.finished() and Options.csv:
-            gameWinner = max(self.players, key=lambda x: x.balance)
-            writer = CsvWriter(Options.csv, mode='a')
-            if Debug.process and os.name != 'nt':
-                self.csvTags.append('MEM:%s' % resource.getrusage(
-                    resource.RUSAGE_SELF).ru_maxrss)
-            if Options.rounds:
-                self.csvTags.append('ROUNDS:%s' % Options.rounds)
-            row = [self.ruleset.name, Options.AI,
-                   gitHead(), '3',
-                   str(self.seed), ','.join(self.csvTags)]
-            for player in sorted(self.players, key=lambda x: x.name):
-                row.append(player.name)
-                row.append(player.balance)
-                row.append(player.wonCount)
-                row.append(1 if player == gameWinner else 0)
-            writer.writerow(row)
+    def csvRow(self):
+        """the game summary as written by writeCsv"""
+        gameWinner = max(self.players, key=lambda x: x.balance)
+        if Debug.process and os.name != 'nt':
+            self.csvTags.append('MEM:%s' % resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss)
+        if Options.rounds:
+            self.csvTags.append('ROUNDS:%s' % Options.rounds)
+        row = [self.ruleset.name, Options.AI,
+               gitHead(), '3',
+               str(self.seed), ','.join(self.csvTags)]
+        for player in sorted(self.players, key=lambda x: x.name):
+            row.append(player.name)
+            row.append(player.balance)
+            row.append(player.wonCount)
+            row.append(1 if player == gameWinner else 0)
+        return row
+
+    def writeCsv(self, csvName=None):
+        """write game summary to csvName, default is Options.csv"""
+        csvName = csvName or Options.csv
+        if self.finished() and csvName:
+            writer = CsvWriter(csvName, mode='a')
+            writer.writerow(self.csvRow())
             del writer
 
     def close(self):
@@ -29,7 +29,7 @@ from dialogs import WarningYesNo
 from kde import KIcon
 from mi18n import i18n, i18nc
 from log import logException
-from query import Query
+from query import Query, QueryStream
 from guiutil import MJTableView, decorateWindow
 from statesaver import StateSaver
 from common import Debug
@@ -43,6 +43,7 @@ class GamesModel(QAbstractTableModel):
     def __init__(self):
         QAbstractTableModel.__init__(self)
         self._resultRows = []
+        self._stream = None
 
     def columnCount(self, dummyParent=None):   # pylint: disable=no-self-use
         """including the hidden col 0"""
@@ -55,14 +56,35 @@ class GamesModel(QAbstractTableModel):
             return 0
         return len(self._resultRows)
 
-    def setResultset(self, rows):
-        """new data"""
+    def setResultset(self, stream):
+        """new data. The rows are read page by page when the view needs them"""
         self.beginResetModel()
         try:
-            self._resultRows = rows
+            if self._stream:
+                self._stream.close()
+            self._stream = stream
+            self._resultRows = stream.fetch()
         finally:
             self.endResetModel()
 
+    def canFetchMore(self, parent=None):
+        """are there more games in the data base?"""
+        if parent and parent.isValid():
+            return False
+        return bool(self._stream) and not self._stream.exhausted
+
+    def fetchMore(self, parent=None):
+        """read the next page"""
+        if not self.canFetchMore(parent):
+            return
+        rows = self._stream.fetch()
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self._resultRows), len(self._resultRows) + len(rows) - 1)
+            try:
+                self._resultRows.extend(rows)
+            finally:
+                self.endInsertRows()
+
     def index(self, row, column, parent=None):
         """helper"""
         if (row < 0
@@ -183,7 +205,7 @@ class Games(QDialog):
 
     def setQuery(self):
         """define the query depending on self.OnlyPending"""
-        query = Query(
+        self.model.setResultset(QueryStream(
             "select g.id, g.starttime, "
             "p0.name||'///'||p1.name||'///'||p2.name||'///'||p3.name "
             "from game g, player p0,"
@@ -192,18 +214,23 @@ class Games(QDialog):
             " and p0.id=g.p0 and p1.id=g.p1 "
             " and p2.id=g.p2 and p3.id=g.p3 "
             "%s"
-            "and exists(select 1 from score where game=g.id)" %
-            ("and g.endtime is null " if self.onlyPending else ""))
-        self.model.setResultset(query.records)
+            "and exists(select 1 from score where game=g.id) "
+            "order by g.id" %
+            ("and g.endtime is null " if self.onlyPending else "")))
         self.view.hideColumn(0)
 
     def __idxForGame(self, game):
         """returns the model index for game"""
-        for row in range(self.model.rowCount()):
-            idx = self.model.index(row, 0)
-            if self.model.data(idx, 0) == game:
-                return idx
-        return self.model.index(0, 0)
+        row = 0
+        while True:
+            for row in range(row, self.model.rowCount()):
+                idx = self.model.index(row, 0)
+                if self.model.data(idx, 0) == game:
+                    return idx
+            if not self.model.canFetchMore():
+                return self.model.index(0, 0)
+            row = self.model.rowCount()
+            self.model.fetchMore()
 
     def __getSelectedGame(self):
         """returns the game id of the selected game"""
@@ -22,6 +22,8 @@ Read the user manual for a description of the interface to this scoring engine
 """
 
 from itertools import chain
+from collections import OrderedDict
+import bisect
 import weakref
 from hashlib import md5
 
@@ -36,6 +38,99 @@ from util import callers
 from message import Message
 
 
+class HandCache:
+
+    """A process wide cache for evaluated hands, shared by all players
+    and games. Hand objects themselves stay per player, but the expensive
+    part - arranging the melds, finding the mjRule and applying all
+    rules - is only done once for every hand state.
+
+    The key combines everything the evaluation depends on, see
+    Hand.cacheKey. This includes what rules like EastWonNineTimesInARow
+    look at in the game, see RuleCode.gameState. The cache holds at
+    most maxSize entries, the least recently used entries are dropped
+    first."""
+
+    maxSize = 20000
+    entries = OrderedDict()
+    hits = 0
+    misses = 0
+
+    def __init__(self):
+        raise Exception('HandCache is not meant to be instantiated')
+
+    @classmethod
+    def get(cls, key):
+        """returns the entry for key or None"""
+        result = cls.entries.get(key)
+        if result is None:
+            cls.misses += 1
+        else:
+            cls.hits += 1
+            cls.entries.move_to_end(key)
+        return result
+
+    @classmethod
+    def put(cls, key, entry):
+        """add entry, drop the oldest entries if we are too big"""
+        cls.entries[key] = entry
+        while len(cls.entries) > cls.maxSize:
+            cls.entries.popitem(last=False)
+
+    @classmethod
+    def clear(cls):
+        """clears the cache and its statistics"""
+        cls.entries.clear()
+        cls.hits = 0
+        cls.misses = 0
+
+    @classmethod
+    def stats(cls):
+        """hits and misses as a string"""
+        return 'hand cache: %d entries, hits:%d misses:%d' % (
+            len(cls.entries), cls.hits, cls.misses)
+
+
+class HandParts:
+
+    """The tiles of a hand as Hand.__parseString would find them in
+    the hand string: melds, the rearrangeable rest and bonus tiles.
+    lastSource, announcements, lastTile and lastMeld are not included.
+
+    Player keeps one of those and applies added and removed tiles
+    to it, so it does not have to build a hand string and parse it
+    again after every single tile. Hand copies what it needs."""
+
+    def __init__(self, melds=None, rest=None, bonusTiles=None):
+        self.melds = MeldList(melds)
+        self.rest = TileList(rest).sorted()
+        self.bonusMelds = MeldList(x.single for x in bonusTiles or [])
+        self.tiles = TileList(chain(chain.from_iterable(self.melds), self.rest)).sorted()
+        self.declaredMelds = MeldList(x for x in self.melds if x.isDeclared)
+        self.declaredTiles = set(chain.from_iterable(self.declaredMelds))
+        self.tilesInHand = TileList(x for x in self.tiles if x not in self.declaredTiles)
+
+    def add(self, tile):
+        """tile goes to the rest"""
+        if tile.isBonus:
+            self.bonusMelds.append(tile.single)
+            return
+        bisect.insort(self.rest, tile)
+        bisect.insort(self.tiles, tile)
+        if tile not in self.declaredTiles:
+            bisect.insort(self.tilesInHand, tile)
+
+    def remove(self, tile):
+        """tile leaves the rest"""
+        if tile.isBonus:
+            self.bonusMelds.remove(tile.single)
+            return
+        self.rest.remove(tile)
+        self.tiles.remove(tile)
+        if tile not in self.declaredTiles:
+            self.tilesInHand.remove(tile)
+
+
 class Hand(StrMixin):
 
     """represent the hand to be evaluated.
@@ -69,26 +164,35 @@ class Hand(StrMixin):
     # pylint: disable=too-many-instance-attributes
 
     indent = 0
+
+    # a Hand is evaluated in stages, each one only when something
+    # needs it: parsing the string, arranging the rest into melds,
+    # applying the rules. The counts tell how often they really ran
+    __stageParsed, __stageArranged, __stageScored = range(1, 4)
+    parseCount = 0
+    arrangeCount = 0
+    scoreCount = 0
+
     class __NotWon(UserWarning):  # pylint: disable=invalid-name
 
         """should be won but is not a winning hand"""
 
-    def __new__(cls, player, string, prevHand=None):
+    def __new__(cls, player, string, prevHand=None, parts=None):
         # pylint: disable=unused-argument
         """since a Hand instance is never changed, we can use a cache"""
         cache = player.handCache
         cacheKey = string
         if cacheKey in cache:
-            result = cache[cacheKey]
-            player.cacheHits += 1
-            return result
-        player.cacheMisses += 1
+            return cache[cacheKey]
         result = object.__new__(cls)
         cache[cacheKey] = result
         return result
 
-    def __init__(self, player, string, prevHand=None):
-        """evaluate string for player. rules are to be applied in any case"""
+    def __init__(self, player, string, prevHand=None, parts=None):
+        """parse string for player. Arranging and applying the rules
+        wait until somebody asks for the result, see __evaluate.
+        parts may hold the tiles of string as HandParts, saving the
+        parsing of its tiles"""
         if hasattr(self, 'string'):
             # I am from cache
             return
@@ -111,38 +215,124 @@ class Hand(StrMixin):
         self.__lastMeld = 0
         self.__lastMelds = MeldList()
         self.tiles = None
-        self.melds = MeldList()
+        self.__melds = MeldList()
         self.bonusMelds = MeldList()
-        self.usedRules = []
+        self.__usedRules = []
         self.__rest = TileList()
         self.__arranged = None
 
-        self.__parseString(string)
+        self.__stage = Hand.__stageParsed
+        # no evaluation while we do not even know the tiles
+        self.__evaluating = True
+        self.__parseString(string, parts)
+        self.__evaluating = False
+        Hand.parseCount += 1
         self.__won = self.lenOffset == 1 and player.mayWin
 
+        self.__cacheKey = self.cacheKey()
+        entry = HandCache.get(self.__cacheKey)
+        if entry is not None:
+            self.__restore(entry)
+            self.__stage = Hand.__stageScored
+            self._fixed = True
+
+    def __evaluate(self, stage):
+        """run the stages up to stage which did not yet run. A stage
+        asking for a later one while it runs gets what there is now"""
+        if self.__stage >= stage or self.__evaluating:
+            return
+        self.__evaluating = True
+        try:
+            if self.__stage < Hand.__stageArranged:
+                self.__stage = Hand.__stageArranged
+                self.__arrangeStage()
+            if stage == Hand.__stageScored and self.__stage < Hand.__stageScored:
+                self.__stage = Hand.__stageScored
+                self.__scoreStage()
+        finally:
+            self.__evaluating = False
+
+    def __arrangeStage(self):
+        """find the best melds for the rest"""
+        Hand.arrangeCount += 1
         if Debug.hand or (Debug.mahJongg and self.lenOffset == 1):
             self.debug(fmt('{callers}',
-                           callers=callers(exclude=['__init__'])))
+                           callers=callers(exclude=['__init__', '__evaluate', '__arrangeStage'])))
             Hand.indent += 1
-            self.debug('New Hand {} {}'.format(string, self.lenOffset))
-
+            self.debug('New Hand {} {}'.format(self.string, self.lenOffset))
         try:
             self.__arrange()
-            self.__calculate()
-            self.__arranged = True
         except Hand.__NotWon as notwon:
-            if Debug.mahJongg:
-                self.debug(fmt(str(notwon)))
-            self.__won = False
-            self.__score = Score()
+            self.__notWon(notwon)
+        finally:
+            Hand.indent -= 1
+
+    def __scoreStage(self):
+        """apply the rules and compute the score"""
+        try:
+            if self.__score is None:
+                # __arrange did not say NotWon
+                Hand.scoreCount += 1
+                self.__calculate()
+                self.__arranged = True
+        except Hand.__NotWon as notwon:
+            self.__notWon(notwon)
         finally:
             self._fixed = True
             if Debug.hand or (Debug.mahJongg and self.lenOffset == 1):
                 self.debug('Fixing {} {} {}'.format(self, self.won, self.score))
-            Hand.indent -= 1
-
-    def __parseString(self, inString):
-        """parse the string passed to Hand()"""
+        HandCache.put(self.__cacheKey, self.__entry())
+
+    def __notWon(self, notwon):
+        """should be won but is not"""
+        if Debug.mahJongg:
+            self.debug(fmt(str(notwon)))
+        self.__won = False
+        self.__score = Score()
+
+    @classmethod
+    def stageStats(cls):
+        """how often the stages ran, as a string"""
+        return 'hand stages: parsed:%d arranged:%d scored:%d' % (
+            cls.parseCount, cls.arrangeCount, cls.scoreCount)
+
+    def cacheKey(self):
+        """everything the evaluation of this hand depends on. Used
+        as key for HandCache"""
+        player = self.player
+        game = player.game
+        return (self.string, self.ruleset.hash, player.wind, game.roundWind,
+                player.mayWin, self.robbedTile, self.intelligence.__class__,
+                self.ruleset.plan.gameState(game))
+
+    def __entry(self):
+        """the evaluated state of this hand for HandCache. Score is
+        mutable, so we save its parts. Every game has its own copy of
+        the ruleset, so we save rule names"""
+        score = self.__score
+        return (
+            MeldList(self.__melds), self.__mjRule.name if self.__mjRule else None,
+            self.__won, self.__arranged,
+            (score.points, score.doubles, score.limits) if score is not None else None,
+            tuple((x.rule.name, x.meld) for x in self.__usedRules),
+            self.__lastMeld, self.__lastMelds)
+
+    def __restore(self, entry):
+        """take over the evaluated state from HandCache"""
+        (melds, mjRuleName, self.__won, self.__arranged,
+         score, usedRules, self.__lastMeld, self.__lastMelds) = entry
+        rules = self.ruleset.plan.rulesByName
+        self.__melds = MeldList(melds)
+        self.__rest = TileList()
+        self.__mjRule = rules[mjRuleName] if mjRuleName else None
+        if score is not None:
+            self.__score = Score(*score, ruleset=self.ruleset)
+        self.__usedRules = list(UsedRule(rules[name], meld) for name, meld in usedRules)
+
+    def __parseString(self, inString, parts=None):
+        """parse the string passed to Hand(). If parts are given,
+        only lastSource, announcements and lastTile are parsed, the
+        tiles are taken from parts"""
         # pylint: disable=too-many-branches
         tileStrings = []
         for part in inString.split():
@@ -162,31 +352,32 @@ class Hand(StrMixin):
                 if len(part) > 3:
                     self.__lastMeld = Meld(part[3:])
                 self.__lastTile = Tile(part[1:3])
-            else:
+            elif parts is None:
                 if part != 'R':
                     tileStrings.append(part)
-        self.bonusMelds, tileStrings = self.__separateBonusMelds(tileStrings)
-        tileString = ' '.join(tileStrings)
-        self.tiles = TileList(tileString.replace(' ', '').replace('R', ''))
-        self.tiles.sort()
-        for part in tileStrings[:]:
-            if part[:1] != 'R':
-                self.melds.append(Meld(part))
-                tileStrings.remove(part)
-
+        if parts is None:
+            bonusMelds, tileStrings = self.__separateBonusMelds(tileStrings)
+            restStrings = list(x for x in tileStrings if x[:1] == 'R')
+            assert len(restStrings) < 2, restStrings
+            parts = HandParts(
+                melds=(Meld(x) for x in tileStrings if x[:1] != 'R'),
+                rest=TileList(restStrings[0][1:]) if restStrings else None,
+                bonusTiles=(x[0] for x in bonusMelds))
+        self.__melds = MeldList(parts.melds)
+        self.bonusMelds = MeldList(parts.bonusMelds)
+        self.tiles = TileList(parts.tiles)
+        self.declaredMelds = MeldList(parts.declaredMelds)
+        self.tilesInHand = TileList(parts.tilesInHand)
+        self.__rest = TileList(parts.rest)
         self.values = tuple(x.value for x in self.tiles)
         self.suits = set(x.lowerGroup for x in self.tiles)
-        self.declaredMelds = MeldList(x for x in self.melds if x.isDeclared)
-        declaredTiles = list(sum((x for x in self.declaredMelds), []))
-        self.tilesInHand = TileList(x for x in self.tiles
-                                    if x not in declaredTiles)
+        # the flags all tiles have and the flags any tile has, see Tile.flags
+        self.allFlags, self.anyFlags = -1, 0
+        for key in (x.key for x in self.tiles):
+            self.allFlags &= Tile.flags[key]
+            self.anyFlags |= Tile.flags[key]
         self.lenOffset = (len(self.tiles) - 13
-                          - sum(x.isKong for x in self.melds))
-
-        assert len(tileStrings) < 2, tileStrings
-        self.__rest = TileList()
-        if len(tileStrings):
-            self.__rest.extend(TileList(tileStrings[0][1:]))
+                          - sum(x.isKong for x in self.__melds))
 
         last = self.__lastTile
         if last and not last.isBonus:
@@ -199,11 +390,34 @@ class Hand(StrMixin):
                         'lastTile %s more than once in %s' % (
                             last, ' '.join(self.tiles)))
 
+    def allTilesAre(self, flag):
+        """flag is a Tile attribute like isHonor"""
+        return bool(self.allFlags & Tile.flagBit[flag])
+
+    def anyTileIs(self, flag):
+        """flag is a Tile attribute like isHonor"""
+        return bool(self.anyFlags & Tile.flagBit[flag])
+
     @property
     def arranged(self):
         """readonly"""
+        self.__evaluate(Hand.__stageScored)
         return self.__arranged
 
+    @property
+    def melds(self):
+        """the rest is arranged into melds first"""
+        if self.__stage < Hand.__stageArranged:
+            self.__evaluate(Hand.__stageArranged)
+        return self.__melds
+
+    @property
+    def usedRules(self):
+        """the rules are applied first"""
+        if self.__stage < Hand.__stageScored:
+            self.__evaluate(Hand.__stageScored)
+        return self.__usedRules
+
     @property
     def player(self):
         """weakref"""
@@ -243,6 +457,8 @@ class Hand(StrMixin):
     @property
     def mjRule(self):
         """getter"""
+        if self.__stage < Hand.__stageScored:
+            self.__evaluate(Hand.__stageScored)
         return self.__mjRule
 
     @mjRule.setter
@@ -270,6 +486,8 @@ class Hand(StrMixin):
     @property
     def score(self):
         """calculate it first if not yet done"""
+        if self.__stage < Hand.__stageScored:
+            self.__evaluate(Hand.__stageScored)
         if self.__score is None and self.__arranged is not None:
             self.__score = Score()
             self.__calculate()
@@ -278,6 +496,8 @@ class Hand(StrMixin):
     @property
     def lastMeld(self):
         """compute and cache, readonly"""
+        if self.__stage < Hand.__stageScored:
+            self.__evaluate(Hand.__stageScored)
         if self.__lastMeld == 0:
             self.__setLastMeld()
         return self.__lastMeld
@@ -285,13 +505,18 @@ class Hand(StrMixin):
     @property
     def lastMelds(self):
         """compute and cache, readonly"""
+        if self.__stage < Hand.__stageScored:
+            self.__evaluate(Hand.__stageScored)
         if self.__lastMeld == 0:
             self.__setLastMeld()
         return self.__lastMelds
 
     @property
     def won(self):
-        """do we really have a winner hand?"""
+        """do we really have a winner hand? Only a hand which
+        might win must be evaluated for this"""
+        if self.__won and self.__stage < Hand.__stageScored:
+            self.__evaluate(Hand.__stageScored)
         return self.__won
 
     def debug(self, msg):
@@ -304,12 +529,14 @@ class Hand(StrMixin):
 
     def __applyRules(self):
         """find out which rules apply, collect in self.usedRules"""
-        self.usedRules = []
-        for meld in chain(self.melds, self.bonusMelds):
-            self.usedRules.extend(UsedRule(x, meld) for x in meld.rules(self))
-        for rule in self.ruleset.handRules:
+        self.__usedRules = []
+        plan = self.ruleset.plan
+        features = plan.features(self)
+        for meld in chain(self.__melds, self.bonusMelds):
+            self.__usedRules.extend(UsedRule(x, meld) for x in meld.rules(self))
+        for rule in plan.rules('handRules', features):
             if rule.appliesToHand(self):
-                self.usedRules.append(UsedRule(rule))
+                self.__usedRules.append(UsedRule(rule))
 
         self.__score = self.__totalScore()
 
@@ -323,30 +550,37 @@ class Hand(StrMixin):
                 self.__score = Score()
                 raise Hand.__NotWon('no matching MJ Rule')
             self.__mjRule = matchingMJRules[0]
-            self.usedRules.append(UsedRule(self.__mjRule))
-            self.usedRules.extend(self.matchingWinnerRules())
+            self.__usedRules.append(UsedRule(self.__mjRule))
+            self.__usedRules.extend(self.__matchingWinnerRules(plan.rules('winnerRules', features)))
             self.__score = self.__totalScore()
         else:  # not self.won
-            loserRules = self.__matchingRules(self.ruleset.loserRules)
+            loserRules = self.__matchingRules(plan.rules('loserRules', features))
             if loserRules:
-                self.usedRules.extend(list(UsedRule(x) for x in loserRules))
+                self.__usedRules.extend(list(UsedRule(x) for x in loserRules))
                 self.__score = self.__totalScore()
         self.__checkHasExclusiveRules()
 
     def matchingWinnerRules(self):
         """returns a list of matching winner rules"""
+        plan = self.ruleset.plan
+        return self.__matchingWinnerRules(plan.rules('winnerRules', plan.features(self)))
+
+    def __matchingWinnerRules(self, candidates):
+        """the matching rules out of candidates, or only the highest limit rule"""
         matching = list(
             UsedRule(x)
-            for x in self.__matchingRules(self.ruleset.winnerRules))
+            for x in self.__matchingRules(candidates))
         limitRule = self.maxLimitRule(matching)
         return [limitRule] if limitRule else matching
 
     def __checkHasExclusiveRules(self):
         """if we have one, remove all others"""
-        exclusive = list(x for x in self.usedRules
+        if not self.ruleset.plan.hasExclusiveRules:
+            return
+        exclusive = list(x for x in self.__usedRules
                          if 'absolute' in x.rule.options)
         if exclusive:
-            self.usedRules = exclusive
+            self.__usedRules = exclusive
             self.__score = self.__totalScore()
             if self.__won and not bool(self.__maybeMahjongg()):
                 raise Hand.__NotWon(fmt('exclusive rule {exclusive} does not win'))
@@ -377,7 +611,7 @@ class Hand(StrMixin):
         assert len(self.lastMelds) > 1
         totals = []
         prev = self.lastMeld
-        for rule in self.usedRules:
+        for rule in self.__usedRules:
             assert isinstance(rule, UsedRule)
         for lastMeld in self.lastMelds:
             self.__lastMeld = lastMeld
@@ -409,11 +643,20 @@ class Hand(StrMixin):
                 (self.player.tileAvailable(completedHand.lastTile, self)))
         return result
 
+    def missingTiles(self):
+        """how many tiles are missing for the nearest Mah Jongg form,
+        see TileCounts. None if we do not know all tiles"""
+        result = list(x.missingTiles(self) for x in self.ruleset.mjRules)
+        result = list(x for x in result if x is not None)
+        return min(result) if result else None
+
     def newString(self, melds=1, rest=1, lastSource=1, announcements=1, lastTile=1, lastMeld=1):
         """create string representing a hand. Default is current Hand, but every part
         can be overridden or excluded by passing None"""
+        if melds == 1 or rest == 1 or lastMeld == 1:
+            self.__evaluate(Hand.__stageScored)
         if melds == 1:
-            melds = chain(self.melds, self.bonusMelds)
+            melds = chain(self.__melds, self.bonusMelds)
         if rest == 1:
             rest = self.__rest
         if lastSource == 1:
@@ -424,9 +667,9 @@ class Hand(StrMixin):
             lastTile = self.lastTile
         if lastMeld == 1:
             lastMeld = self.__lastMeld
-        parts = list(str(x) for x in sorted(melds))
+        parts = list(str(x) for x in sorted(melds, key=MeldList.order))
         if rest:
-            parts.append('R' + ''.join(str(x) for x in sorted(rest)))
+            parts.append('R' + ''.join(str(x) for x in sorted(rest, key=TileList.order)))
         if lastSource or announcements:
             parts.append('m{}{}'.format(
                 self.lastSource.char,
@@ -437,18 +680,7 @@ class Hand(StrMixin):
 
     def __add__(self, addTile):
         """returns a new Hand built from this one plus addTile"""
-        assert addTile.isConcealed, 'addTile %s should be concealed:' % addTile
-        # combine all parts about hidden tiles plus the new one to one part
-        # because something like DrDrS8S9 plus S7 will have to be reordered
-        # anyway
-        newString = self.newString(
-            melds=chain(self.declaredMelds, self.bonusMelds),
-            rest=self.tilesInHand + [addTile],
-            lastSource=None,
-            lastTile=addTile,
-            lastMeld=None
-            )
-        return Hand(self.player, newString, prevHand=self)
+        return self.handsPlus([addTile])[addTile]
 
     def __sub__(self, subtractTile):
         """returns a copy of self minus subtractTiles.
@@ -489,7 +721,36 @@ class Hand(StrMixin):
         rest = 'R' + str(tilesInHand)
         newString = ' '.join(str(x) for x in (
             declaredMelds, rest, boni, mjPart))
-        return Hand(self.player, newString, prevHand=self)
+        parts = HandParts(declaredMelds, tilesInHand, (x[0] for x in boni))
+        return Hand(self.player, newString, prevHand=self, parts=parts)
+
+    def handsPlus(self, tiles):
+        """what if we got one more tile: returns a dict with a new Hand
+        for every tile in tiles. They share the tiles of this hand, so
+        their strings are not parsed again. Like every Hand, they are only
+        arranged and scored when won, score, mjRule etc. are asked for"""
+        # combine all parts about hidden tiles plus the new one to one part
+        # because something like DrDrS8S9 plus S7 will have to be reordered
+        # anyway
+        melds = sorted(chain(self.declaredMelds, self.bonusMelds), key=MeldList.order)
+        parts = HandParts(
+            (x for x in melds if not x.isBonus), self.tilesInHand,
+            (x[0] for x in melds if x.isBonus))
+        result = {}
+        for tile in tiles:
+            assert tile.isConcealed, 'addTile %s should be concealed:' % tile
+            newString = self.newString(
+                melds=melds, rest=self.tilesInHand + [tile],
+                lastSource=None, lastTile=tile, lastMeld=None)
+            parts.add(tile)
+            result[tile] = Hand(self.player, newString, prevHand=self, parts=parts)
+            parts.remove(tile)
+        return result
+
+    def handsMinus(self, tiles):
+        """what if we lose one tile: returns a dict with a new Hand
+        for every tile in tiles, see __sub__ and handsPlus"""
+        return dict((x, self - x) for x in tiles)
 
     def manualRuleMayApply(self, rule):
         """returns True if rule has selectable() and applies to this hand"""
@@ -525,10 +786,9 @@ class Hand(StrMixin):
                 candis = ''.join(str(x) for x in sorted(cand)) # pylint: disable=unused-variable
                 self.debug('callingHands found {} for {}'.format(candis, rule))
             candidates.extend(x.concealed for x in cand)
-        for tile in sorted(set(candidates)):
-            if sum(x.exposed == tile.exposed for x in self.tiles) == 4:
-                continue
-            hand = self + tile
+        tiles = list(x for x in sorted(set(candidates))
+                     if sum(y.exposed == x.exposed for y in self.tiles) < 4)
+        for hand in self.handsPlus(tiles).values():
             if hand.won:
                 result.append(hand)
         if Debug.hand:
@@ -602,12 +862,12 @@ class Hand(StrMixin):
         """work hard to always return the variant with the highest Mah Jongg value."""
         if any(not x.isKnown for x in self.__rest):
             melds, rest = divmod(len(self.__rest), 3)
-            self.melds.extend([Tile.unknown.pung] * melds)
+            self.__melds.extend([Tile.unknown.pung] * melds)
             if rest:
-                self.melds.append(Meld(Tile.unknown * rest))
+                self.__melds.append(Meld(Tile.unknown * rest))
             self.__rest = []
         if not self.__rest:
-            self.melds.sort()
+            self.__melds.sort()
             mjRules = self.__maybeMahjongg()
             if self.won:
                 if not mjRules:
@@ -615,10 +875,11 @@ class Hand(StrMixin):
                     raise Hand.__NotWon('Long Hand with no rest')
                 self.mjRule = mjRules[0]
             return
-        wonHands = []
-        lostHands = []
-        for mjRule, melds in self.__arrangements():
-            allMelds = self.melds[:] + list(melds)
+        variants = []
+        arrangements = self.__arrangements()
+        bound = self.__variantBound() if len(arrangements) > 1 else None
+        for idx, (mjRule, melds) in enumerate(arrangements):
+            allMelds = self.__melds[:] + list(melds)
             lastTile = self.lastTile
             if self.lastSource and self.lastSource.isDiscarded:
                 lastTile = lastTile.exposed
@@ -628,26 +889,67 @@ class Hand(StrMixin):
                 if lastMelds:
                     allMelds.remove(lastMelds[0])
                     allMelds.append(lastMelds[0].exposed)
+            variants.append((bound(allMelds) if bound else None, idx, mjRule, melds, allMelds, lastTile))
+        if bound:
+            # most promising variants first, so we can stop early
+            variants.sort(key=lambda x: -x[0])
+        wonHands = []
+        lostHands = []
+        bestIdx = bestTotal = None
+        excluded = None
+        for maxTotal, idx, mjRule, melds, allMelds, lastTile in variants:
+            if bestTotal is not None:
+                if excluded:
+                    maxTotal = bound(allMelds, excluded)
+                if maxTotal < bestTotal:
+                    if not excluded:
+                        # all following variants have no higher bound
+                        break
+                    continue
+                if maxTotal == bestTotal and idx > bestIdx:
+                    # max() would keep the earlier one
+                    continue
             _ = self.newString(
                 chain(allMelds, self.bonusMelds),
                 rest=None, lastTile=lastTile, lastMeld=None)
             tryHand = Hand(self.player, _, prevHand=self)
             if tryHand.won:
                 tryHand.mjRule = mjRule
-                wonHands.append((mjRule, melds, tryHand))
+                wonHands.append((idx, mjRule, melds, tryHand))
+                if bound:
+                    total = tryHand.total()
+                    if excluded is None:
+                        excluded = self.ruleset.plan.unusedTileRules(tryHand) or frozenset()
+                    if bestTotal is None or total > bestTotal or (total == bestTotal and idx < bestIdx):
+                        bestIdx, bestTotal = idx, total
             else:
-                lostHands.append((mjRule, melds, tryHand))
+                lostHands.append((idx, mjRule, melds, tryHand))
         # we prefer a won Hand even if a lost Hand might have a higher score
-        tryHands = wonHands if wonHands else lostHands
-        bestRule, bestVariant, _ = max(tryHands, key=lambda x: x[2])
+        tryHands = sorted(wonHands if wonHands else lostHands, key=lambda x: x[0])
+        _, bestRule, bestVariant, _ = max(tryHands, key=lambda x: x[3])
         if wonHands:
             self.mjRule = bestRule
-        self.melds.extend(bestVariant)
-        self.melds.sort()
+        self.__melds.extend(bestVariant)
+        self.__melds.sort()
         self.__rest = []
         self.ruleCache.clear()
-        assert sum(len(x) for x in self.melds) == len(self.tiles), (
-            '%s != %s' % (self.melds, self.tiles))
+        assert sum(len(x) for x in self.__melds) == len(self.tiles), (
+            '%s != %s' % (self.__melds, self.tiles))
+
+    def __variantBound(self):
+        """returns a function giving an upper bound for the total of a won
+        variant with melds, or None if the bound does not help: only
+        the default handValue is the total"""
+        if type(self.intelligence).handValue is not AIDefault.handValue:
+            return None
+        plan = self.ruleset.plan
+        features = plan.features(self) - set(['chows', 'noChows', 'concealed'])
+
+        def maxTotal(melds, excluded=frozenset()):
+            """the bound for the variant with melds"""
+            return plan.maxTotal(
+                chain(melds, self.bonusMelds), features | plan.meldFeatures(melds), excluded)
+        return maxTotal
 
     def __gt__(self, other):
         """compares hand values"""
@@ -694,16 +996,21 @@ class Hand(StrMixin):
         return result
 
     def __totalScore(self):
-        """use all used rules to compute the score"""
-        maxRule = self.maxLimitRule(self.usedRules)
-        maxLimit = 0.0
-        pointsTotal = sum((x.rule.score for x in self.usedRules),
-                          Score(ruleset=self.ruleset))
+        """use all used rules to compute the score. Like maxLimitRule,
+        but in the same loop"""
+        maxRule = None
+        maxLimit = 0
+        pointsTotal = Score(ruleset=self.ruleset)
+        for usedRule in self.__usedRules:
+            score = usedRule.rule.score
+            pointsTotal += score
+            if score.limits > maxLimit:
+                maxLimit = score.limits
+                maxRule = usedRule
         if maxRule:
-            maxLimit = maxRule.rule.score.limits
             if (maxLimit >= 1.0
                     or maxLimit * self.ruleset.limit > pointsTotal.total()):
-                self.usedRules = [maxRule]
+                self.__usedRules = [maxRule]
                 return Score(ruleset=self.ruleset, limits=maxLimit)
         return pointsTotal
 
@@ -711,6 +1018,12 @@ class Hand(StrMixin):
         """total points of hand"""
         return self.score.total()
 
+    @property
+    def digest(self):
+        """a short replacement for str(hand) when client and server compare
+        their hands: the total and a part of the md5sum of the string"""
+        return '#{}:{}'.format(self.total(), md5(self.newString().encode()).hexdigest()[:8])
+
     @staticmethod
     def __separateBonusMelds(tileStrings):
         """One meld per bonus tile. Others depend on that."""
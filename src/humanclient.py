@@ -44,6 +44,7 @@ from login import Connection
 from rule import Ruleset
 from game import PlayingGame
 from visible import VisiblePlayingGame
+from wire import Wire
 
 
 class SelectChow(KDialogIgnoringEscape):
@@ -384,6 +385,7 @@ class HumanClient(Client):
         self.table = None
         self.ruleset = None
         self.beginQuestion = None
+        self.wireVersion = 0
         self.tableList = TableList(self)
         Connection(self).login().addCallbacks(
             self.__loggedIn,
@@ -437,10 +439,22 @@ class HumanClient(Client):
                     (self.name, voiceId))
         maxGameId = Query('select max(id) from game').records[0][0]
         maxGameId = int(maxGameId) if maxGameId else 0
-        self.callServer('setClientProperties',
-                        Internal.db.identifier,
-                        voiceId, maxGameId,
-                        Internal.defaultPort).addCallbacks(self.__initTableList, self.__versionError)
+
+        def oldServer(dummyFailure):
+            """the server does not know the compact encoding"""
+            return 0
+
+        def setClientProperties(wireVersion):
+            """now we know how to talk with the server"""
+            self.wireVersion = wireVersion or 0
+            if Debug.connections:
+                logDebug('{} uses wire version {}'.format(self.name, self.wireVersion))
+            return self.callServer('setClientProperties',
+                                   Internal.db.identifier,
+                                   voiceId, maxGameId,
+                                   Internal.defaultPort)
+        self.callServer('setWire', Wire.version, Wire.digest()).addErrback(oldServer).addCallback(
+            setClientProperties).addCallbacks(self.__initTableList, self.__versionError)
 
     def __initTableList(self, dummy):
         """first load of the list. Process options like --demo, --table, --join"""
@@ -536,6 +550,8 @@ class HumanClient(Client):
 
         def gotRulesets(result):
             """the server sent us the wanted ruleset definitions"""
+            if isinstance(result, bytes):
+                result = Wire.unzipValue(result)
             for ruleset in result:
                 Ruleset.cached(ruleset).save()  # make it known to the cache and save in db
             return tables
@@ -551,11 +567,12 @@ class HumanClient(Client):
         else:
             self.__receiveTables(tables)
 
-    @staticmethod
-    def remote_needRuleset(ruleset):
+    def remote_needRuleset(self, ruleset):
         """server only knows hash, needs full definition"""
         result = Ruleset.cached(ruleset)
         assert result and result.hash == ruleset
+        if self.wireVersion:
+            return Wire.zipValue(result.toList())
         return result.toList()
 
     def tableChanged(self, table):
@@ -758,6 +775,8 @@ class HumanClient(Client):
     def remote_abort(self, tableid, message: str, *args):
         """the server aborted this game"""
         if self.table and self.table.tableid == tableid:
+            if self.table.claimWindow:
+                self.table.claimWindow.cancel()
             # translate Robot to Roboter:
             if self.game:
                 args = self.game.players.translatePlayerNames(args)
@@ -23,6 +23,7 @@ import weakref
 from message import Message
 from common import IntDict, Debug, StrMixin
 from tile import Tile
+from tilecounts import TileCounts
 
 
 class AIDefault:
@@ -51,20 +52,24 @@ class AIDefault:
     @staticmethod
     def weighSameColors(dummyAiInstance, candidates):
         """weigh tiles of same group against each other"""
-        for candidate in candidates:
-            if candidate.group in Tile.colors:
-                if candidate.prev.occurrence:
-                    candidate.prev.keep += 1.001
-                    candidate.keep += 1.002
-                    if candidate.next.occurrence:
-                        candidate.prev.keep += 2.001
-                        candidate.next.keep += 2.003
-                if candidate.next.occurrence:
-                    candidate.next.keep += 1.003
-                    candidate.keep += 1.002
-                elif candidate.next2.occurrence:
-                    candidate.keep += 0.502
-                    candidate.next2.keep += 0.503
+        occurrence = candidates.occurrence
+        keeps = candidates.keeps
+        for slot in candidates.slots:
+            neighbours = candidates.neighbours[slot]
+            if neighbours:
+                _, prev, nextSlot, next2 = neighbours
+                if occurrence[prev]:
+                    keeps[prev] += 1.001
+                    keeps[slot] += 1.002
+                    if occurrence[nextSlot]:
+                        keeps[prev] += 2.001
+                        keeps[nextSlot] += 2.003
+                if occurrence[nextSlot]:
+                    keeps[nextSlot] += 1.003
+                    keeps[slot] += 1.002
+                elif occurrence[next2]:
+                    keeps[slot] += 0.502
+                    keeps[next2] += 0.503
         return candidates
 
     def selectDiscard(self, hand):
@@ -75,9 +80,7 @@ class AIDefault:
         as possible with limited computing resources, it stands on
         no theoretical basis"""
         candidates = DiscardCandidates(self.player, hand)
-        result = self.weighDiscardCandidates(candidates).best()
-        candidates.unlink()
-        return result
+        return self.weighDiscardCandidates(candidates).best()
 
     def weighDiscardCandidates(self, candidates):
         """the standard"""
@@ -114,66 +117,75 @@ class AIDefault:
     @staticmethod
     def weighBasics(aiInstance, candidates):
         """basic things"""
-        # pylint: disable=too-many-branches
+        # pylint: disable=too-many-branches,too-many-locals
         # too many branches
-        for candidate in candidates:
-            keep = candidate.keep
-            tile = candidate.tile
+        occurrence = candidates.occurrence
+        maxPossible = candidates.maxPossible
+        keeps = candidates.keeps
+        ownWind = candidates.hand.ownWind
+        roundWind = candidates.hand.roundWind
+        for slot in candidates.slots:
+            keep = keeps[slot]
+            tile = candidates.tiles[slot]
             value = tile.value
-            if candidate.dangerous:
+            if candidates.dangerous[slot]:
                 keep += 1000
-            if candidate.occurrence >= 3:
+            if occurrence[slot] >= 3:
                 keep += 10.04
-            elif candidate.occurrence == 2:
+            elif occurrence[slot] == 2:
                 keep += 5.08
             keep += aiInstance.groupPrefs[tile.group]
             if tile.isWind:
-                if value == candidates.hand.ownWind:
+                if value == ownWind:
                     keep += 1.01
-                if value == candidates.hand.roundWind:
+                if value == roundWind:
                     keep += 1.02
             if tile.isTerminal:
                 keep += 2.16
-            if candidate.maxPossible == 1:
+            neighbours = candidates.neighbours[slot]
+            if neighbours:
+                prev2, prev, nextSlot, next2 = (maxPossible[x] for x in neighbours)
+            if maxPossible[slot] == 1:
                 if tile.isHonor:
                     keep -= 8.32
                     # not too much, other players might profit from this tile
                 else:
-                    if not candidate.next.maxPossible:
-                        if not candidate.prev.maxPossible or not candidate.prev2.maxPossible:
+                    if not nextSlot:
+                        if not prev or not prev2:
                             keep -= 100
-                    if not candidate.prev.maxPossible:
-                        if not candidate.next.maxPossible or not candidate.next2.maxPossible:
+                    if not prev:
+                        if not nextSlot or not next2:
                             keep -= 100
-            if candidate.available == 1 and candidate.occurrence == 1:
+            if candidates.available[slot] == 1 and occurrence[slot] == 1:
                 if tile.isHonor:
                     keep -= 3.64
                 else:
-                    if not candidate.next.maxPossible:
-                        if not candidate.prev.maxPossible or not candidate.prev2.maxPossible:
+                    if not nextSlot:
+                        if not prev or not prev2:
                             keep -= 3.64
-                    if not candidate.prev.maxPossible:
-                        if not candidate.next.maxPossible or not candidate.next2.maxPossible:
+                    if not prev:
+                        if not nextSlot or not next2:
                             keep -= 3.64
-            candidate.keep = keep
+            keeps[slot] = keep
         return candidates
 
     @staticmethod
     def weighSpecialGames(dummyAiInstance, candidates):
         """like color game, many dragons, many winds"""
-        for candidate in candidates:
-            tile = candidate.tile
+        keeps = candidates.keeps
+        for slot in candidates.slots:
+            tile = candidates.tiles[slot]
             groupCount = candidates.groupCounts[tile.group]
             if tile.isWind:
                 if groupCount > 8:
-                    candidate.keep += 10.153
+                    keeps[slot] += 10.153
             elif tile.isDragon:
                 if groupCount > 7:
-                    candidate.keep += 15.157
+                    keeps[slot] += 15.157
             else:
                 # count tiles with a different group:
                 if groupCount == 1:
-                    candidate.keep -= 2.013
+                    keeps[slot] -= 2.013
                 else:
                     otherGC = sum(candidates.groupCounts[x]
                                   for x in Tile.colors if x != tile.group)
@@ -182,7 +194,7 @@ class AIDefault:
                             # do not go for color game if we already declared
                             # something in another group:
                             if not any(candidates.declaredGroupCounts[x] for x in Tile.colors if x != tile.group):
-                                candidate.keep += 20 // otherGC
+                                keeps[slot] += 20 // otherGC
         return candidates
 
     @staticmethod
@@ -208,12 +220,14 @@ class AIDefault:
     @staticmethod
     def weighCallingHand(aiInstance, candidates):
         """if we can get a calling hand, prefer that"""
+        newHands = candidates.hand.handsMinus(list(x.tile.concealed for x in candidates))
         for candidate in candidates:
-            newHand = candidates.hand - candidate.tile.concealed
+            newHand = newHands[candidate.tile.concealed]
             winningTiles = newHand.chancesToWin()
             if winningTiles:
+                winnerHands = newHand.handsPlus(sorted(set(x.concealed for x in winningTiles)))
                 for winnerTile in sorted(set(winningTiles)):
-                    winnerHand = newHand + winnerTile.concealed
+                    winnerHand = winnerHands[winnerTile.concealed]
                     if Debug.robotAI:
                         aiInstance.player.game.debug('weighCallingHand %s cand %s winnerTile %s winnerHand %s: %s' % (
                             newHand, candidate, winnerTile, winnerHand, '     '.join(winnerHand.explain())))
@@ -333,33 +347,62 @@ class AIDefault:
 
 class TileAI(StrMixin):
 
-    """holds a few AI related tile properties"""
+    """holds a few AI related tile properties. The values are kept
+    by DiscardCandidates, this is only a view on them"""
     # pylint: disable=too-many-instance-attributes
     # we do want that many instance attributes
 
-    def __init__(self, candidates, tile):
-        self.tile = tile
-        self.group, self.value = tile.group, tile.value
-        if tile.isReal:
-            self.occurrence = candidates.hiddenTiles.count(tile)
-            self.available = candidates.player.tileAvailable(
-                tile, candidates.hand)
-            self.maxPossible = self.available + self.occurrence
-            self.dangerous = bool(
-                candidates.player.game.dangerousFor(
-                    candidates.player,
-                    tile))
-        else:
-            # value might be -1, 0, 10, 11 for suits
-            self.occurrence = 0
-            self.available = 0
-            self.maxPossible = 0
-            self.dangerous = False
-        self.keep = 0.0
-        self.prev = None
-        self.next = None
-        self.prev2 = None
-        self.next2 = None
+    def __init__(self, candidates, slot, tile=None):
+        self._candidates = weakref.ref(candidates)
+        self._keeps = candidates.keeps
+        self.slot = slot
+        self.tile = tile or candidates.tiles[slot]
+        self.group, self.value = self.tile.group, self.tile.value
+        self.occurrence = candidates.occurrence[slot]
+        self.available = candidates.available[slot]
+        self.maxPossible = candidates.maxPossible[slot]
+        self.dangerous = candidates.dangerous[slot]
+
+    @property
+    def keep(self):
+        """the weight: the higher, the more we want to keep this tile"""
+        return self._keeps[self.slot]
+
+    @keep.setter
+    def keep(self, value):
+        """the weight: the higher, the more we want to keep this tile"""
+        self._keeps[self.slot] = value
+
+    def __neighbour(self, idx, offset):
+        """prev2, prev, next, next2 for suit tiles.
+        Beyond 1 and 9, they have no occurrence and are not available"""
+        candidates = self._candidates()
+        if self.slot == candidates.sentinel or not candidates.neighbours[self.slot]:
+            return None
+        slot = candidates.neighbours[self.slot][idx]
+        if slot == candidates.sentinel:
+            return TileAI(candidates, slot, Tile(self.group, self.value + offset))
+        return TileAI(candidates, slot)
+
+    @property
+    def prev2(self):
+        """the tile two values below"""
+        return self.__neighbour(0, -2)
+
+    @property
+    def prev(self):
+        """the tile one value below"""
+        return self.__neighbour(1, -1)
+
+    @property
+    def next(self):
+        """the tile one value above"""
+        return self.__neighbour(2, 1)
+
+    @property
+    def next2(self):
+        """the tile two values above"""
+        return self.__neighbour(3, 2)
 
     def __lt__(self, other):
         """for sorting"""
@@ -373,10 +416,21 @@ class TileAI(StrMixin):
 class DiscardCandidates(list):
 
     """a list of TileAI objects. This class should only hold
-    AI neutral methods"""
+    AI neutral methods.
+
+    All values are held in flat lists indexed like TileCounts.tiles,
+    and the filters of AIDefault weigh all candidates on those lists.
+    The additional sentinel slot stands for the neighbours beyond 1 and 9,
+    its values are always 0."""
+
+    tiles = TileCounts.tiles
+    sentinel = len(TileCounts.tiles)
+    neighbours = None  # per slot: the slots of prev2, prev, next, next2
 
     def __init__(self, player, hand):
         list.__init__(self)
+        if DiscardCandidates.neighbours is None:
+            DiscardCandidates.__defineNeighbours()
         self._player = weakref.ref(player)
         self._hand = weakref.ref(hand)
         if Debug.robotAI:
@@ -392,9 +446,32 @@ class DiscardCandidates(list):
         for tile in sum((x for x in hand.declaredMelds), []):
             self.groupCounts[tile.lowerGroup] += 1
             self.declaredGroupCounts[tile.lowerGroup] += 1
-        self.extend(list(TileAI(self, x)
-                         for x in sorted(set(self.hiddenTiles))))
-        self.link()
+        slots = TileCounts.slots
+        self.occurrence = [0] * (self.sentinel + 1)
+        for tile in self.hiddenTiles:
+            self.occurrence[slots[tile]] += 1
+        self.available = player.tilesAvailable(hand) + [0]
+        self.maxPossible = list(x + y for x, y in zip(self.available, self.occurrence))
+        self.slots = list(slots[x] for x in sorted(set(self.hiddenTiles)))
+        self.dangerous = [False] * (self.sentinel + 1)
+        for slot in self.slots:
+            self.dangerous[slot] = bool(player.game.dangerousFor(player, self.tiles[slot]))
+        self.keeps = [0.0] * (self.sentinel + 1)
+        self.extend(TileAI(self, x) for x in self.slots)
+
+    @classmethod
+    def __defineNeighbours(cls):
+        """for suit tiles, the slots with value -2, -1, +1, +2.
+        None for honors"""
+        result = []
+        for slot, tile in enumerate(cls.tiles):
+            if tile.isHonor:
+                result.append(None)
+            else:
+                result.append(tuple(
+                    slot + x if 1 <= tile.value + x <= 9 else cls.sentinel
+                    for x in (-2, -1, 1, 2)))
+        cls.neighbours = result
 
     @property
     def player(self):
@@ -408,50 +485,10 @@ class DiscardCandidates(list):
         if self._hand:
             return self._hand()
 
-    def link(self):
-        """define values for candidate.prev and candidate.next"""
-        prev = prev2 = None
-        for this in self:
-            if this.group in Tile.colors:
-                thisValue = this.value
-                if prev and prev.group == this.group:
-                    if prev.value + 1 == thisValue:
-                        prev.next = this
-                        this.prev = prev
-                    if prev.value + 2 == thisValue:
-                        prev.next2 = this
-                        this.prev2 = prev
-                if prev2 and prev2.group == this.group and prev2.value + 2 == thisValue:
-                    prev2.next2 = this
-                    this.prev2 = prev2
-            prev2 = prev
-            prev = this
-        for this in self:
-            if this.group in Tile.colors:
-                # we want every tile to have prev/prev2/next/next2
-                # the names do not matter, just occurrence, available etc
-                thisValue = this.value
-                if not this.prev:
-                    this.prev = TileAI(self, this.tile.prevForChow)
-                if not this.prev2:
-                    this.prev2 = TileAI(self, this.prev.tile.prevForChow)
-                if not this.next:
-                    this.next = TileAI(self, this.tile.nextForChow)
-                if not this.next2:
-                    this.next2 = TileAI(self, this.next.tile.nextForChow)
-
-    def unlink(self):
-        """remove links between elements. This helps garbage collection."""
-        for this in self:
-            this.prev = None
-            this.next = None
-            this.prev2 = None
-            this.next2 = None
-
     def best(self):
         """returns the candidate with the lowest value"""
-        lowest = min(x.keep for x in self)
-        candidates = sorted(x for x in self if x.keep == lowest)
+        lowest = min(self.keeps[x] for x in self.slots)
+        candidates = list(x for x in self if x.keep == lowest)
         result = self.player.game.randomGenerator.choice(
             candidates).tile.concealed
         if Debug.robotAI:
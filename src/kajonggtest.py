@@ -31,7 +31,9 @@ import random
 import shutil
 import time
 import gc
+import multiprocessing
 
+from multiprocessing.connection import wait
 from optparse import OptionParser
 
 from common import Debug, StrMixin, cacheDir
@@ -611,6 +613,14 @@ def parse_options():
         '', '--servers', dest='servers',
         help='start a maximum of SERVERS kajonggserver instances. Default is 1',
         metavar='SERVERS', type=int, default=1)
+    parser.add_option(
+        '', '--farm', dest='farm', action='store_true',
+        help='play all games within WORKERS local processes without game servers',
+        default=False)
+    parser.add_option(
+        '', '--workers', dest='workers',
+        help='the number of processes for --farm. Default is the number of cores',
+        metavar='WORKERS', type=int, default=multiprocessing.cpu_count())
     parser.add_option(
         '', '--git', dest='git',
         help='check all commits: either a comma separated list or a range from..until')
@@ -627,9 +637,19 @@ def improve_options():
     if OPTIONS.servers < 1:
         OPTIONS.servers = 1
 
-    cmdPath = os.path.join(startingDir(), 'kajongg.py')
-    cmd = ['python3', cmdPath, '--rulesets']
-    OPTIONS.knownRulesets = list(popenReadlines(cmd))
+    if OPTIONS.farm:
+        if OPTIONS.git is not None:
+            print('--farm only plays the current checkout, not --git')
+            sys.exit(2)
+        if OPTIONS.gui or OPTIONS.log:
+            print('--farm does not support --gui or --log')
+            sys.exit(2)
+        from simulator import rulesetNames
+        OPTIONS.knownRulesets = rulesetNames()
+    else:
+        cmdPath = os.path.join(startingDir(), 'kajongg.py')
+        cmd = ['python3', cmdPath, '--rulesets']
+        OPTIONS.knownRulesets = list(popenReadlines(cmd))
     if OPTIONS.rulesets == 'ALL':
         OPTIONS.rulesets = OPTIONS.knownRulesets
     else:
@@ -714,9 +734,137 @@ def allJobs():
                 for aiVariant in OPTIONS.allAis:
                     OPTIONS.jobCount += 1
                     if OPTIONS.jobCount > OPTIONS.count:
-                        raise StopIteration
+                        return
                     yield Job(3, ruleset, aiVariant, commitId, game)
 
+
+class FarmResults(StrMixin):
+
+    """aggregates the rows sent by the farm workers"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.lastReport = self.started
+        self.games = 0
+        self.aborted = 0
+        self.variants = dict()  # (ruleset, AI): [games, points for 4 players]
+
+    def add(self, row):
+        """a finished game"""
+        self.games += 1
+        variant = tuple(row[:COMMITFIELD])
+        if variant not in self.variants:
+            self.variants[variant] = [0, [0, 0, 0, 0]]
+        values = self.variants[variant]
+        values[0] += 1
+        for playerIdx in range(4):
+            values[1][playerIdx] += int(row[PLAYERSFIELD + 1 + playerIdx * 4])
+
+    def rate(self):
+        """games per second"""
+        return self.games / max(time.time() - self.started, 0.001)
+
+    def progress(self):
+        """print the throughput every 10 seconds"""
+        if time.time() - self.lastReport >= 10:
+            self.lastReport = time.time()
+            print('{} games, {:.2f} games/s'.format(self.games, self.rate()))
+
+    def report(self):
+        """print a summary"""
+        print()
+        print('{ruleset:<25} {ai:<20} {games:>5}     {points:>4}                      human'.format(
+            ruleset='Ruleset', ai='AI variant', games='games', points='points'))
+        for (ruleset, aiVariant), (games, points) in sorted(self.variants.items()):
+            print('{ruleset:<25} {ai:<20} {games:>5}   {points}'.format(
+                ruleset=ruleset[:25], ai=aiVariant[:20], games=games,
+                points=' '.join('{:>8}'.format(x) for x in points)))
+        print('{} games, {} aborted, {:.1f} seconds, {:.2f} games/s with {} workers'.format(
+            self.games, self.aborted, time.time() - self.started, self.rate(), OPTIONS.workers))
+
+
+def farmWorker(connection, options):
+    """runs in a worker process: play the games the parent sends and
+    send back the csv rows. None ends the worker."""
+    # pylint: disable=import-outside-toplevel
+    import simulator
+    from common import Options
+    Options.rounds = int(options.rounds) if options.rounds else None
+    Options.playOpen = options.playopen
+    rulesets = dict()
+    while True:
+        job = connection.recv()
+        if job is None:
+            break
+        rulesetName, aiVariant, game = job
+        if rulesetName not in rulesets:
+            rulesets[rulesetName] = simulator.findRuleset(rulesetName)
+        Options.AI = aiVariant
+        result = simulator.playGame(
+            rulesets[rulesetName], game, 'Tester 1', playOpen=options.playopen)
+        connection.send(result.csvRow() if result else job)
+    connection.close()
+
+
+def doFarmJobs():
+    """play all jobs in local worker processes. Every worker gets the next
+    job as soon as it sent back the result of the previous one. Only we write
+    to the csv file."""
+    if OPTIONS.csv and gitHead() in ('current', None):
+        print(
+            'Disabling CSV output: %s' %
+            ('You have uncommitted changes' if gitHead() == 'current' else 'No git'))
+        print()
+        OPTIONS.csv = None
+    results = FarmResults()
+    writer = CsvWriter(OPTIONS.csv, mode='a') if OPTIONS.csv else None
+    workers = dict()
+    for _ in range(max(OPTIONS.workers, 1)):
+        parentEnd, childEnd = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=farmWorker, args=(childEnd, OPTIONS))
+        process.start()
+        childEnd.close()
+        workers[parentEnd] = process
+
+    def sendJob(connection):
+        """returns False if there are no more jobs"""
+        job = next(OPTIONS.jobs, None)
+        if job is None:
+            connection.send(None)
+            return False
+        connection.send((job.ruleset, job.aiVariant, job.game))
+        return True
+
+    busy = set(x for x in workers if sendJob(x))
+    try:
+        while busy:
+            for connection in wait(list(busy)):
+                try:
+                    row = connection.recv()
+                except EOFError:
+                    print('farm worker {} died'.format(workers[connection].pid))
+                    busy.remove(connection)
+                    continue
+                if isinstance(row, tuple):
+                    results.aborted += 1
+                    print('aborted: {} game={}'.format(*row[:3:2]))
+                else:
+                    results.add(row)
+                    if writer:
+                        writer.writerow(row)
+                        writer.outfile.flush()
+                if not sendJob(connection):
+                    busy.remove(connection)
+                results.progress()
+    finally:
+        for connection, process in workers.items():
+            if connection in busy:
+                process.terminate()
+            process.join()
+        del writer
+    results.report()
+
+
 def main():
     """parse options, play, evaluate results"""
     global OPTIONS  # pylint: disable=global-statement
@@ -748,7 +896,10 @@ def main():
     print()
 
     if OPTIONS.count:
-        doJobs()
+        if OPTIONS.farm:
+            doFarmJobs()
+        else:
+            doJobs()
         if OPTIONS.csv:
             evaluate(readGames(OPTIONS.csv))
 
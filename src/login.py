@@ -52,6 +52,7 @@ from statesaver import StateSaver
 
 from guiutil import ListComboBox, decorateWindow
 from rule import Ruleset
+from wire import CountingBroker
 
 
 class LoginAborted(Exception):
@@ -573,6 +574,7 @@ class Connection:
         """send a login command to server. That might be a normal login
         or adduser/deluser/change passwd encoded in the username"""
         factory = pb.PBClientFactory(unsafeTracebacks=True)
+        factory.protocol = CountingBroker
         self.connector = self.url.connect(factory)
         utf8Password = self.dlg.password.encode('utf-8')
         utf8Username = username.encode('utf-8')
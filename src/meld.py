@@ -23,6 +23,7 @@ Read the user manual for a description of the interface to this scoring engine
 
 
 from itertools import chain
+from operator import attrgetter
 
 from mi18n import i18nc
 from common import StrMixin
@@ -35,8 +36,9 @@ class Meld(TileList, StrMixin):
     raise exceptions if the meld is empty. But we do not care,
     those methods are not supposed to be called on empty melds.
     Meld is essentially a list of Tile with added methods.
-    A Meld is immutable, not from the view of python but for
-    its user
+    A Meld is immutable: all methods changing the list raise
+    TypeError. So Meld can be hashed by its key, and tileKeys
+    holds the integer ids of its tiles as a tuple
 
     for melds with 3 tiles::
         isDeclared == isExposed : 3 exposed tiles
@@ -55,8 +57,9 @@ class Meld(TileList, StrMixin):
     """
     # pylint: disable=too-many-instance-attributes
 
-    __hash__ = None
     cache = {}
+    # tuple of tile keys to Meld
+    byKeys = {}
 
     def __new__(cls, newContent=None):
         """try to use cache"""
@@ -64,17 +67,30 @@ class Meld(TileList, StrMixin):
             return cls.cache[newContent]
         if isinstance(newContent, Meld):
             return newContent
+        if isinstance(newContent, (list, tuple)):
+            # hashing a tuple of tiles is much cheaper than TileList.key
+            result = cls.cache.get(tuple(newContent))
+            if result is not None:
+                return result
         tiles = TileList(newContent)
         cacheKey = tiles.key()
         if cacheKey in cls.cache:
             return cls.cache[cacheKey]
         return TileList.__new__(cls, tiles)
 
+    @classmethod
+    def fromKeys(cls, keys):
+        """the meld for a tuple of tile keys. Much faster than Meld(tiles)"""
+        result = cls.byKeys.get(keys)
+        if result is None:
+            result = cls(list(Tile.byKey[x] for x in keys))
+        return result
+
     @classmethod
     def check(cls):
         """check cache consistency"""
         for key, value in cls.cache.items():
-            assert key == value.key or key == str(value), 'cache wrong: cachekey=%s realkey=%s value=%s' % (
+            assert key in (value.key, str(value), tuple(value)), 'cache wrong: cachekey=%s realkey=%s value=%s' % (
                 key, value.key, value)
             assert value.key == 1 + value.hashTable.index(value) / 2
             assert value.key == TileList.key(value), \
@@ -91,9 +107,12 @@ class Meld(TileList, StrMixin):
             TileList.__init__(self, newContent)
             self.case = ''.join('a' if x.islower() else 'A' for x in self)
             self.key = TileList.key(self)
+            self.tileKeys = tuple(x.key for x in self)
             if self.key not in self.cache:
                 self.cache[self.key] = self
                 self.cache[str(self)] = self
+                self.cache[tuple(self)] = self
+                self.byKeys[self.tileKeys] = self
             self.isExposed = self.__isExposed()
             self.isConcealed = not self.isExposed
             self.isSingle = self.isPair = self.isChow = self.isPung = False
@@ -114,6 +133,7 @@ class Meld(TileList, StrMixin):
                 self.group = 'X'
                 self.lowerGroup = 'x'
             self.isRest = False
+            self.sortKey = self.__sortKey()
             self.__staticRules = {}  # ruleset is key
             self.__dynamicRules = {}  # ruleset is key
             self.__staticDoublingRules = {}  # ruleset is key
@@ -188,6 +208,15 @@ class Meld(TileList, StrMixin):
             rulesetId] if x.appliesToMeld(hand, self))
         return result
 
+    def possibleRules(self, ruleset):
+        """all rules which might apply to this meld, whatever the hand is"""
+        if self.__hasRules is False:
+            return []
+        rulesetId = id(ruleset)
+        if rulesetId not in self.__staticRules:
+            self.__prepareRules(ruleset)
+        return self.__staticRules[rulesetId] + self.__dynamicRules[rulesetId]
+
     def doublingRules(self, hand):
         """all applicable doubling rules for this meld being part of hand"""
         ruleset = hand.ruleset
@@ -219,6 +248,26 @@ class Meld(TileList, StrMixin):
         """we want to be immutable"""
         raise TypeError
 
+    def clear(self):
+        """we want to be immutable"""
+        raise TypeError
+
+    def sort(self, key=None, reverse=False):
+        """we want to be immutable"""
+        raise TypeError
+
+    def reverse(self):
+        """we want to be immutable"""
+        raise TypeError
+
+    def __iadd__(self, other):
+        """we want to be immutable"""
+        raise TypeError
+
+    def __imul__(self, other):
+        """we want to be immutable"""
+        raise TypeError
+
     def without(self, remove):
         """self without tile. The rest will be uppercased."""
         tiles = TileList()
@@ -310,19 +359,21 @@ class Meld(TileList, StrMixin):
                     return
         raise UserWarning('Meld %s is malformed' % self)
 
+    def __sortKey(self):
+        """used for sorting. Smaller value is shown first: empty melds,
+        declared melds, then by the first tile, longer melds first.
+        A meld never has 32 tiles"""
+        if len(self) == 0:
+            return 0
+        return ((2 - self.isDeclared) * 1000 + self[0].key) * 32 - len(self)
+
     def __lt__(self, other):
         """used for sorting. Smaller value is shown first."""
-        if len(other) == 0:
-            return False
-        if len(self) == 0:
-            return True
-        if self.isDeclared and not other.isDeclared:
-            return True
-        if not self.isDeclared and other.isDeclared:
-            return False
-        if self[0].key == other[0].key:
-            return len(self) > len(other)
-        return self[0].key < other[0].key
+        return self.sortKey < other.sortKey
+
+    def __hash__(self):
+        """all melds are cached and immutable, so equal melds have the same key"""
+        return self.key
 
     def typeName(self):
         """convert int to speaking name with shortcut. ATTENTION: UNTRANSLATED!"""
@@ -401,6 +452,8 @@ class MeldList(list):
 
     """a list of melds"""
 
+    order = attrgetter('sortKey')
+
     def __init__(self, newContent=None):
         list.__init__(self)
         if newContent is None:
@@ -411,9 +464,13 @@ class MeldList(list):
             list.extend(self, [Meld(x)
                                for x in newContent.split()])  # pylint: disable=maybe-no-member
         else:
-            list.extend(self, [Meld(x) for x in newContent])
+            list.extend(self, [x if isinstance(x, Meld) else Meld(x) for x in newContent])
         self.sort()
 
+    def sort(self, key=None, reverse=False):
+        """without a key, sort by Meld.sortKey. Much faster than Meld.__lt__"""
+        list.sort(self, key=key or self.order, reverse=reverse)
+
     def extend(self, values):
         list.extend(self, values)
         self.sort()
@@ -22,11 +22,166 @@ Read the user manual for a description of the interface to this scoring engine
 """
 
 import itertools
+import os
+import mmap
+import struct
 
-from tile import Tile
+from log import logDebug
+from tile import Tile, TileList
 from meld import Meld, MeldList
 
 
+class PermutationTable:
+
+    """A precomputed, memory mapped table with the result of
+    Permutations.usefulPermutations for every legal group of
+    consecutive suit values with up to maxTiles tiles.
+
+    Such a group is given by the count of each of its values, beginning
+    with the lowest one. Since the result only depends on those counts,
+    the table holds the melds relative to the lowest value.
+
+    The file is built by running this module as a script. It starts with
+    a header (magic, version, maxTiles, bits), followed by a hash table
+    with 2**bits slots of (key, offset) and the data. Entry data is:
+    number of variants, and for every variant the number of melds
+    followed by one byte per meld: the meld type in the high nibble and
+    the relative value in the low nibble."""
+
+    magic = b'KJPT'
+    version = 1
+    maxTiles = 14
+    bits = 14
+    fileName = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'permutations.bin')
+    header = struct.Struct('<4sHHI')
+    slot = struct.Struct('<II')
+
+    single, pair, pung, chow = range(4)
+
+    data = None
+    usable = None
+
+    def __init__(self):
+        raise Exception('PermutationTable is not meant to be instantiated')
+
+    @staticmethod
+    def key(counts):
+        """a unique int for a tuple of counts 1..4"""
+        result = 0
+        for count in reversed(counts):
+            result = result * 5 + count
+        return result
+
+    @classmethod
+    def hashSlot(cls, key):
+        """the first slot to look at for key"""
+        return ((key * 2654435761) & 0xffffffff) >> (32 - cls.bits)
+
+    @classmethod
+    def load(cls):
+        """map the file into memory. Returns True if usable"""
+        if cls.usable is None:
+            cls.usable = False
+            try:
+                with open(cls.fileName, 'rb') as tableFile:
+                    cls.data = mmap.mmap(tableFile.fileno(), 0, access=mmap.ACCESS_READ)
+            except (IOError, OSError, ValueError) as exc:
+                logDebug('cannot map %s: %s' % (cls.fileName, exc))
+                return False
+            magic, version, maxTiles, bits = cls.header.unpack_from(cls.data, 0)
+            if (magic, version, maxTiles, bits) != (cls.magic, cls.version, cls.maxTiles, cls.bits):
+                logDebug('%s has wrong format version %s, expected %s' % (
+                    cls.fileName, version, cls.version))
+                cls.data = None
+                return False
+            cls.usable = True
+        return cls.usable
+
+    @classmethod
+    def lookup(cls, counts):
+        """returns the variants relative to value 0 or None"""
+        if sum(counts) > cls.maxTiles or not cls.load():
+            return None
+        key = cls.key(counts)
+        slotCount = 1 << cls.bits
+        slotIdx = cls.hashSlot(key)
+        dataStart = cls.header.size + slotCount * cls.slot.size
+        data = cls.data
+        while True:
+            slotKey, offset = cls.slot.unpack_from(data, cls.header.size + slotIdx * cls.slot.size)
+            if slotKey == key:
+                break
+            if not slotKey:
+                return None
+            slotIdx = (slotIdx + 1) % slotCount
+        pos = dataStart + offset
+        result = []
+        for _ in range(data[pos]):
+            pos += 1
+            meldCount = data[pos]
+            result.append(tuple(cls.decodeMeld(x) for x in data[pos + 1:pos + 1 + meldCount]))
+            pos += meldCount
+        return tuple(result)
+
+    @classmethod
+    def decodeMeld(cls, code):
+        """returns a tuple of values"""
+        kind, value = divmod(code, 16)
+        if kind == cls.single:
+            return (value, )
+        elif kind == cls.pair:
+            return (value, value)
+        elif kind == cls.pung:
+            return (value, value, value)
+        return (value, value + 1, value + 2)
+
+    @classmethod
+    def encodeMeld(cls, meld):
+        """returns one byte"""
+        if len(meld) == 1:
+            kind = cls.single
+        elif len(meld) == 2:
+            kind = cls.pair
+        elif meld[0] == meld[1]:
+            kind = cls.pung
+        else:
+            kind = cls.chow
+        return kind * 16 + meld[0]
+
+    @classmethod
+    def allCounts(cls):
+        """all groups of consecutive values with up to maxTiles tiles"""
+        for length in range(1, len(Tile.numbers) + 1):
+            for counts in itertools.product(range(1, 5), repeat=length):
+                if sum(counts) <= cls.maxTiles:
+                    yield counts
+
+    @classmethod
+    def write(cls, fileName=None):
+        """compute the table and write it"""
+        slotCount = 1 << cls.bits
+        slots = [(0, 0)] * slotCount
+        data = bytearray()
+        for counts in cls.allCounts():
+            values = tuple(value for value, count in enumerate(counts) for _ in range(count))
+            variants = Permutations.computeUseful(values)
+            offset = len(data)
+            data.append(len(variants))
+            for variant in variants:
+                data.append(len(variant))
+                data.extend(cls.encodeMeld(x) for x in variant)
+            key = cls.key(counts)
+            slotIdx = cls.hashSlot(key)
+            while slots[slotIdx][0]:
+                slotIdx = (slotIdx + 1) % slotCount
+            slots[slotIdx] = (key, offset)
+        with open(fileName or cls.fileName, 'wb') as tableFile:
+            tableFile.write(cls.header.pack(cls.magic, cls.version, cls.maxTiles, cls.bits))
+            for slot in slots:
+                tableFile.write(cls.slot.pack(*slot))
+            tableFile.write(data)
+
+
 class Permutations:
 
     """creates permutations for building melds out of single tiles.
@@ -51,7 +206,7 @@ class Permutations:
     def _variants(self):
         """full Meld lists"""
         honors = []
-        for tile in sorted(set(self.tiles)):
+        for tile in sorted(set(self.tiles), key=TileList.order):
             if tile.isHonor:
                 count = self.tiles.count(tile)
                 if count == 4:
@@ -115,35 +270,51 @@ class Permutations:
     def usefulPermutations(cls, values):
         """return all variants usable for standard MJ formt (4 melds plus 1 pair),
         and also the variant with the most pungs. At least one will be returned.
-        This is meant for the standard MJ format (4 pungs/kongs/chows plus 1 pair)"""
+        This is meant for the standard MJ format (4 pungs/kongs/chows plus 1 pair).
+        values must be consecutive. Look them up in PermutationTable, only
+        compute them if they are not in the table."""
         values = tuple(values)
         if values not in cls.colorPermCache:
-            variants = cls.permute(values)
-            result = []
-            maxPungs = -1
-            maxPungVariant = minMeldVariant = None
-            minMelds = 99
-            for variant in variants:
-                if all(len(meld) > 1 for meld in variant):
-                    # no singles: usable for MJ
-                    result.append(variant)
-                if len(variant) < minMelds:
-                    minMelds = len(variant)
-                    minMeldVariant = variant
-                pungCount = sum(
-                    len(meld) == 3 and len(set(meld)) == 1 for meld in variant)
-                if pungCount > maxPungs:
-                    maxPungs = pungCount
-                    maxPungVariant = variant
-            if maxPungs > 0 and maxPungVariant not in result:
-                result.append(maxPungVariant)
-            result.append(minMeldVariant)
-            if not result:
-                # if nothing seems useful, return all possible permutations
-                result.extend(variants)
-            cls.colorPermCache[values] = tuple(result)
+            start = values[0]
+            relative = PermutationTable.lookup(tuple(
+                values.count(x) for x in range(start, values[-1] + 1)))
+            if relative is None:
+                result = cls.computeUseful(values)
+            else:
+                result = tuple(
+                    tuple(tuple(x + start for x in meld) for meld in variant)
+                    for variant in relative)
+            cls.colorPermCache[values] = result
         return cls.colorPermCache[values]
 
+    @classmethod
+    def computeUseful(cls, values):
+        """see usefulPermutations. This does the real work."""
+        variants = cls.permute(values)
+        result = []
+        maxPungs = -1
+        maxPungVariant = minMeldVariant = None
+        minMelds = 99
+        for variant in variants:
+            if all(len(meld) > 1 for meld in variant):
+                # no singles: usable for MJ
+                result.append(variant)
+            if len(variant) < minMelds:
+                minMelds = len(variant)
+                minMeldVariant = variant
+            pungCount = sum(
+                len(meld) == 3 and len(set(meld)) == 1 for meld in variant)
+            if pungCount > maxPungs:
+                maxPungs = pungCount
+                maxPungVariant = variant
+        if maxPungs > 0 and maxPungVariant not in result:
+            result.append(maxPungVariant)
+        result.append(minMeldVariant)
+        if not result:
+            # if nothing seems useful, return all possible permutations
+            result.extend(variants)
+        return tuple(result)
+
     @classmethod
     def __colorVariants(cls, color, values):
         """generates all possible meld variants out of original
@@ -158,12 +329,17 @@ class Permutations:
                 groups.append(content)
                 allValues = list(x for x in allValues if x > border)
         combinations = list(cls.usefulPermutations(x) for x in groups)
+        keyOf = Tile.keyOf
         result = []
         for variant in list(itertools.product(*combinations)):
             melds = []
             for block in variant:
                 for meld in block:
-                    melds.append(Meld(Tile(color, x) for x in meld))
+                    melds.append(Meld.fromKeys(tuple(keyOf[color, x] for x in meld)))
             if melds:
                 result.append(melds)
         return result
+
+
+if __name__ == '__main__':
+    PermutationTable.write()
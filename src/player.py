@@ -23,7 +23,7 @@ from collections import defaultdict
 
 from log import logException, logWarning
 from mi18n import i18n, i18nc, i18nE
-from common import IntDict, Debug
+from common import IntDict, Debug, Internal
 from common import StrMixin
 from wind import East
 from query import Query
@@ -32,7 +32,8 @@ from tilesource import TileSource
 from meld import Meld, MeldList
 from permutations import Permutations
 from message import Message
-from hand import Hand
+from hand import Hand, HandCache, HandParts
+from tilecounts import TileCounts
 from intelligence import AIDefault
 
 
@@ -46,6 +47,8 @@ class Players(list, StrMixin):
     allIds = {}
     humanNames = {}
 
+    insertStatement = "insert or ignore into player(name) values(?)"
+
     def __init__(self, players=None):
         list.__init__(self)
         if players:
@@ -91,10 +94,17 @@ class Players(list, StrMixin):
     @staticmethod
     def createIfUnknown(name):
         """create player in database if not there yet"""
+        if not Internal.db:
+            # simulated games know their players only in memory
+            if name not in Players.allIds:
+                nameid = len(Players.allIds) + 1
+                Players.allIds[name] = nameid
+                Players.allNames[nameid] = name
+            return
         if name not in Players.allNames.values():
             Players.load()  # maybe somebody else already added it
             if name not in Players.allNames.values():
-                Query("insert or ignore into player(name) values(?)", (name,))
+                Query(Players.insertStatement, (name,))
                 Players.load()
         assert name in Players.allNames.values(), '%s not in %s' % (
             name, Players.allNames.values())
@@ -140,8 +150,6 @@ class Player(StrMixin):
         self.intelligence = AIDefault(self)
         self.visibleTiles = IntDict(game.visibleTiles) if game else IntDict()
         self.handCache = {}
-        self.cacheHits = 0
-        self.cacheMisses = 0
         self.__lastSource = TileSource.East14th
         self.clearHand()
         self.handBoard = None
@@ -153,15 +161,12 @@ class Player(StrMixin):
         return self.name < other.name
 
     def clearCache(self):
-        """clears the cache with Hands"""
+        """clears the cache with Hands. The process wide HandCache
+        is kept, it is not bound to a specific hand"""
         if Debug.hand and len(self.handCache):
-            self.game.debug(
-                '%s: cache hits:%d misses:%d' %
-                (self, self.cacheHits, self.cacheMisses))
+            self.game.debug('%s: %s, %s' % (self, HandCache.stats(), Hand.stageStats()))
         self.handCache.clear()
         Permutations.cache.clear()
-        self.cacheHits = 0
-        self.cacheMisses = 0
 
     @property
     def name(self):
@@ -208,7 +213,7 @@ class Player(StrMixin):
         self.usedDangerousFrom = None
         self.isCalling = False
         self.clearCache()
-        self._hand = None
+        self.invalidateHand()
 
     @property
     def lastTile(self):
@@ -224,6 +229,17 @@ class Player(StrMixin):
     def invalidateHand(self):
         """some source for the computation of current hand changed"""
         self._hand = None
+        self._handParts = None
+
+    def __changeHandParts(self, added=None, removed=None):
+        """a single tile was added or removed: apply that to
+        _handParts instead of invalidating them"""
+        self._hand = None
+        if self._handParts is not None:
+            if added:
+                self._handParts.add(added)
+            if removed:
+                self._handParts.remove(removed)
 
     @property
     def hand(self):
@@ -233,6 +249,11 @@ class Player(StrMixin):
         elif Debug.hand:
             _ = self.__computeHand()
             assert self._hand == self.__computeHand(), '{} != {}'.format(_, self._hand)
+            if self._handParts is not None:
+                parts = self.__buildHandParts()
+                assert (parts.tiles, parts.tilesInHand, parts.bonusMelds) == (
+                    self._handParts.tiles, self._handParts.tilesInHand, self._handParts.bonusMelds), \
+                    'incremental hand parts differ for {}'.format(self._hand)
         return self._hand
 
     @property
@@ -359,7 +380,7 @@ class Player(StrMixin):
                                 (tile, ''.join(self._concealedTiles)))
         if tile is self.lastTile:
             self.lastTile = None
-        self._hand = None
+        self.__changeHandParts(removed=tile)
 
     def addConcealedTiles(self, tiles, animated=False):  # pylint: disable=unused-argument
         """add to my tiles"""
@@ -370,7 +391,7 @@ class Player(StrMixin):
             else:
                 assert tile.isConcealed, '%s data=%s' % (tile, tiles)
                 self._concealedTiles.append(tile)
-        self._hand = None
+            self.__changeHandParts(added=tile)
 
     def syncHandBoard(self, adding=None):
         """virtual: synchronize display"""
@@ -393,23 +414,32 @@ class Player(StrMixin):
         """used when somebody else discards a tile"""
         assert not self._concealedTiles[0].isKnown
         self._concealedTiles[0] = tileName
-        self._hand = None
+        self.__changeHandParts(added=tileName, removed=Tile.unknown)
+
+    def __buildHandParts(self):
+        """HandParts from scratch"""
+        return HandParts(
+            melds=self._exposedMelds + self._concealedMelds,
+            rest=self._concealedTiles,
+            bonusTiles=self._bonusTiles)
 
     def __computeHand(self):
         """returns Hand for this player"""
         assert not (self._concealedMelds and self._concealedTiles)
+        if self._handParts is None:
+            self._handParts = self.__buildHandParts()
         melds = list()
         melds.extend(str(x) for x in self._exposedMelds)
         melds.extend(str(x) for x in self._concealedMelds)
         if self._concealedTiles:
-            melds.append('R' + ''.join(str(x) for x in sorted(self._concealedTiles)))
+            melds.append('R' + ''.join(self._handParts.rest))
         melds.extend(str(x) for x in self._bonusTiles)
         melds.append(self.mjString())
         if self.lastTile:
             melds.append(
                 'L%s%s' %
                 (self.lastTile, self.lastMeld if self.lastMeld else ''))
-        return Hand(self, ' '.join(melds))
+        return Hand(self, ' '.join(melds), parts=self._handParts)
 
     def _computeHandWithDiscard(self, discard):
         """what if"""
@@ -420,11 +450,15 @@ class Player(StrMixin):
             if discard:
                 self.lastTile = discard
                 self._concealedTiles.append(discard)
+                if self._handParts is not None:
+                    self._handParts.add(discard)
             return self.__computeHand()
         finally:
             self.lastTile, self.lastSource = save
             if discard:
                 self._concealedTiles = self._concealedTiles[:-1]
+                if self._handParts is not None:
+                    self._handParts.remove(discard)
 
     def scoringString(self):
         """helper for HandBoard.__str__"""
@@ -460,6 +494,29 @@ class Player(StrMixin):
         visible += sum(x.exposed == lowerTile for x in hand.tiles)
         return 4 - visible
 
+    def tilesAvailable(self, hand):
+        """tileAvailable for all tiles at once: a list of counts,
+        indexed like TileCounts.tiles"""
+        slots = TileCounts.slots
+        visible = [0] * len(TileCounts.tiles)
+        for tile, count in self.game.discardedTiles.items():
+            if tile.isExposed and tile in slots:
+                visible[slots[tile]] += count
+        lastDiscard = self.game.lastDiscard
+        if hand.lenOffset == 0 and lastDiscard and lastDiscard in slots:
+            slot = slots[lastDiscard]
+            if visible[slot]:
+                # the last discarded one is available to us since we can claim it
+                visible[slot] -= 1
+        for player in self.others():
+            for tile, count in player.visibleTiles.items():
+                if tile in slots:
+                    visible[slots[tile]] += count
+        for tile in hand.tiles:
+            if tile in slots:
+                visible[slots[tile]] += 1
+        return list(4 - x for x in visible)
+
     def violatesOriginalCall(self, discard=None):
         """called if discarding discard violates the Original Call"""
         if not self.originalCall or not self.mayWin:
@@ -525,7 +582,7 @@ class PlayingPlayer(Player):
         self.lastMeld = lastMeld
         self._concealedMelds = melds
         self._concealedTiles = []
-        self._hand = None
+        self.invalidateHand()
         if Debug.mahJongg:
             self.game.debug('  hand becomes {}'.format(self.hand))
             self._hand = None
@@ -606,8 +663,10 @@ class PlayingPlayer(Player):
 
     def __maySayOriginalCall(self, dummyMove):
         """returns True if Original Call is possible"""
-        for tileName in sorted(set(self.concealedTiles)):
-            newHand = self.hand - tileName
+        tileNames = sorted(set(self.concealedTiles))
+        newHands = self.hand.handsMinus(tileNames)
+        for tileName in tileNames:
+            newHand = newHands[tileName]
             if newHand.callingHands:
                 if Debug.originalCall:
                     self.game.debug(
@@ -671,7 +730,7 @@ class PlayingPlayer(Player):
                 self._concealedTiles[idx] = dst
             if self.lastTile and not self.lastTile.isKnown:
                 self.lastTile = None
-            self._hand = None
+            self.invalidateHand()
             self.syncHandBoard()
 
     def showConcealedMelds(self, concealedMelds, ignoreDiscard=None):
@@ -695,7 +754,7 @@ class PlayingPlayer(Player):
             msg = i18nE(
                 '%1 claiming MahJongg: She did not pass all concealed tiles to the server')
             return msg, self.name
-        self._hand = None
+        self.invalidateHand()
 
     def robTileFrom(self, tile):
         """used for robbing the kong from this player"""
@@ -710,7 +769,7 @@ class PlayingPlayer(Player):
             raise Exception('robTileFrom: no meld found with %s' % tile)
         self.game.lastDiscard = tile.concealed
         self.lastTile = None  # our lastTile has just been robbed
-        self._hand = None
+        self.invalidateHand()
 
     def robsTile(self):
         """True if the player is robbing a tile"""
@@ -722,9 +781,12 @@ class PlayingPlayer(Player):
             return True
         if any(not x.isKnown for x in self._concealedTiles):
             return True
-        if str(self.hand) == score:
+        if score.startswith('#'):
+            if self.hand.digest == score:
+                return True
+        elif str(self.hand) == score:
             return True
-        self.game.debug('%s localScore:%s' % (self, self.hand))
+        self.game.debug('%s localScore:%s %s' % (self, self.hand, self.hand.digest))
         self.game.debug('%s serverScore:%s' % (self, score))
         logWarning(
             'Game %s: client and server disagree about scoring, see logfile for details' %
@@ -791,7 +853,7 @@ class PlayingPlayer(Player):
         if self.lastTile in allMeldTiles:
             self.lastTile = self.lastTile.exposed
         self._exposedMelds.append(meld)
-        self._hand = None
+        self.invalidateHand()
         game.computeDangerous(self)
         return meld
 
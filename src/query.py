@@ -24,13 +24,19 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 """
 
 import os
+import re
+import atexit
 import traceback
-import time
 import datetime
 import random
-from collections import defaultdict
+import queue
+import threading
+import time
+from collections import defaultdict, OrderedDict
 import sqlite3
 
+from twisted.internet.defer import Deferred, succeed
+
 from mi18n import i18n, i18ncE
 from util import Duration
 from log import logInfo, logWarning, logException, logError, logDebug, id4
@@ -50,6 +56,9 @@ class DBCursor(sqlite3.Cursor):
 
     # pylint: disable=no-member
 
+    # how often we try again if another process holds the lock
+    retries = 2
+
     def __init__(self, dbHandle):
         sqlite3.Cursor.__init__(self, dbHandle)
         self.statement = None
@@ -65,7 +74,7 @@ class DBCursor(sqlite3.Cursor):
         if not silent:
             logDebug(str(self))
         try:
-            for _ in range(10):
+            for attempt in range(1, self.retries + 2):
                 try:
                     with Duration(statement, 60.0 if Debug.neutral else 2.0):
                         if isinstance(parameters, list):
@@ -77,14 +86,11 @@ class DBCursor(sqlite3.Cursor):
                             sqlite3.Cursor.execute(self, statement)
                     break
                 except sqlite3.OperationalError as exc:
+                    # sqlite already waited DBHandle.busyTimeout for the lock
+                    if attempt > self.retries or not self.isBusy(exc):
+                        raise
                     logDebug(
-                        '{} failed after {} tries:{}'.format(self, _, ' '.join(exc.args)))
-                    time.sleep(1)
-                else:
-                    break
-            else:
-                raise sqlite3.OperationalError(
-                    'Failed after 10 tries:{}'.format(self))
+                        '{} failed after {} tries:{}'.format(self, attempt, ' '.join(exc.args)))
             self.failure = None
         except sqlite3.Error as exc:
             self.failure = exc
@@ -101,6 +107,12 @@ class DBCursor(sqlite3.Cursor):
                 raise QueryException(msg)
             return
 
+    @staticmethod
+    def isBusy(exc):
+        """does exc only say that somebody else holds the lock?"""
+        msg = ' '.join(str(x) for x in exc.args)
+        return 'locked' in msg or 'busy' in msg
+
     def __str__(self):
         """the statement"""
         if self.parameters is not None:
@@ -115,14 +127,42 @@ class DBHandle(sqlite3.Connection):
 
     # pylint: disable=no-member
 
+    # pragmas for every connection. Options.dbProfile selects one.
+    # The journal mode WAL is stored in the data base file: readers
+    # never wait for a writer and a commit needs less fsyncs
+    profiles = {
+        # WAL is stored in the file: set the default mode explicitly
+        'safe': (
+            ('journal_mode', 'DELETE'),),
+        'fast': (
+            ('journal_mode', 'WAL'),
+            ('synchronous', 'NORMAL'),
+            ('cache_size', -8000),
+            ('mmap_size', 64 * 1024 * 1024)),
+    }
+
+    # seconds sqlite waits for a lock held by another connection
+    busyTimeout = 10.0
+
+    # the same for Query with mayDelay: those try again later
+    delayTimeout = 0.05
+
+    # compiled statements kept per connection, see Query
+    cachedStatements = 256
+
     def __init__(self, path: str):
         assert Internal.db is None, id(self)
         Internal.db = self
         self.inTransaction = None
         self.path = path
         self.identifier = None
+        if Debug.sqlTime and Duration.totals is None:
+            Duration.totals = {}
         try:
-            sqlite3.Connection.__init__(self, self.path, timeout=10.0)
+            sqlite3.Connection.__init__(
+                self, self.path, timeout=self.busyTimeout,
+                cached_statements=self.cachedStatements)
+            self.applyProfile(self)
         except sqlite3.Error as exc:
             if hasattr(exc, 'message'):
                 msg = exc.message
@@ -151,6 +191,35 @@ class DBHandle(sqlite3.Connection):
         if Debug.sql:
             logDebug('finished transaction')
 
+    @classmethod
+    def connect(cls, path, timeout):
+        """a plain connection with our profile, for other threads"""
+        result = sqlite3.connect(
+            path, timeout=timeout, cached_statements=cls.cachedStatements)
+        cls.applyProfile(result)
+        return result
+
+    @classmethod
+    def applyProfile(cls, connection):
+        """set the pragmas of Options.dbProfile"""
+        if Options.dbProfile not in cls.profiles:
+            logWarning('unknown data base profile {}, using safe'.format(Options.dbProfile))
+            return
+        for pragma, value in cls.profiles[Options.dbProfile]:
+            current = connection.execute('pragma {}'.format(pragma)).fetchone()
+            if current and str(current[0]).lower() == str(value).lower():
+                continue
+            try:
+                connection.execute('pragma {}={}'.format(pragma, value))
+            except sqlite3.OperationalError as exc:
+                # another process may still use WAL
+                logWarning('{}: cannot set {} to {}: {}'.format(
+                    connection, pragma, value, ' '.join(str(x) for x in exc.args)))
+
+    def setBusyTimeout(self, seconds):
+        """how long sqlite waits for the lock"""
+        self.execute('pragma busy_timeout={}'.format(int(seconds * 1000)))
+
     @staticmethod
     def dbPath():
         """
@@ -199,7 +268,14 @@ class DBHandle(sqlite3.Connection):
             else:
                 logDebug('Closing DBHandle %s: %s' % (self, self.path))
         if self is Internal.db:
+            if Query.delayed:
+                # the last chance, now we wait for the lock
+                Query.writeDelayed(wait=True)
+            WriteBehind.stop()
             Internal.db = None
+            if Duration.totals:
+                logDebug('sql statements by time spent:\n' + '\n'.join(Duration.report()))
+                Duration.totals = {}
         try:
             self.commit(silent=True)
         except sqlite3.Error:
@@ -212,7 +288,7 @@ class DBHandle(sqlite3.Connection):
     @staticmethod
     def hasTable(table):
         """does the table contain table?"""
-        return bool(len(Query('SELECT name FROM sqlite_master WHERE type="table" AND name="%s"' % table).records))
+        return bool(len(Query('SELECT name FROM sqlite_master WHERE type="table" AND name=?', (table,)).records))
 
     def tableHasField(self, table, field):
         """does the table contain a column named field?"""
@@ -232,29 +308,66 @@ class Query:
         'kajongg name for local game server',
         'Local Game')
 
+    # a worker process of the game server does not write,
+    # it passes changes to the front end. See serverworker.py
+    writer = None
+
+    # writes which found the data base locked, see mayDelay
+    delayed = []
+
+    # seconds until we try them again, doubled after every failure
+    firstDelay = 0.1
+    maxDelay = 5.0
+    delay = firstDelay
+
     def __init__(self, statement, args=None,
-                 silent=False, mayFail=False, failSilent=False):
+                 silent=False, mayFail=False, failSilent=False, mayDelay=False):
         """we take one sql statement.
         Do prepared queries by passing the parameters in args.
         If args is a list of lists, execute the prepared query for every sublist.
         Use Internal.db for db access.
-        Else if the default dbHandle (Internal.db) is defined, use it."""
+        Else if the default dbHandle (Internal.db) is defined, use it.
+        mayDelay: nobody reads the result soon. If another process holds
+        the lock, the reactor tries again later instead of waiting.
+        Other statements first write those delayed changes, waiting
+        for the lock, so the order of changes is kept."""
         # pylint: disable=too-many-branches
         silent |= not Debug.sql
         self.msg = None
         self.records = []
         self.statement = statement
         self.args = args
-        if Internal.db:
+        WriteBehind.flush(statement)
+        if Query.delayed and not mayDelay:
+            Query.writeDelayed(wait=True)
+        if Query.writer and not statement.lstrip().lower().startswith('select'):
+            Query.writer(statement, args)
+            self.cursor = None
+            self.failure = None
+        elif mayDelay and Query.delayed:
+            # keep the order of changes
+            Query.delayed.append((statement, args))
+            self.cursor = None
+            self.failure = None
+        elif Internal.db:
             self.cursor = Internal.db.cursor(
                 DBCursor)  # pylint: disable=no-member
-            self.cursor.execute(
-                statement,
-                args,
-                silent=silent,
-                mayFail=mayFail,
-                failSilent=failSilent)
+            mayDelay = mayDelay and Internal.reactor and not Internal.db.inTransaction
+            if mayDelay:
+                Internal.db.setBusyTimeout(DBHandle.delayTimeout)
+            try:
+                self.cursor.execute(
+                    statement,
+                    args,
+                    silent=silent,
+                    mayFail=mayFail or mayDelay,
+                    failSilent=failSilent or mayDelay)
+            finally:
+                if mayDelay:
+                    Internal.db.setBusyTimeout(DBHandle.busyTimeout)
             self.failure = self.cursor.failure
+            if mayDelay and self.failure:
+                self.__delay()
             self.records = list(self.cursor.fetchall())
             if not Internal.db.inTransaction:
                 Internal.db.commit()
@@ -266,6 +379,49 @@ class Query:
         if self.records and Debug.sql:
             logDebug('result set:{}'.format(self.records))
 
+    def __delay(self):
+        """the cursor failed, maybe try again later"""
+        if not DBCursor.isBusy(self.failure):
+            msg = 'ERROR in {}: {} for {}'.format(Internal.db.path, self.failure, self.cursor)
+            logError(msg)
+            raise QueryException(msg)
+        if Debug.sql:
+            logDebug('delaying {}'.format(self))
+        Query.delayed.append((self.statement, self.args))
+        Internal.reactor.callLater(Query.delay, Query.writeDelayed)
+        self.failure = None
+
+    @classmethod
+    def writeDelayed(cls, wait=False):
+        """write the delayed changes in their order. If the data base
+        is still locked, try again later. wait: wait for the lock
+        like any other statement and do not try again"""
+        while cls.delayed and Internal.db:
+            if Internal.db.inTransaction and not wait:
+                # a transaction of somebody else, do not mix
+                busy = True
+            else:
+                statement, args = cls.delayed[0]
+                cursor = Internal.db.cursor(DBCursor)  # pylint: disable=no-member
+                if not wait:
+                    Internal.db.setBusyTimeout(DBHandle.delayTimeout)
+                try:
+                    cursor.execute(statement, args, silent=not Debug.sql, mayFail=True, failSilent=True)
+                finally:
+                    if not wait:
+                        Internal.db.setBusyTimeout(DBHandle.busyTimeout)
+                busy = cursor.failure and DBCursor.isBusy(cursor.failure)
+            if busy and not wait:
+                cls.delay = min(cls.delay * 2, cls.maxDelay)
+                Internal.reactor.callLater(cls.delay, cls.writeDelayed)
+                return
+            if cursor.failure:
+                logError('ERROR in {}: {} for {}'.format(Internal.db.path, cursor.failure, cursor))
+            cls.delayed.pop(0)
+            Internal.db.commit()
+        cls.delayed = []
+        cls.delay = cls.firstDelay
+
     def __str__(self):
         return '{} {}'.format(self.statement,
                               'args=' + ','.join(str(x) for x in self.args) if self.args else '')
@@ -278,6 +434,212 @@ class Query:
             return 0
 
 
+class QueryStream:
+
+    """like Query for select statements, but the records are only
+    read when needed: iterate over it or call fetch(). Use this if
+    the result can be big. Every fetch is a Query of its own with
+    limit and offset, so no cursor stays open and holds a lock
+    between pages. The statement needs an order by and no limit"""
+
+    pageSize = 200
+
+    def __init__(self, statement, args=None):
+        self.statement = statement
+        self.args = tuple(args or ())
+        self.offset = 0
+        self.exhausted = not Internal.db
+
+    def fetch(self, count=None):
+        """returns the next count records, default is pageSize"""
+        if self.exhausted:
+            return []
+        count = count or self.pageSize
+        query = Query(
+            self.statement + ' limit ? offset ?',
+            self.args + (count, self.offset))
+        result = query.records
+        self.offset += len(result)
+        if len(result) < count:
+            self.close()
+        return result
+
+    def __iter__(self):
+        while not self.exhausted:
+            for record in self.fetch():
+                yield record
+
+    def close(self):
+        """we do not want more records"""
+        self.exhausted = True
+
+    def __str__(self):
+        return '{} {}'.format(self.statement,
+                              'args=' + ','.join(str(x) for x in self.args) if self.args else '')
+
+
+class WriteBehind:
+
+    """rows which nobody reads soon, like the scores of a hand.
+    A background thread writes them with its own connection. It
+    writes everything waiting in the queue in one transaction, so
+    the hands of several tables share one fsync. Before a Query uses
+    a table with rows waiting, we wait until the queue is written: so
+    that Query sees all rows added before and the order of changes is
+    kept. Other queries do not wait.
+
+    add returns a Deferred. It fires in the main thread when the rows
+    are written, or fails with QueryException"""
+
+    # put() blocks if the writer thread falls that many batches behind
+    maxBatches = 200
+
+    # how often we try again if another process holds the lock
+    retries = 5
+
+    # the writer thread may wait for the lock
+    busyTimeout = 5.0
+
+    # finds the table an insert statement writes to
+    tableRe = re.compile(r'\binto\s+(\w+)', re.IGNORECASE)
+
+    instance = None
+
+    def __init__(self, path):
+        self.path = path
+        # the tables with rows waiting. Only for the main thread
+        self.tables = set()
+        self.queue = queue.Queue(self.maxBatches)
+        # (Deferreds, failure message) for every written batch
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.__run, name='WriteBehind')
+        self.thread.daemon = True
+        self.thread.start()
+
+    @classmethod
+    def add(cls, statement, rows):
+        """write rows with statement, sometimes later. Returns a Deferred"""
+        if Query.writer or not Internal.db:
+            # a worker of the game server or no data base at all
+            Query(statement, list(rows))
+            return succeed(None)
+        if cls.instance is None or cls.instance.path != Internal.db.path:
+            cls.stop()
+            cls.instance = cls(Internal.db.path)
+        result = Deferred()
+        cls.instance.tables.update(x.lower() for x in cls.tableRe.findall(statement))
+        cls.instance.queue.put((statement, list(rows), result))
+        return result
+
+    @classmethod
+    def flush(cls, statement=None):
+        """wait until all rows are written. With statement, only
+        if it uses a table with rows waiting"""
+        instance = cls.instance
+        if instance:
+            if statement is None or instance.uses(statement):
+                if instance.queue.unfinished_tasks:
+                    instance.queue.join()
+                instance.tables.clear()
+            instance.deliver()
+
+    def uses(self, statement):
+        """does statement use a table with rows waiting?"""
+        if not self.tables:
+            return False
+        words = set(re.findall(r'\w+', statement.lower()))
+        return not words.isdisjoint(self.tables)
+
+    @classmethod
+    def stop(cls):
+        """write all rows and end the thread"""
+        instance = cls.instance
+        if instance:
+            cls.instance = None
+            instance.queue.put(None)
+            instance.thread.join()
+            instance.deliver()
+
+    def deliver(self):
+        """fire the Deferreds of the written batches. Only in the main thread"""
+        while True:
+            try:
+                deferreds, failure = self.results.get_nowait()
+            except queue.Empty:
+                return
+            for deferred in deferreds:
+                if failure:
+                    deferred.errback(QueryException(failure))
+                else:
+                    deferred.callback(None)
+
+    def __batch(self):
+        """wait for the next batch, then add everything else waiting.
+        Returns the rows per statement, the Deferreds, the number of
+        queue items and whether we should stop"""
+        items = [self.queue.get()]
+        while True:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        batch = OrderedDict()
+        deferreds = []
+        for item in items:
+            if item:
+                statement, rows, deferred = item
+                batch.setdefault(statement, []).extend(rows)
+                deferreds.append(deferred)
+        return batch, deferreds, len(items), None in items
+
+    def __run(self):
+        """the writer thread"""
+        connection = DBHandle.connect(self.path, self.busyTimeout)
+        try:
+            while True:
+                batch, deferreds, itemCount, finished = self.__batch()
+                try:
+                    failure = self.__write(connection, batch)
+                    if deferreds:
+                        self.results.put((deferreds, failure))
+                        reactor = Internal.reactor
+                        if reactor and reactor.running:
+                            reactor.callFromThread(self.deliver)
+                finally:
+                    for _ in range(itemCount):
+                        self.queue.task_done()
+                if finished:
+                    break
+        finally:
+            connection.close()
+
+    def __write(self, connection, batch):
+        """one transaction for the whole batch. Returns
+        None or the failure message"""
+        if not batch:
+            return None
+        for attempt in range(1, self.retries + 2):
+            try:
+                with Duration('WriteBehind', 60.0 if Debug.neutral else 2.0):
+                    with connection:
+                        for statement, rows in batch.items():
+                            connection.executemany(statement, rows)
+                if Debug.sql:
+                    logDebug('WriteBehind wrote {} rows'.format(sum(len(x) for x in batch.values())))
+                return None
+            except sqlite3.Error as exc:
+                if attempt <= self.retries and DBCursor.isBusy(exc):
+                    # sqlite already waited busyTimeout, the transaction is rolled back
+                    time.sleep(0.1 * attempt)
+                    continue
+                return 'WriteBehind cannot write {}: {}'.format(
+                    ', '.join(batch), ' '.join(str(x) for x in exc.args))
+
+
+# also if nobody closes Internal.db
+atexit.register(WriteBehind.stop)
+
+
 def initDb():
     """open the db, create or update it if needed.
     sets Internal.db."""
@@ -94,4 +94,8 @@ class CountingRandom(Random):
     def shuffle(self, listValue, func=None):
         """add debug output to shuffle"""
         with CountRandomCalls(self, 'shuffle({})'.format(listValue)):
-            Random.shuffle(self, listValue, func)
+            if func is None:
+                # python 3.11 removed the parameter
+                Random.shuffle(self, listValue)
+            else:
+                Random.shuffle(self, listValue, func)
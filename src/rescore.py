@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Wolfgang Rohdewald <wolfgang@rohdewald.de>
+
+Kajongg is free software you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+Score the hands of all archived games again, for example after the
+scoring engine or the rules changed. The hands are read from the score
+table in chunks, the chunks are scored by worker processes. Every
+worker keeps one minimal game per ruleset hash: no data base, no server,
+no clients.
+
+Only points and manualrules (the names of the used rules) are compared.
+Rows with scores computed manually are left alone.
+Payments and balances depend on the whole game and are left alone.
+With --update, changed rows are written back.
+"""
+
+from __future__ import print_function
+
+import signal
+signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+import collections
+import multiprocessing
+import os
+import sys
+import time
+
+from optparse import OptionParser
+
+from common import Internal, Options, Debug
+Internal.isServer = True
+Internal.logPrefix = 'S'
+
+OPTIONS = None
+
+# s.hand is unique within a game but not over penalties, so we
+# exclude them. The east wins only matter for EastWonNineTimesInARow,
+# CASE makes sure we only count them when they can matter.
+SELECT = """select s.rowid, g.ruleset, s.data, s.wind, s.prevailing,
+    w.wind, s.notrotated, s.points, s.manualrules,
+    case when s.notrotated >= 8 and w.wind = 'E' then
+        (select count(1) from score e where e.game = s.game and e.won = 1
+         and e.wind = 'E' and e.prevailing = s.prevailing and e.hand < s.hand)
+    else 0 end
+    from score s join game g on g.id = s.game
+    left join score w on w.game = s.game and w.hand = s.hand and w.won = 1
+    where s.penalty = 0 and s.data is not null
+    order by g.ruleset, s.game, s.hand"""
+
+ScoreRow = collections.namedtuple(
+    'ScoreRow',
+    'rowid rulesetId data wind prevailing winnerWind notRotated points manualrules eastWins')
+
+
+class ScoringContext:
+
+    """one game per ruleset hash, only used for scoring hands.
+    Lives in the worker processes"""
+
+    games = {}
+
+    @classmethod
+    def game(cls, rulesetList):
+        """the game for this ruleset. rulesetList is what Ruleset.toList returns"""
+        rulesetHash = rulesetList[0][1]
+        if rulesetHash not in cls.games:
+            from wind import Wind
+            from rule import Ruleset
+            from game import PlayingGame
+            ruleset = Ruleset.cached(rulesetList)
+            game = PlayingGame(list(tuple([wind, str(wind.char)]) for wind in Wind.all4), ruleset)
+            for idx, wind in enumerate(Wind.all4):
+                game.players[idx].wind = wind
+            cls.games[rulesetHash] = game
+        return cls.games[rulesetHash]
+
+    @classmethod
+    def score(cls, game, row):
+        """returns points and manualrules for row"""
+        from wind import Wind
+        from hand import Hand
+        game.roundsFinished = Wind(row.prevailing).__index__()
+        game.notRotated = row.notRotated
+        game.winner = game.players[Wind(row.winnerWind)] if row.winnerWind else None
+        player = game.players[Wind(row.wind)]
+        player.clearCache()
+        game.eastMJCounts.clear()
+        if row.eastWins:
+            game.eastMJCounts[(game.winner.name, row.prevailing)] = row.eastWins
+        hand = Hand(player, row.data)
+        points = hand.total() if game.winner else 0
+        return points, '||'.join(x.rule.name for x in hand.usedRules)
+
+
+def rescoreChunk(rulesetList, rows):
+    """runs in a worker process. Returns a list with
+    (rowid, points, manualrules) for rows scoring differently and
+    a list with (rowid, error message) for rows we cannot score"""
+    from mi18n import i18n
+    changed = []
+    failed = []
+    game = ScoringContext.game(rulesetList)
+    manually = ('Score computed manually', i18n('Score computed manually'))
+    for row in rows:
+        row = ScoreRow(*row)
+        if row.manualrules in manually:
+            # the hand is not what the score was computed from
+            continue
+        try:
+            points, manualrules = ScoringContext.score(game, row)
+        except Exception as exc:  # pylint: disable=broad-except
+            failed.append((row.rowid, '{}: {}'.format(row.data, exc)))
+            continue
+        if points != row.points or manualrules != row.manualrules:
+            changed.append((row.rowid, points, manualrules))
+    return changed, failed
+
+
+def chunks(cursor, chunkSize):
+    """yields (rulesetId, rows). All rows in a chunk have the same ruleset"""
+    rows = []
+    while True:
+        records = cursor.fetchmany(chunkSize)
+        if not records:
+            break
+        for record in records:
+            if rows and (len(rows) == chunkSize or rows[-1][1] != record[1]):
+                yield rows[0][1], rows
+                rows = []
+            rows.append(tuple(record))
+    if rows:
+        yield rows[0][1], rows
+
+
+def rulesetLists():
+    """all rulesets used by archived games, as lists. The id
+    of a ruleset is only unique within one data base"""
+    from query import Query
+    from rule import Ruleset
+    result = {}
+    for record in Query('select distinct ruleset from game').records:
+        rulesetId = record[0] or 1
+        result[record[0]] = Ruleset.cached(rulesetId).toList()
+    return result
+
+
+def rescore(pool):
+    """score all hands, returns changed and failed rows"""
+    rulesets = rulesetLists()
+    cursor = Internal.db.cursor()
+    cursor.execute(SELECT)
+    changed = []
+    failed = []
+    pending = collections.deque()
+    done = 0
+    start = time.time()
+
+    def collect():
+        """wait for the oldest chunk"""
+        nonlocal done
+        rowCount, result = pending.popleft()
+        chunkChanged, chunkFailed = result.get()
+        changed.extend(chunkChanged)
+        failed.extend(chunkFailed)
+        done += rowCount
+        if OPTIONS.verbose:
+            print('{} hands in {:.1f} seconds'.format(done, time.time() - start))
+
+    for rulesetId, rows in chunks(cursor, OPTIONS.chunk):
+        pending.append((len(rows), pool.apply_async(rescoreChunk, (rulesets[rulesetId], rows))))
+        # do not read the whole table ahead of the workers
+        if len(pending) > 2 * OPTIONS.workers:
+            collect()
+    while pending:
+        collect()
+    cursor.close()
+    return done, changed, failed
+
+
+def update(changed):
+    """write back the new scores in one transaction"""
+    from query import Query
+    with Internal.db:
+        Query('update score set points=?, manualrules=? where rowid=?',
+              list((points, manualrules, rowid) for rowid, points, manualrules in changed))
+
+
+def parse_options():
+    """parse options"""
+    parser = OptionParser()
+    parser.add_option(
+        '', '--db', dest='dbPath',
+        help='rescore the games in data base DB. Default is the data base of the local game server',
+        metavar='DB')
+    parser.add_option(
+        '', '--workers', dest='workers', type=int, default=multiprocessing.cpu_count(),
+        help='use WORKERS processes for scoring. Default is the number of CPUs', metavar='WORKERS')
+    parser.add_option(
+        '', '--chunk', dest='chunk', type=int, default=1000,
+        help='send HANDS hands at once to a worker', metavar='HANDS')
+    parser.add_option(
+        '', '--update', dest='update', action='store_true', default=False,
+        help='write the new scores into the data base')
+    parser.add_option(
+        '', '--verbose', dest='verbose', action='store_true', default=False,
+        help='show progress and all changed hands')
+    parser.add_option(
+        '', '--debug', dest='debug',
+        help=Debug.help())
+    return parser.parse_args()
+
+
+def main():
+    """rescore all archived games"""
+    if OPTIONS.debug:
+        msg = Debug.setOptions(OPTIONS.debug)
+        if msg:
+            print(msg)
+            sys.exit(2)
+    import predefined
+    from query import initDb, DBHandle
+    predefined.load()
+    Options.dbPath = OPTIONS.dbPath
+    if not os.path.exists(DBHandle.dbPath()):
+        raise SystemExit('{} does not exist'.format(DBHandle.dbPath()))
+    # the workers must not inherit the data base connection
+    pool = multiprocessing.Pool(OPTIONS.workers)
+    try:
+        initDb()
+        start = time.time()
+        done, changed, failed = rescore(pool)
+    finally:
+        pool.close()
+        pool.join()
+    print('{} hands scored in {:.1f} seconds, {} changed, {} failed'.format(
+        done, time.time() - start, len(changed), len(failed)))
+    if OPTIONS.verbose:
+        for rowid, points, manualrules in changed:
+            print('changed {}: {} {}'.format(rowid, points, manualrules))
+    for rowid, msg in failed:
+        print('failed {}: {}'.format(rowid, msg))
+    if OPTIONS.update and changed:
+        update(changed)
+        print('updated {} rows in {}'.format(len(changed), Internal.db.path))
+    Internal.db.close()
+
+if __name__ == '__main__':
+    OPTIONS, ARGS = parse_options()
+    main()
@@ -22,6 +22,7 @@ Read the user manual for a description of the interface to this scoring engine
 """
 
 import types
+from itertools import chain
 from hashlib import md5
 
 from common import Internal, Debug
@@ -29,6 +30,7 @@ from common import StrMixin
 from log import logException, logDebug
 from mi18n import i18n, i18nc, i18nE, i18ncE, english
 from query import Query
+from tile import Tile
 
 
 class Score(StrMixin):
@@ -248,6 +250,115 @@ class RuleList(list):
         self.add(rule)
 
 
+class ScoringPlan:
+
+    """built once per ruleset. For a hand, we first find its features:
+    which groups of tiles, chows, exposed melds, the last source etc.
+    Then we only look at the hand, winner and loser rules whose
+    RuleCode.needs are all among those features, in the order
+    of the ruleset. The candidates are cached per feature set"""
+
+    honors = set(Tile.honors)
+
+    def __init__(self, ruleset):
+        self.ruleLists = dict(
+            handRules=tuple(ruleset.handRules),
+            winnerRules=tuple(ruleset.winnerRules),
+            loserRules=tuple(ruleset.loserRules))
+        self.hasExclusiveRules = any(
+            'absolute' in x.options for x in ruleset.allRules if isinstance(x, Rule))
+        self.ruleset = ruleset
+        self.gameRules = tuple(
+            x for x in ruleset.allRules if isinstance(x, Rule) and hasattr(x, 'gameState'))
+        # HandCache entries refer to rules by name
+        self.rulesByName = dict((x.name, x) for x in ruleset.allRules)
+        self.mjScore = Score(
+            max([0] + list(x.score.points for x in ruleset.mjRules)),
+            max([0] + list(x.score.doubles for x in ruleset.mjRules)),
+            max([0] + list(x.score.limits for x in ruleset.mjRules)))
+        self.__candidates = {}
+
+    def gameState(self, game):
+        """what the rules look at in game beyond the hand, see RuleCode"""
+        return tuple(x.gameState(game) for x in self.gameRules)
+
+    @staticmethod
+    def meldFeatures(melds):
+        """the features only depending on how the tiles are arranged into melds"""
+        result = set()
+        result.add('chows' if any(x.isChow for x in melds) else 'noChows')
+        if not any(x.isExposed and not x.isClaimedKong for x in melds):
+            result.add('concealed')
+        return result
+
+    @classmethod
+    def features(cls, hand):
+        """what the rules might want to know about hand"""
+        suits = hand.suits
+        result = cls.meldFeatures(hand.melds)
+        result |= set(hand.announcements)
+        result.add(hand.lastSource)
+        result.add('honors' if suits & cls.honors else 'noHonors')
+        if Tile.dragon in suits:
+            result.add('dragons')
+        if Tile.wind in suits:
+            result.add('winds')
+        colors = len(suits - cls.honors)
+        if colors == 0:
+            result.add('noColors')
+        elif colors == 1:
+            result.add('oneColor')
+        if hand.lastTile:
+            result.add('lastTile')
+        if hand.bonusMelds:
+            result.add('bonus')
+        return frozenset(result)
+
+    def rules(self, listName, features):
+        """the rules of ruleset.listName which may apply to a hand with features"""
+        key = (listName, features)
+        result = self.__candidates.get(key)
+        if result is None:
+            result = tuple(x for x in self.ruleLists[listName] if x.needs <= features)
+            self.__candidates[key] = result
+        return result
+
+    def unusedTileRules(self, hand):
+        """the tilesOnly rules which were asked for the won hand but
+        do not apply: they do not apply to any other arrangement of
+        its tiles either. If we cannot know, return None"""
+        if any(x.rule.score.limits or 'absolute' in x.rule.options for x in hand.usedRules):
+            # usedRules only holds the winning rules
+            return None
+        features = self.features(hand)
+        asked = set(chain(self.rules('handRules', features), self.rules('winnerRules', features)))
+        return frozenset(x for x in asked if x.tilesOnly) - set(x.rule for x in hand.usedRules)
+
+    def maxTotal(self, melds, features, excluded=frozenset()):
+        """an upper bound for the total of a won hand with melds and features:
+        as if every rule which might apply did apply, with the best MJ rule.
+        Rules in excluded are known not to apply"""
+        points = self.mjScore.points
+        doubles = self.mjScore.doubles
+        limits = self.mjScore.limits
+        rules = list(chain.from_iterable(x.possibleRules(self.ruleset) for x in melds))
+        rules.extend(self.rules('handRules', features))
+        rules.extend(self.rules('winnerRules', features))
+        for rule in rules:
+            if rule in excluded:
+                continue
+            score = rule.score
+            if score.points > 0:
+                points += score.points
+            if score.doubles > 0:
+                doubles += score.doubles
+            if score.limits > limits:
+                limits = score.limits
+        return max(
+            Score(points, doubles, ruleset=self.ruleset).total(),
+            Score(limits=limits, ruleset=self.ruleset).total())
+
+
 class UsedRule(StrMixin):
 
     """use this in scoring, never change class Rule.
@@ -341,6 +452,7 @@ class Ruleset:
         self.doublingMeldRules = []
         self.doublingHandRules = []
         self.standardMJRule = None
+        self.__plan = None
         self.meldRules = RuleList(1, i18n('Meld Rules'),
                                   i18n('Meld rules are applied to single melds independent of the rest of the hand'))
         self.handRules = RuleList(2, i18n('Hand Rules'),
@@ -376,6 +488,14 @@ into a situation where you have to pay a penalty"""))
         self.__dirty = dirty
         if dirty:
             self.__computeHash()
+            self.__plan = None
+
+    @property
+    def plan(self):
+        """the L{ScoringPlan}"""
+        if self.__plan is None:
+            self.__plan = ScoringPlan(self)
+        return self.__plan
 
     @property
     def hash(self):
@@ -469,6 +589,7 @@ into a situation where you have to pay a penalty"""))
                 self.standardMJRule = mjRule
                 break
         assert self.standardMJRule
+        self.__plan = ScoringPlan(self)
         return self
 
     def __loadQuery(self):
@@ -786,6 +907,8 @@ class Rule(RuleBase):
 
     ruleCode = {}
     limitHand = None
+    needs = frozenset()
+    tilesOnly = False
 
     @classmethod
     def memoize(cls, func, srcClass):
@@ -896,6 +1019,8 @@ class Rule(RuleBase):
                 # to call those things indirectly
                 # pylint: disable=attribute-defined-outside-init
                 self.redirectTo(code, self.__class__, memoize=True)
+                self.needs = frozenset(code.needs)
+                self.tilesOnly = code.tilesOnly
                 if hasattr(code, 'selectable'):
                     self.hasSelectable = True
             elif variant[0] == 'O':
@@ -21,11 +21,12 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 from tile import Tile, elements
 from tilesource import TileSource
 from meld import Meld, MeldList
-from common import IntDict
+from common import IntDict, Internal
 from wind import East
 from message import Message
 from query import Query
 from permutations import Permutations
+from tilecounts import TileCounts
 
 
 class RuleCode:
@@ -48,9 +49,34 @@ class RuleCode:
         This is used to find all winning hands which only need
         one tile: The calling hands (after calling)
 
+    needs lists hand features which must be present if appliesToHand
+    can ever be True, see ScoringPlan.features. Only list features
+    which really follow from appliesToHand, the hand rules are not
+    even asked if one of them is missing.
+
+    missingTiles(hand):
+        All rules for going MahJongg should have such a method. It
+        returns the number of tiles missing for this form, see
+        TileCounts. 0 if the hand has this form, None if we cannot
+        know. Only the tiles are looked at: if appliesToHand is True
+        for a complete hand, this must be 0.
+
+    gameState(game):
+        Rules whose appliesToHand looks at the game beyond the hand
+        must have such a method. It returns what they look at, Hand
+        puts it into the key for HandCache.
+
+    tilesOnly is True if appliesToHand only looks at the tiles, the
+    announcements, the last tile and the game but never at how the
+    tiles are arranged into melds. If such a rule does not apply
+    to one arrangement, it does not apply to any other arrangement
+    of the same hand either, see Hand.__arrange.
+
     """
 
     cache = ()
+    needs = ()
+    tilesOnly = False
 
 
 # pylint: disable=missing-docstring
@@ -65,6 +91,9 @@ class MJRule(RuleCode):
     def computeLastMelds(hand):
         """returns all possible last melds"""
 
+    def missingTiles(hand):
+        """unknown"""
+
 
 class DragonPungKong(RuleCode):
 
@@ -193,6 +222,8 @@ class DragonPair(RuleCode):
 
 class LastTileCompletesPairMinor(RuleCode):
 
+    needs = ('lastTile',)
+
     def appliesToHand(hand):
         return hand.lastMeld and hand.lastMeld.isPair and hand.lastTile.isMinor
 
@@ -211,12 +242,17 @@ class Season(RuleCode):
 
 class LastTileCompletesPairMajor(RuleCode):
 
+    needs = ('lastTile',)
+
     def appliesToHand(hand):
         return hand.lastMeld and hand.lastMeld.isPair and hand.lastTile.isMajor
 
 
 class LastFromWall(RuleCode):
 
+    needs = ('lastTile',)
+    tilesOnly = True
+
     def appliesToHand(hand):
         return hand.lastTile and hand.lastTile.isConcealed
 
@@ -229,18 +265,24 @@ class ZeroPointHand(RuleCode):
 
 class NoChow(RuleCode):
 
+    needs = ('noChows',)
+
     def appliesToHand(hand):
         return not any(x.isChow for x in hand.melds)
 
 
 class OnlyConcealedMelds(RuleCode):
 
+    needs = ('concealed',)
+
     def appliesToHand(hand):
         return not any((x.isExposed and not x.isClaimedKong) for x in hand.melds)
 
 
 class FalseColorGame(RuleCode):
 
+    needs = ('honors', 'oneColor')
+
     def appliesToHand(hand):
         dwSet = set(Tile.honors)
         return dwSet & hand.suits and len(hand.suits - dwSet) == 1
@@ -248,12 +290,17 @@ class FalseColorGame(RuleCode):
 
 class TrueColorGame(RuleCode):
 
+    needs = ('noHonors', 'oneColor')
+    tilesOnly = True
+
     def appliesToHand(hand):
         return len(hand.suits) == 1 and hand.suits < set(Tile.colors)
 
 
 class Purity(RuleCode):
 
+    needs = ('noHonors', 'oneColor', 'noChows')
+
     def appliesToHand(hand):
         return (len(hand.suits) == 1 and hand.suits < set(Tile.colors)
                 and not any(x.isChow for x in hand.melds))
@@ -261,6 +308,9 @@ class Purity(RuleCode):
 
 class ConcealedTrueColorGame(RuleCode):
 
+    needs = ('concealed',)
+    tilesOnly = True
+
     def appliesToHand(hand):
         if len(hand.suits) != 1 or hand.suits >= set(Tile.colors):
             return False
@@ -269,18 +319,26 @@ class ConcealedTrueColorGame(RuleCode):
 
 class OnlyMajors(RuleCode):
 
+    needs = ('noChows',)
+    tilesOnly = True
+
     def appliesToHand(hand):
-        return all(x.isMajor for x in hand.tiles)
+        return hand.allTilesAre('isMajor')
 
 
 class OnlyHonors(RuleCode):
 
+    needs = ('noColors',)
+    tilesOnly = True
+
     def appliesToHand(hand):
-        return all(x.isHonor for x in hand.tiles)
+        return hand.allTilesAre('isHonor')
 
 
 class HiddenTreasure(RuleCode):
 
+    needs = ('concealed', 'noChows', 'lastTile')
+
     def appliesToHand(hand):
         return (not any(((x.isExposed and not x.isClaimedKong) or x.isChow) for x in hand.melds)
                 and hand.lastTile and hand.lastTile.isConcealed
@@ -289,6 +347,8 @@ class HiddenTreasure(RuleCode):
 
 class BuriedTreasure(RuleCode):
 
+    needs = ('oneColor', 'noChows')
+
     def appliesToHand(hand):
         return (len(hand.suits - set(Tile.honors)) == 1
                 and sum(x.isPung for x in hand.melds) == 4
@@ -297,8 +357,11 @@ class BuriedTreasure(RuleCode):
 
 class AllTerminals(RuleCode):
 
+    needs = ('noHonors', 'noChows')
+    tilesOnly = True
+
     def appliesToHand(hand):
-        return all(x.isTerminal for x in hand.tiles)
+        return hand.allTilesAre('isTerminal')
 
 
 class StandardMahJongg(MJRule):
@@ -334,144 +397,43 @@ class StandardMahJongg(MJRule):
             x.rule.score.doubles for x in hand.matchingWinnerRules())
         return hand.score.doubles + doublingWinnerRules >= hand.ruleset.minMJDoubles
 
-    def fillChow(group, values):
-        val0, val1 = values
-        if val0 + 1 == val1:
-            if val0 == 1:
-                return {Tile(group, val0 + 2)}
-            if val0 == 8:
-                return {Tile(group, val0 - 1)}
-            return {Tile(group, val0 - 1), Tile(group, val0 + 2)}
-        else:
-            assert val0 + 2 == val1, 'group:%s values:%s' % (group, values)
-            return {Tile(group, val0 + 1)}
-
-    def winningTileCandidates(cls, hand):
-        # pylint: disable=too-many-locals,too-many-return-statements,too-many-branches,too-many-statements
+    def winningTileCandidates(hand):
         if len(hand.melds) > 7:
             # hope 7 is sufficient, 6 was not
             return set()
         if not hand.tilesInHand:
             return set()
-        inHand = list(x.exposed for x in hand.tilesInHand)
-        result = inHand[:]
-        pairs = 0
-        isolated = 0
+        form = StandardMahJongg.concealedForm(hand)
+        if form is None:
+            return set()
+        _, pairs, chows = form
+        return TileCounts(hand.tilesInHand).completingTiles(chows=chows, pairs=pairs)
+
+    def concealedForm(hand):
+        """returns the number of melds and pairs still needed in the
+        concealed tiles, and if they may hold chows. None if the
+        declared melds do not fit"""
+        if any(not (x.isPungKong or x.isChow or x.isPair) for x in hand.declaredMelds):
+            return None
         maxChows = hand.ruleset.maxChows - \
             sum(x.isChow for x in hand.declaredMelds)
-        # TODO: does not differentiate between maxChows == 1 and maxChows > 1
-        # test with kajonggtest and a ruleset where maxChows == 2
+        # a limit of 1 or more chows is not checked, see SquirmingSnake
         if maxChows < 0:
-            return set()
-        if maxChows == 0:
-            checkTiles = set(inHand)
-        else:
-            checkTiles = set(inHand) & elements.honors
-        for tileName in checkTiles:
-            count = inHand.count(tileName)
-            if count == 1:
-                isolated += 1
-            elif count == 2:
-                pairs += 1
-            else:
-                for _ in range(count):
-                    result.remove(tileName)
-        if maxChows:
-            if pairs > 2 or isolated > 2 or (pairs > 1 and isolated > 1):
-                # this is not a calling hand
-                return set()
-        else:
-            if pairs + isolated > 2:
-                return set()
-        if maxChows == 0:
-            return set(result)
-        melds = []
-        for group in sorted(hand.suits & set(Tile.colors)):
-            values = sorted(x.value for x in result if x.group == group)
-            changed = True
-            while (changed and len(values) > 2
-                   and values.count(values[0]) == 1
-                   and values.count(values[1]) == 1
-                   and values.count(values[2]) == 1):
-                changed = False
-                if values[0] + 2 == values[2] and (len(values) == 3 or values[3] > values[0] + 3):
-                    # logDebug('removing first 3 from %s' % values)
-                    meld = Tile(group, values[0]).chow
-                    # pylint: disable=not-an-iterable
-                    # must be a pylint bug. meld is TileList is list
-                    for pair in meld:
-                        result.remove(pair)
-                    melds.append(meld)
-                    values = values[3:]
-                    changed = True
-                elif values[0] + 1 == values[1] and values[2] > values[0] + 2:
-                    # logDebug('found incomplete chow at start of %s' %
-                    # values)
-                    return cls.fillChow(group, values[:2])
-            changed = True
-            while (changed and len(values) > 2
-                   and values.count(values[-1]) == 1
-                   and values.count(values[-2]) == 1
-                   and values.count(values[-3]) == 1):
-                changed = False
-                if values[-1] - 2 == values[-3] and (len(values) == 3 or values[-4] < values[-1] - 3):
-                    meld = Tile(group, values[-3]).chow
-                    # pylint: disable=not-an-iterable
-                    # must be a pylint bug. meld is TileList is list
-                    for pair in meld:
-                        result.remove(pair)
-                    melds.append(meld)
-                    values = values[:-3]
-                    changed = True
-                elif values[-1] - 1 == values[-2] and values[-3] < values[-1] - 2:
-                    # logDebug('found incomplete chow at end of %s' % values)
-                    return cls.fillChow(group, values[-2:])
-
-            if len(values) % 3 == 0:
-                # adding a 4th, 7th or 10th tile with this color can not let us win,
-                # so we can exclude this color from the candidates
-                result = list(x for x in result if x.group != group)
-                continue
-            valueSet = set(values)
-            if len(values) == 4 and len(values) == len(valueSet):
-                if values[0] + 3 == values[-1]:
-                    # logDebug('seq4 in %s' % hand.tilesInHand)
-                    return {Tile(group, values[0]), Tile(group, values[-1])}
-            if len(values) == 7 and len(values) == len(valueSet):
-                if values[0] + 6 == values[6]:
-                    # logDebug('seq7 in %s' % hand.tilesInHand)
-                    return {Tile(group, values[x]) for x in (0, 3, 6)}
-            if len(values) == 1:
-                # only a pair of this value is possible
-                # logDebug('need pair')
-                return {Tile(group, values[0]).concealed}
-            if len(valueSet) == 1:
-                # no chow reachable, only pair/pung
-                continue
-            singles = set(x for x in valueSet
-                          if values.count(x) == 1
-                          and not set([x - 1, x - 2, x + 1, x + 2]) & valueSet)
-            isolated += len(singles)
-            if isolated > 1:
-                # this is not a calling hand
-                return set()
-            if len(values) == 2 and len(valueSet) == 2:
-                # exactly two adjacent values: must be completed to Chow
-                if maxChows == 0:
-                    # not a calling hand
-                    return set()
-                # logDebug('return fillChow for %s' % values)
-                return cls.fillChow(group, values)
-            if (len(values) == 4 and len(valueSet) == 2
-                    and values[0] == values[1] and values[2] == values[3]):
-                return {Tile(group, values[0]), Tile(group, values[2])}
-            if maxChows:
-                for value in valueSet:
-                    if value > 1:
-                        result.append(Tile(group, value - 1))
-                    if value < 9:
-                        result.append(Tile(group, value + 1))
-        return set(result)
+            return None
+        pairs = 1 - sum(x.isPair for x in hand.declaredMelds)
+        if pairs < 0:
+            return None
+        melds = 4 - sum(not x.isPair for x in hand.declaredMelds)
+        if melds < 0:
+            return None
+        return melds, pairs, maxChows > 0
+
+    def missingTiles(hand):
+        form = StandardMahJongg.concealedForm(hand)
+        if form is None:
+            return None
+        melds, pairs, chows = form
+        return TileCounts(hand.tilesInHand).missing(melds, pairs, chows)
 
     def shouldTry(hand, maxMissing=10):
         return True
@@ -508,6 +470,9 @@ class SquirmingSnake(StandardMahJongg):
         """they have already been found by the StandardMahJongg rule"""
         return set()
 
+    def missingTiles(hand):
+        return TileCounts(hand.tiles).missingGates(surplusValues=(2, 5, 8))
+
 
 class WrigglingSnake(MJRule):
 
@@ -517,6 +482,9 @@ class WrigglingSnake(MJRule):
         return (len(set(x.exposed for x in hand.tiles)) + maxMissing > 12
                 and all(not x.isChow for x in hand.declaredMelds))
 
+    def missingTiles(hand):
+        return TileCounts(hand.tiles).missingSnake()
+
     def computeLastMelds(hand):
         if hand.lastTile.value == 1:
             return [hand.lastTile.pair]
@@ -633,7 +601,7 @@ class TripleKnitting(MJRule):
         yield tuple(melds), tuple(rest)
 
     def appliesToHand(cls, hand):
-        if any(x.isHonor for x in hand.tiles):
+        if hand.anyTileIs('isHonor'):
             return False
         if len(hand.declaredMelds) > 1:
             return False
@@ -646,7 +614,7 @@ class TripleKnitting(MJRule):
     def winningTileCandidates(cls, hand):
         if hand.declaredMelds:
             return set()
-        if any(x.isHonor for x in hand.tiles):
+        if hand.anyTileIs('isHonor'):
             return set()
         _, rest = cls.findTriples(hand)
         if len(rest) not in (1, 4):
@@ -664,6 +632,9 @@ class TripleKnitting(MJRule):
         tripleCount = len(cls.findTriples(hand)[0])
         return tripleCount >= tripleWanted
 
+    def missingTiles(hand):
+        return TileCounts(hand.tiles).missingTripleKnitting()
+
     def findTriples(cls, hand):
         """returns a list of triple knitted melds, including the mj triple.
         Also returns the remaining untripled tiles"""
@@ -721,8 +692,11 @@ class Knitting(MJRule):
         pairCount = len(cls.findCouples(hand)[0])
         return pairCount >= pairWanted
 
+    def missingTiles(hand):
+        return TileCounts(hand.tiles).missingKnitting()
+
     def appliesToHand(cls, hand):
-        if any(x.isHonor for x in hand.tiles):
+        if hand.anyTileIs('isHonor'):
             return False
         if len(hand.declaredMelds) > 1:
             return False
@@ -733,7 +707,7 @@ class Knitting(MJRule):
     def winningTileCandidates(cls, hand):
         if hand.declaredMelds:
             return set()
-        if any(x.isHonor for x in hand.tiles):
+        if hand.anyTileIs('isHonor'):
             return set()
         couples, singleTile = cls.findCouples(hand)
         if len(couples) != 6:
@@ -847,6 +821,9 @@ class AllPairHonors(MJRule):
             pairCount + kongCount * 2) > pairWanted
         return result
 
+    def missingTiles(hand):
+        return TileCounts(hand.tiles).missingHonorPairs()
+
     def rearrange(hand, rest):
         melds = []
         for pair in sorted(set(rest) & elements.mAJORS):
@@ -874,12 +851,16 @@ class AllPairHonors(MJRule):
 
 class FourfoldPlenty(RuleCode):
 
+    tilesOnly = True
+
     def appliesToHand(hand):
         return len(hand.tiles) == 18
 
 
 class ThreeGreatScholars(RuleCode):
 
+    needs = ('dragons',)
+
     def appliesToHand(cls, hand):
         return (BigThreeDragons.appliesToHand(hand)
                 and ('nochow' not in cls.options or not any(x.isChow for x in hand.melds)))
@@ -887,18 +868,24 @@ class ThreeGreatScholars(RuleCode):
 
 class BigThreeDragons(RuleCode):
 
+    needs = ('dragons',)
+
     def appliesToHand(hand):
         return len([x for x in hand.melds if x.isDragonMeld and x.isPungKong]) == 3
 
 
 class BigFourJoys(RuleCode):
 
+    needs = ('winds',)
+
     def appliesToHand(hand):
         return len([x for x in hand.melds if x.isWindMeld and x.isPungKong]) == 4
 
 
 class LittleFourJoys(RuleCode):
 
+    needs = ('winds',)
+
     def appliesToHand(hand):
         lengths = sorted([min(len(x), 3) for x in hand.melds if x.isWindMeld])
         return lengths == [2, 3, 3, 3]
@@ -906,6 +893,8 @@ class LittleFourJoys(RuleCode):
 
 class LittleThreeDragons(RuleCode):
 
+    needs = ('dragons',)
+
     def appliesToHand(hand):
         lengths = sorted([min(len(x), 3)
                           for x in hand.melds if x.isDragonMeld])
@@ -914,24 +903,34 @@ class LittleThreeDragons(RuleCode):
 
 class FourBlessingsHoveringOverTheDoor(RuleCode):
 
+    needs = ('winds',)
+
     def appliesToHand(hand):
         return len([x for x in hand.melds if x.isPungKong and x.isWindMeld]) == 4
 
 
 class AllGreen(RuleCode):
 
+    tilesOnly = True
+
     def appliesToHand(hand):
         return set(x.exposed for x in hand.tiles) < elements.greenHandTiles
 
 
 class LastTileFromWall(RuleCode):
 
+    needs = (TileSource.LivingWall,)
+    tilesOnly = True
+
     def appliesToHand(hand):
         return hand.lastSource is TileSource.LivingWall
 
 
 class LastTileFromDeadWall(RuleCode):
 
+    needs = (TileSource.DeadWall,)
+    tilesOnly = True
+
     def appliesToHand(hand):
         return hand.lastSource is TileSource.DeadWall
 
@@ -942,6 +941,9 @@ class LastTileFromDeadWall(RuleCode):
 
 class IsLastTileFromWall(RuleCode):
 
+    needs = (TileSource.LivingWallEnd,)
+    tilesOnly = True
+
     def appliesToHand(hand):
         return hand.lastSource is TileSource.LivingWallEnd
 
@@ -952,6 +954,9 @@ class IsLastTileFromWall(RuleCode):
 
 class IsLastTileFromWallDiscarded(RuleCode):
 
+    needs = (TileSource.LivingWallEndDiscard,)
+    tilesOnly = True
+
     def appliesToHand(hand):
         return hand.lastSource is TileSource.LivingWallEndDiscard
 
@@ -962,6 +967,9 @@ class IsLastTileFromWallDiscarded(RuleCode):
 
 class RobbingKong(RuleCode):
 
+    needs = (TileSource.RobbedKong,)
+    tilesOnly = True
+
     def appliesToHand(hand):
         return hand.lastSource is TileSource.RobbedKong
 
@@ -974,18 +982,27 @@ class RobbingKong(RuleCode):
 
 class GatheringPlumBlossomFromRoof(RuleCode):
 
+    needs = (TileSource.DeadWall,)
+    tilesOnly = True
+
     def appliesToHand(hand):
         return LastTileFromDeadWall.appliesToHand(hand) and hand.lastTile is Tile(Tile.stone, '5').concealed
 
 
 class PluckingMoon(RuleCode):
 
+    needs = (TileSource.LivingWallEnd,)
+    tilesOnly = True
+
     def appliesToHand(hand):
         return IsLastTileFromWall.appliesToHand(hand) and hand.lastTile is Tile(Tile.stone, '1').concealed
 
 
 class ScratchingPole(RuleCode):
 
+    needs = (TileSource.RobbedKong,)
+    tilesOnly = True
+
     def appliesToHand(hand):
         return RobbingKong.appliesToHand(hand) and hand.lastTile is Tile(Tile.bamboo, '2')
 
@@ -997,11 +1014,15 @@ class StandardRotation(RuleCode):
 
 
 class EastWonNineTimesInARow(RuleCode):
+    tilesOnly = True
     nineTimes = 9
 
     def appliesToHand(cls, hand):
         return cls.appliesToGame(hand.player.game)
 
+    def gameState(cls, game):
+        return cls.appliesToGame(game)
+
     def appliesToGame(cls, game, needWins=None):
         if needWins is None:
             needWins = EastWonNineTimesInARow.nineTimes
@@ -1009,9 +1030,14 @@ class EastWonNineTimesInARow(RuleCode):
                 # we are only proposing for the last needed Win
                 needWins -= 1
         if game.winner and game.winner.wind is East and game.notRotated >= needWins:
+            if not Internal.db or Query.writer:
+                # a worker of the game server cannot read its own
+                # score rows yet, but it played the whole game
+                eastMJCount = game.eastMJCounts[(game.winner.name, game.roundWind.char)]
+                return eastMJCount == needWins
             eastMJCount = int(Query("select count(1) from score "
-                                    "where game=%d and won=1 and wind='E' and player=%d "
-                                    "and prevailing='%s'" %
+                                    "where game=? and won=1 and wind='E' and player=? "
+                                    "and prevailing=?",
                                     (game.gameid, game.players[East].nameid, game.roundWind.char)).records[0][0])
             return eastMJCount == needWins
         return False
@@ -1044,6 +1070,9 @@ class GatesOfHeaven(StandardMahJongg):
                 return True
         return False
 
+    def missingTiles(hand):
+        return TileCounts(hand.tiles).missingGates()
+
     def appliesToHand(cls, hand):
         if len(hand.suits) != 1 or hand.suits >= set(Tile.colors):
             return False
@@ -1199,6 +1228,9 @@ class ThirteenOrphans(MJRule):
                 return False
         return True
 
+    def missingTiles(hand):
+        return TileCounts(hand.tiles).missingOrphans()
+
     def weigh(cls, aiInstance, candidates):
         hand = candidates.hand
         if not cls.shouldTry(hand):
@@ -1243,18 +1275,27 @@ class OwnSeason(RuleCode):
 
 class OwnFlowerOwnSeason(RuleCode):
 
+    needs = ('bonus',)
+    tilesOnly = True
+
     def appliesToHand(hand):
         return sum(x.isBonus and x[0].value is hand.ownWind for x in hand.bonusMelds) == 2
 
 
 class AllFlowers(RuleCode):
 
+    needs = ('bonus',)
+    tilesOnly = True
+
     def appliesToHand(hand):
         return len([x for x in hand.bonusMelds if x.group == Tile.flower]) == 4
 
 
 class AllSeasons(RuleCode):
 
+    needs = ('bonus',)
+    tilesOnly = True
+
     def appliesToHand(hand):
         return len([x for x in hand.bonusMelds if x.group == Tile.season]) == 4
 
@@ -1268,6 +1309,8 @@ class ThreeConcealedPongs(RuleCode):
 
 class MahJonggWithOriginalCall(RuleCode):
 
+    needs = ('a',)
+
     def appliesToHand(hand):
         return ('a' in hand.announcements
                 and sum(x.isExposed for x in hand.melds) < 3)
@@ -1294,6 +1337,9 @@ class MahJonggWithOriginalCall(RuleCode):
 
 class TwofoldFortune(RuleCode):
 
+    needs = ('t',)
+    tilesOnly = True
+
     def appliesToHand(hand):
         return 't' in hand.announcements
 
@@ -1305,6 +1351,9 @@ class TwofoldFortune(RuleCode):
 
 class BlessingOfHeaven(RuleCode):
 
+    needs = (TileSource.East14th,)
+    tilesOnly = True
+
     def appliesToHand(hand):
         if hand.lastSource is not TileSource.East14th:
             return False
@@ -1322,6 +1371,9 @@ class BlessingOfHeaven(RuleCode):
 
 class BlessingOfEarth(RuleCode):
 
+    needs = (TileSource.East14th,)
+    tilesOnly = True
+
     def appliesToHand(hand):
         if hand.lastSource is not TileSource.East14th:
             return False
@@ -1365,6 +1417,9 @@ class DangerousGame(RuleCode):
 class LastOnlyPossible(RuleCode):
 
     """check if the last tile was the only one possible for winning"""
+
+    needs = ('lastTile',)
+
     def appliesToHand(cls, hand):
         if not hand.lastTile:
             return False
@@ -30,7 +30,7 @@ from wind import Wind
 from tilesource import TileSource
 from animation import animate
 from log import logError, logDebug, logWarning, i18n
-from query import Query
+from query import Query, WriteBehind
 from uitile import UITile
 from board import WindLabel, Board
 from game import Game
@@ -460,7 +460,7 @@ class ScoringPlayer(VisiblePlayer, Player):
             self._exposedMelds.append(meld)
             if Debug.scoring:
                 logDebug('{} gets exposed meld {}'.format(self, meld))
-        self._hand = None
+        self.invalidateHand()
 
     def removeMeld(self, uiMeld):
         """remove a meld from this hand in a scoring game"""
@@ -485,7 +485,7 @@ class ScoringPlayer(VisiblePlayer, Player):
             else:
                 if Debug.scoring:
                     logDebug('{} lost meld {}'.format(self, popped))
-        self._hand = None
+        self.invalidateHand()
 
 
 class ScoringGame(Game):
@@ -594,15 +594,16 @@ class ScoringGame(Game):
     def savePenalty(self, player, offense, amount):
         """save computed values to database, update score table and balance in status line"""
         scoretime = datetime.datetime.now().replace(microsecond=0).isoformat()
-        Query("INSERT INTO SCORE "
-              "(game,penalty,hand,data,manualrules,player,scoretime,"
-              "won,prevailing,wind,points,payments, balance,rotated,notrotated) "
-              "VALUES(%d,1,%d,?,?,%d,'%s',%d,'%s','%s',%d,%d,%d,%d,%d)" %
-              (self.gameid, self.handctr, player.nameid,
-               scoretime, int(player == self.winner),
-               self.roundWind, player.wind, 0,
-               amount, player.balance, self.rotated, self.notRotated),
-              (player.hand.string, offense.name))
+        written = WriteBehind.add(
+            "INSERT INTO SCORE "
+            "(game,penalty,hand,data,manualrules,player,scoretime,"
+            "won,prevailing,wind,points,payments,balance,rotated,notrotated) "
+            "VALUES(?,1,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+            [(self.gameid, self.handctr, player.hand.string, offense.name,
+              player.nameid, scoretime, int(player == self.winner),
+              str(self.roundWind), str(player.wind), 0,
+              amount, player.balance, self.rotated, self.notRotated)])
+        written.addErrback(self._scoresNotSaved, self.handctr)
         Internal.mainWindow.updateGUI()
 
 def scoreGame():
@@ -20,6 +20,8 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
 # pylint: disable=ungrouped-imports
 
+from collections import defaultdict
+
 from qt import Qt, QPointF, QSize, QModelIndex, QEvent, QTimer
 
 from qt import QColor, QPushButton, QPixmapCache
@@ -41,7 +43,7 @@ from board import WindLabel
 from mi18n import i18n, i18nc
 from common import Internal, Debug
 from statesaver import StateSaver
-from query import Query
+from query import QueryStream
 from guiutil import ListComboBox, Painter, decorateWindow, BlockSignals
 from tree import TreeItem, RootItem, TreeModel
 from wind import Wind
@@ -181,6 +183,10 @@ class ScoreModel(TreeModel):
         self.scoreTable = parent
         self.rootItem = ScoreRootItem(None)
         self.minY = self.maxY = None
+        self.gameid = self.scoreTable.game.gameid
+        self.lastRowid = 0
+        self.handsByPlayer = {}
+        self.__columnExtremes = []
         self.loadData()
 
     def chart(self, rect, index, playerItem):
@@ -263,20 +269,29 @@ class ScoreModel(TreeModel):
             else:
                 return int(Qt.AlignRight | Qt.AlignVCenter)
 
+    def __newHands(self):
+        """the hands saved since we looked last time, per player"""
+        result = defaultdict(list)
+        for record in QueryStream(
+                'select rowid,player,rotated,notrotated,penalty,won,prevailing,wind,points,payments,balance,manualrules'
+                ' from score where game=? and rowid>? order by hand,rowid', (self.gameid, self.lastRowid)):
+            self.lastRowid = max(self.lastRowid, record[0])
+            result[record[1]].append(HandResult(*record[2:]))
+        return result
+
     def loadData(self):
         """loads all data from the data base into a 2D matrix formatted like the wanted tree"""
         game = self.scoreTable.game
-        data = []
-        records = Query(
-            'select player,rotated,notrotated,penalty,won,prevailing,wind,points,payments,balance,manualrules'
-            ' from score where game=? order by player,hand', (game.gameid,)).records
+        handsByPlayer = self.__newHands()
         humans = sorted(
             (x for x in game.players if not x.name.startswith('Robot')))
         robots = sorted(
             (x for x in game.players if x.name.startswith('Robot')))
-        data = list(tuple([player.localName, [HandResult(*x[1:]) for x in records
-                                              if x[0] == player.nameid]]) for player in humans + robots)
-        self.__findMinMaxChartPoints(data)
+        # all four groups share those lists, see update()
+        self.handsByPlayer = dict((x.nameid, handsByPlayer[x.nameid]) for x in humans + robots)
+        data = list(tuple([player.localName, self.handsByPlayer[player.nameid]])
+                    for player in humans + robots)
+        self.__findMinMaxChartPoints()
         parent = QModelIndex()
         groupIndex = self.index(self.rootItem.childCount(), 0, parent)
         groupNames = [i18nc('kajongg', 'Score'), i18nc('kajongg', 'Payments'),
@@ -287,17 +302,44 @@ class ScoreModel(TreeModel):
             for idx1, item in enumerate(data):
                 self.insertRows(idx1, list([ScorePlayerItem(item)]), listIndex)
 
-    def __findMinMaxChartPoints(self, data):
+    def update(self):
+        """append the hands saved since the last call. Returns how many
+        columns we added or None if the caller must build a new model"""
+        newHands = self.__newHands()
+        if not newHands:
+            return 0
+        counts = set(len(x) for x in newHands.values())
+        oldCounts = set(len(x) for x in self.handsByPlayer.values())
+        if set(newHands) != set(self.handsByPlayer) or len(counts) != 1 or len(oldCounts) != 1:
+            # penalties are only for one player
+            return None
+        added = counts.pop()
+        oldCount = oldCounts.pop()
+        self.beginInsertColumns(QModelIndex(), oldCount + 1, oldCount + added)
+        try:
+            for nameid, hands in newHands.items():
+                self.handsByPlayer[nameid].extend(hands)
+        finally:
+            self.endInsertColumns()
+        # the spline of the previous last hand changes too
+        self.__findMinMaxChartPoints(max(0, oldCount - 1))
+        return added
+
+    def __findMinMaxChartPoints(self, firstColumn=0):
         """find and save the extremes of the spline. They can be higher than
-        the pure balance values"""
-        self.minY = 9999999
-        self.maxY = -9999999
-        for item in data:
-            playerItem = ScorePlayerItem(item)
-            for col in range(len(playerItem.hands())):
-                points = list(playerItem.chartPoints(col + 1, self.steps))
-                self.minY = min(self.minY, min(points))
-                self.maxY = max(self.maxY, max(points))
+        the pure balance values. We keep them per column and only compute
+        the columns starting with firstColumn"""
+        del self.__columnExtremes[firstColumn:]
+        playerItems = list(ScorePlayerItem(('', x)) for x in self.handsByPlayer.values())
+        columns = max(len(x.hands()) for x in playerItems) if playerItems else 0
+        for col in range(firstColumn, columns):
+            points = []
+            for playerItem in playerItems:
+                if col < len(playerItem.hands()):
+                    points.extend(playerItem.chartPoints(col + 1, self.steps))
+            self.__columnExtremes.append((min(points), max(points)))
+        self.minY = min([9999999] + list(x[0] for x in self.__columnExtremes))
+        self.maxY = max([-9999999] + list(x[1] for x in self.__columnExtremes))
         self.minY -= 2  # antialiasing might cross the cell border
         self.maxY += 2
 
@@ -507,6 +549,15 @@ class ScoreTable(QWidget):
             title = i18n('Scores for game <numid>%1</numid>', gameid)
         decorateWindow(self, title)
         self.ruleTree.rulesets = list([self.game.ruleset])
+        if self.scoreModel and self.scoreModel.gameid == self.game.gameid:
+            added = self.scoreModel.update()
+            if added is not None:
+                if added:
+                    self.viewRight.setColWidth()
+                    # the chart extremes may have changed
+                    self.viewRight.viewport().update()
+                    QTimer.singleShot(0, self.scrollRight)
+                return
         self.scoreModel = ScoreModel(self)
         if Debug.modelTest:
             self.scoreModelTest = ModelTest(self.scoreModel, self)
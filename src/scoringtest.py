@@ -27,9 +27,14 @@ from common import Debug  # pylint: disable=unused-import
 from wind import Wind, East, South, West, North
 from player import Players
 from game import PlayingGame
-from hand import Hand, Score
-from tile import TileList
+from hand import Hand, HandCache, HandParts, Score
+from tile import Tile, TileList
+from meld import Meld, MeldList
+from tilecounts import TileCounts
+from permutations import Permutations, PermutationTable
 from predefined import ClassicalChineseDMJL, ClassicalChineseBMJA
+from message import Message
+from wire import Wire
 
 RULESETS = []
 
@@ -950,6 +955,57 @@ class CallingHands(Base):
             'dbdgdrwewswwwns1s9b1b9c1c9')
 
 
+class CompletingTiles(Base):
+
+    """the tile count engine behind StandardMahJongg.winningTileCandidates"""
+
+    def testMe(self):
+        def completing(tiles, **kwargs):
+            return ''.join(sorted(TileCounts(TileList(tiles)).completingTiles(**kwargs)))
+        self.assertEqual(completing('S1S1S1S2S3S4S5S6S7S8S9S9S9'), 's1s2s3s4s5s6s7s8s9')
+        self.assertEqual(completing('S1S1S1S2S3S4S5S6S7S8S9S9S9', chows=False), '')
+        self.assertEqual(completing('DbDbWeWe', chows=False), 'dbwe')
+        self.assertEqual(completing('B2B3C5C5'), 'b1b4')
+        self.assertEqual(completing('B2B3C5C6', pairs=0), '')
+        self.assertEqual(completing('WeWnDbDgDrS1S9B1B9C1C9WsWw'), '')
+        self.assertFalse(TileCounts(TileList('XyS1S1')).isValid)
+
+
+class TileKeys(Base):
+
+    """the tables indexed by tile key must agree with the tiles"""
+
+    def testMe(self):
+        for tile in Tile.byKey[1:]:
+            if tile is None:
+                continue
+            self.assertIs(Tile.byKey[Tile.exposedKeys[tile.key]], tile.exposed)
+            self.assertIs(Tile.byKey[Tile.concealedKeys[tile.key]], tile.concealed)
+            for flag in Tile.flagNames:
+                self.assertEqual(bool(Tile.flags[tile.key] & Tile.flagBit[flag]), bool(getattr(tile, flag)))
+        self.assertIs(Tile.byKey[Tile.nextKeys[Tile('s3').key]], Tile('s4'))
+        meld = Meld('s1s2s3')
+        self.assertIs(Meld.fromKeys(meld.tileKeys), meld)
+        with self.assertRaises(TypeError):
+            meld += [Tile('s4')]
+        hand = Hand(GAMES[0].players[0], 'wewewe dbdbdb S9S9S9 RS1S1S1B1B1')
+        self.assertTrue(hand.allTilesAre('isMajor'))
+        self.assertFalse(hand.allTilesAre('isHonor'))
+        self.assertTrue(hand.anyTileIs('isHonor'))
+
+
+class PrecomputedPermutations(Base):
+
+    """the shipped table must give the same as computing"""
+
+    def testMe(self):
+        for values in ((1, 1, 2, 3, 3, 3), (4, 5, 6, 6, 7, 8), (2, 2, 2, 3, 3, 3, 4, 4, 4), (7, 8, 9)):
+            counts = tuple(values.count(x) for x in range(values[0], values[-1] + 1))
+            self.assertIsNotNone(PermutationTable.lookup(counts))
+            Permutations.colorPermCache.clear()
+            self.assertEqual(Permutations.usefulPermutations(values), Permutations.computeUseful(values))
+
+
 class Recursion(Base):
 
     """recursion in Hand computing should never happen"""
@@ -961,6 +1017,164 @@ class Recursion(Base):
             'c6c6c6C6 fe fs RS8S8C1C2C3C4C5C7C8C9 LC7', [NoWin(16), NoWin(16, 1)])
 
 
+class SharedHandCache(Base):
+
+    """a hand evaluated again must come from the process wide cache"""
+
+    def testMe(self):
+        string = 'wewewe s1s1s1 b9b9b9 RC1C1C1C2C3 LC1'
+        for game in GAMES:
+            player = game.players[0]
+            player.clearCache()
+            first = Hand(player, string)
+            # only evaluated hands go into the cache
+            _ = first.score
+            player.clearCache()
+            hits = HandCache.hits
+            second = Hand(player, string)
+            self.assertIsNot(first, second)
+            self.assertEqual(HandCache.hits, hits + 1)
+            self.assertEqual(first.score, second.score)
+            self.assertEqual(first.melds, second.melds)
+            self.assertIs(first.mjRule, second.mjRule)
+        # another game with its own copy of the same ruleset
+        ruleset = ClassicalChineseDMJL()
+        ruleset.load()
+        other = PlayingGame(list(tuple([wind, str(wind.char)]) for wind in Wind.all4), ruleset)
+        player = other.players[0]
+        scoreCount = Hand.scoreCount
+        hand = Hand(player, string)
+        self.assertEqual(hand.score, Hand(GAMES[0].players[0], string).score)
+        self.assertEqual(Hand.scoreCount, scoreCount)
+        self.assertTrue(any(hand.mjRule is x for x in ruleset.mjRules))
+        self.assertTrue(all(any(x.rule is y for y in ruleset.allRules) for x in hand.usedRules))
+
+
+class GameStateInCache(Base):
+
+    """a cached hand must not hide that East won nine times in a row"""
+
+    def testMe(self):
+        string = 'wewewe s1s1s1 b9b9b9 RC1C1C1C2C3 LC1'
+        for game in GAMES:
+            player = game.players[East]
+            game.winner = player
+            player.clearCache()
+            normal = Hand(player, string).score
+            needWins = 8 if game.isScoringGame() else 9
+            game.notRotated = needWins
+            game.eastMJCounts[(player.name, game.roundWind.char)] = needWins
+            try:
+                player.clearCache()
+                nineTimes = Hand(player, string).score
+            finally:
+                game.notRotated = 0
+                game.eastMJCounts.clear()
+            self.assertEqual(normal.limits, 0)
+            self.assertEqual(nineTimes.limits, 1 if game.ruleset.plan.gameRules else 0)
+
+
+class StagedHand(Base):
+
+    """a hand is only arranged and scored when somebody wants to know"""
+
+    def testMe(self):
+        player = GAMES[0].players[0]
+        player.clearCache()
+        HandCache.clear()
+        arranged, scored = Hand.arrangeCount, Hand.scoreCount
+        hand = Hand(player, 'wewewe s1s1s1 b9b9b9 c1c1c1 C2C2 LC2')
+        self.assertEqual(hand.lenOffset, 1)
+        self.assertEqual((Hand.arrangeCount, Hand.scoreCount), (arranged, scored))
+        self.assertEqual(len(hand.melds), 5)
+        self.assertEqual((Hand.arrangeCount, Hand.scoreCount), (arranged + 1, scored))
+        self.assertTrue(hand.won)
+        # scoring looks at other hands too
+        self.assertGreater(Hand.scoreCount, scored)
+
+
+class WhatIf(Base):
+
+    """handsPlus and handsMinus must give the same hands as parsing their strings"""
+
+    def testMe(self):
+        player = GAMES[0].players[0]
+        hand = Hand(player, 'wewewe s1s1s1 RB5B6C2C2C3C3C4 fe')
+        plus = hand.handsPlus(TileList('B4B7C1C2'))
+        minus = plus[TileList('B7')[0]].handsMinus(TileList('B5C3'))
+        for newHand in list(plus.values()) + list(minus.values()):
+            player.clearCache()
+            parsed = Hand(player, newHand.string)
+            self.assertEqual(newHand.tilesInHand, parsed.tilesInHand)
+            self.assertEqual(newHand.melds, parsed.melds)
+            self.assertEqual(newHand.won, parsed.won)
+            self.assertEqual(newHand.score, parsed.score)
+
+
+class IncrementalHandParts(Base):
+
+    """adding and removing tiles must give the same parts as building them again"""
+
+    def testMe(self):
+        melds = MeldList('wewewe s1S1S1s1')
+        parts = HandParts(melds, TileList('C1C2C3B5'))
+        for tile in TileList('B6C2fe'):
+            parts.add(tile)
+        parts.remove(TileList('C1')[0])
+        expected = HandParts(melds, TileList('C2C3B5B6C2'), TileList('fe'))
+        for attr in ('rest', 'tiles', 'tilesInHand', 'bonusMelds'):
+            self.assertEqual(getattr(parts, attr), getattr(expected, attr), attr)
+        player = GAMES[0].players[0]
+        player.clearCache()
+        hand = Hand(player, 'wewewe s1S1S1s1 RB5B6C2C2C3 fe', parts=parts)
+        player.clearCache()
+        self.assertEqual(hand.tilesInHand, Hand(player, hand.string).tilesInHand)
+
+
+class MissingTiles(Base):
+
+    """how many tiles are missing for Mah Jongg"""
+
+    def testMe(self):
+        counts = TileCounts(TileList('S1S2S3B5B5B5C7C8DgDgDrDrWe'))
+        self.assertEqual(counts.missing(), 2)
+        self.assertEqual(counts.missing(chows=False), 5)
+        self.assertEqual(TileCounts(TileList('S1S2S3B5B5B5C7C8C9DgDgDrDrDr')).missing(), 0)
+        for game in GAMES:
+            player = game.players[0]
+            player.clearCache()
+            self.assertEqual(Hand(player, 'RS1S9B1B9C1C9WeWsWwWnDbDgDr').missingTiles(), 1)
+            # only BMJA knows Knitting
+            self.assertEqual(
+                Hand(player, 'RS1B1S1B1S3B3S5B5S7B7S9B9C7').missingTiles(),
+                2 if 'Knitting' in game.ruleset.mjRules else 4)
+
+
+class WireEncoding(unittest.TestCase):
+
+    """the compact encoding must give back what was sent"""
+
+    def testMove(self):
+        kwargs = {'tile': 'S3', 'meld': 'b1b2b3', 'tiles': 'S1S1S1 b2b3b4 Dg',
+                  'source': None, 'gameid': 17, 'data': b'x' * 5000}
+        messageId, encoded, zipped = Wire.encodeMove(Message.SetConcealedTiles, dict(kwargs))
+        self.assertEqual(zipped, ['data'])
+        self.assertEqual(Wire.decodeMove(messageId, encoded, zipped), (Message.SetConcealedTiles, kwargs))
+
+    def testAnswer(self):
+        for answer, name, args in (
+                (Message.NoClaim, 'No Claim', None),
+                ((Message.Discard, None), 'Discard', None),
+                ((Message.Discard, Tile('S3')), 'Discard', 'S3'),
+                ('anything', 'anything', None)):
+            encoded = Wire.encodeAnswer(answer)
+            if args is not None:
+                encoded, wiredArgs = encoded
+                self.assertEqual(wiredArgs, args)
+            self.assertEqual(Wire.messageName(encoded), name)
+        self.assertIs(Wire.messageName(True), True)
+
+
 class TstProgram(unittest.TestProgram):
 
     """we want global access to this program so we can check for verbosity in our tests"""
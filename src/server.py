@@ -37,6 +37,8 @@ def cleanExit(*dummyArgs):
     """we want to cleanly close sqlite3 files"""
     if Debug.quit:
         logDebug('cleanExit')
+    if Internal.workers:
+        Internal.workers.stop()
     if Options.socket and os.name != 'nt':
         if os.path.exists(Options.socket):
             os.remove(Options.socket)
@@ -79,7 +81,7 @@ reactor.addSystemEventTrigger('before', 'shutdown', cleanExit)
 Internal.reactor = reactor
 
 from player import Players
-from query import Query, initDb
+from query import Query, initDb, DBHandle
 from log import logDebug, logWarning, logError, logInfo, SERVERMARK
 from mi18n import i18n, i18nE
 from util import elapsedSince
@@ -89,6 +91,7 @@ from rule import Ruleset
 from servercommon import srvError, srvMessage
 from user import User
 from servertable import ServerTable, ServerGame
+from wire import Wire, CountingBroker
 
 
 @implementer(checkers.ICredentialsChecker)
@@ -139,6 +142,7 @@ class MJServer:
     def __init__(self):
         self.tables = {}
         self.srvUsers = list()
+        self.workers = None
         Players.load()
         self.lastPing = datetime.datetime.now()
         self.checkPings()
@@ -166,6 +170,18 @@ class MJServer:
                 user.mind = None
                 self.logout(user)
 
+    def callMove(self, user, aboutName, command, kwargs):
+        """send a move to user, compact if he knows how"""
+        if user.wireVersion:
+            messageId, kwargs, zipped = Wire.encodeMove(command, kwargs)
+            return self.callRemote(user, 'wireMove', aboutName, messageId, kwargs, zipped)
+        return self.callRemote(user, 'move', aboutName, command.name, **kwargs)
+
+    def callMoves(self, user, moves):
+        """send several moves to user with one remote call"""
+        return self.callRemote(user, 'moves', list(
+            tuple([aboutName]) + Wire.encodeMove(command, kwargs) for aboutName, command, kwargs in moves))
+
     @staticmethod
     def __stopAfterLastDisconnect():
         """as the name says"""
@@ -241,6 +257,8 @@ class MJServer:
         """user creates new table and joins it"""
         def gotRuleset(ruleset):
             """now we have the full ruleset definition from the client"""
+            if isinstance(ruleset, bytes):
+                ruleset = Wire.unzipValue(ruleset)
             Ruleset.cached(
                 ruleset).save()  # make it known to the cache and save in db
         if tableId in self.tables:
@@ -348,6 +366,9 @@ class MJServer:
                            i18n(message, *args)), withGamePrefix=None)
         if table.tableid in self.tables:
             del self.tables[table.tableid]
+            if table.worker:
+                table.worker.callRemote('removeTable', table.tableid)
+                table.worker = None
             if reason == 'silent':
                 tellUsers = []
             else:
@@ -439,6 +460,7 @@ class MJRealm:
 
 def parseArgs():
     """as the name says"""
+    import optparse
     from optparse import OptionParser
     parser = OptionParser()
     defaultPort = Internal.defaultPort
@@ -455,9 +477,23 @@ def parseArgs():
         dest='dbpath',
         help=i18n('name of the database'),
         default=None)
+    parser.add_option(
+        '', '--dbprofile', dest='dbprofile', default=Options.dbProfile,
+        type='choice', choices=sorted(DBHandle.profiles),
+        help=i18n('tune the database for speed (fast) or for surviving power loss (safe)'),
+        metavar='PROFILE')
     parser.add_option(
         '', '--continue', dest='continueServer', action='store_true',
         help=i18n('do not terminate local game server after last client disconnects'), default=False)
+    parser.add_option(
+        '', '--sharedrobots', dest='sharedRobots', action='store_true',
+        help=i18n('robot players look at the server game instead of keeping their own copy'),
+        default=False)
+    parser.add_option(
+        '', '--workers', dest='workers', type=int, default=0,
+        help=i18n('play the games in WORKERS processes'), metavar='WORKERS')
+    parser.add_option('', '--worker', dest='worker', type=int, default=None,
+                      help=optparse.SUPPRESS_HELP)
     parser.add_option('', '--debug', dest='debug',
                       help=Debug.help())
     (options, args) = parser.parse_args()
@@ -465,10 +501,12 @@ def parseArgs():
         logWarning(i18n('unrecognized arguments:%1', ' '.join(args)))
         sys.exit(2)
     Options.continueServer |= options.continueServer
+    Options.sharedRobots = options.sharedRobots
     if options.dbpath:
         Options.dbPath = os.path.expanduser(options.dbpath)
     if options.socket:
         Options.socket = options.socket
+    Options.dbProfile = options.dbprofile
     Debug.setOptions(options.debug)
     Options.fixed = True  # may not be changed anymore
     del parser           # makes Debug.gc quieter
@@ -479,10 +517,17 @@ def kajonggServer():
     """start the server"""
     # pylint: disable=too-many-branches
     options = parseArgs()
+    if options.worker:
+        from serverworker import workerMain
+        workerMain(options.worker)
+        return
     if not initDb():
         sys.exit(1)
     realm = MJRealm()
     realm.server = MJServer()
+    if options.workers:
+        from serverworker import Workers
+        realm.server.workers = Internal.workers = Workers(realm.server, options.workers)
     kajonggPortal = portal.Portal(realm, [DBPasswordChecker()])
     import predefined
     predefined.load()
@@ -491,6 +536,7 @@ def kajonggServer():
             # we do not want tracebacks to go from server to client,
             # please check on the server side instead
             factory = pb.PBServerFactory(kajonggPortal, unsafeTracebacks=False)
+            factory.protocol = CountingBroker
             if os.name == 'nt':
                 if Debug.connections:
                     logDebug(
@@ -506,11 +552,15 @@ def kajonggServer():
         else:
             if Debug.connections:
                 logDebug('server listening on port %d' % options.port)
-            reactor.listenTCP(options.port, pb.PBServerFactory(kajonggPortal))
+            factory = pb.PBServerFactory(kajonggPortal)
+            factory.protocol = CountingBroker
+            reactor.listenTCP(options.port, factory)
     except error.CannotListenError as errObj:
         logWarning(errObj)
         sys.exit(1)
     else:
+        if realm.server.workers:
+            realm.server.workers.start()
         reactor.run()
 
 
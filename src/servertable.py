@@ -31,7 +31,7 @@ from itertools import chain
 
 from twisted.spread import pb
 
-from common import Debug, Internal, StrMixin
+from common import Debug, Internal, Options, StrMixin
 from wind import Wind
 from tilesource import TileSource
 from util import Duration
@@ -43,6 +43,7 @@ from tile import Tile, TileList, elements
 from meld import Meld, MeldList
 from query import Query
 from client import Client, Table
+from sharedrobot import SharedRobotClient
 from wall import WallEmpty
 from sound import Voice
 from servercommon import srvError
@@ -111,6 +112,11 @@ class ServerTable(Table, StrMixin):
         self.remotes = {}   # maps client connections to users
         self.game = None
         self.client = None
+        self.worker = None  # see serverworker.py
+        # the simulator sets a list here: without network,
+        # robot answers arrive at once and finished blocks
+        # would call each other recursively
+        self.pendingCallbacks = None
         server.tables[self.tableid] = self
         if Debug.table:
             logDebug('new table %s' % self)
@@ -179,6 +185,8 @@ class ServerTable(Table, StrMixin):
         if user in self.users:
             self.running = False
             self.users.remove(user)
+            if self.worker:
+                self.worker.callRemote('delUser', self.tableid, user.name)
             self.sendChatMessage(ChatMessage(self.tableid, user.name,
                                              i18nE('leaves the table'), isStatusMessage=True))
             if user is self.owner:
@@ -221,9 +229,13 @@ class ServerTable(Table, StrMixin):
         gameIds.append(serverMaxGameId)
         return max(gameIds) + 1
 
-    def __prepareNewGame(self):
-        """returns a new game object"""
-        names = list(x.name for x in self.users)
+    def prepareNewGame(self, names=None):
+        """returns a new game object. names defaults to the users
+        at this table, missing players will be robots"""
+        if names is None:
+            names = list(x.name for x in self.users)
+        else:
+            names = list(names)
         # the server and all databases save the english name but we
         # want to make sure a translation exists for the client GUI
         robotNames = [
@@ -258,7 +270,10 @@ class ServerTable(Table, StrMixin):
             if not remote:
                 # we found a robot player, its client runs in this server
                 # process
-                remote = Client(player.name)
+                if Options.sharedRobots:
+                    remote = SharedRobotClient(player.name)
+                else:
+                    remote = Client(player.name)
                 remote.table = self
             self.remotes[player] = remote
 
@@ -294,7 +309,7 @@ class ServerTable(Table, StrMixin):
             self.__checkDbIdents()
             self.initGame()
         else:
-            self.game = self.__prepareNewGame()
+            self.game = self.prepareNewGame()
             self.__connectPlayers()
             self.__checkDbIdents()
             self.proposeGameId(self.calcGameId())
@@ -360,14 +375,31 @@ class ServerTable(Table, StrMixin):
                 return
         if Debug.table:
             logDebug('Game starts on table %s' % self)
+        self.__buildWall()
+        self.running = True
+        self.__adaptOtherTables()
+        if self.server.workers and self.server.workers.handOff(self):
+            return
+        self.sendVoiceIds()
+
+    def __buildWall(self):
+        """all tiles for the wall, concealed"""
         elementIter = iter(elements.all(self.game.ruleset))
         wallSize = len(self.game.wall.tiles)
         self.game.wall.tiles = []
         for _ in range(wallSize):
             self.game.wall.tiles.append(next(elementIter).concealed)
         assert isinstance(self.game, ServerGame), self.game
+
+    def runInWorker(self, names, gameid):
+        """the front end started the game and handed it over to
+        this worker process, see serverworker.py"""
+        self.game = self.prepareNewGame(names)
+        self.game.gameid = gameid
+        self.__connectPlayers()
+        self.__checkDbIdents()
+        self.__buildWall()
         self.running = True
-        self.__adaptOtherTables()
         self.sendVoiceIds()
 
     def __adaptOtherTables(self):
@@ -471,7 +503,8 @@ class ServerTable(Table, StrMixin):
         humanPlayers = [
             x for x in self.game.players if isinstance(self.remotes[x], User)]
         block = DeferredBlock(self)
-        block.tell(None, humanPlayers, Message.AssignVoices)
+        if humanPlayers:
+            block.tell(None, humanPlayers, Message.AssignVoices)
         block.callback(self.startHand)
 
     def pickTile(self, dummyResults=None, deadEnd=False):
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Wolfgang Rohdewald <wolfgang@rohdewald.de>
+
+Kajongg is free software you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+With --workers=N, the game server starts N worker processes. The
+server process is the front end: it keeps logins, the table list, chat
+and the game id reservation. When a new game has started, its table
+is handed over to the worker with the fewest tables. The worker plays
+the game with its own robots, the moves for the human players are
+passed through the front end. All changes to the data base are
+written by the front end, the workers only read.
+
+The front end listens on 127.0.0.1 for its workers. The root object
+only knows register: a worker must present the token it got in
+its environment. Only then it gets a WorkerHandle for passing
+changes to the data base and removed tables. The front end only
+executes the statements in Workers.statements. Those changes are
+written later, so a worker must not read back what it just wrote.
+
+Suspended games which are continued are not handed over.
+"""
+
+import hmac
+import os
+import sys
+import subprocess
+import uuid
+
+from twisted.spread import pb
+from twisted.internet.defer import succeed
+
+from common import Internal, Options, Debug
+from log import logDebug, logWarning, logError
+from mi18n import i18nE
+from query import Query
+from rule import Ruleset
+from game import Game
+from player import Players
+from server import MJServer
+from servertable import ServerTable
+from user import User
+from deferredutil import DeferredBlock
+from message import Message
+from wire import CountingBroker
+
+TOKENVAR = 'KAJONGG_WORKER_TOKEN'
+
+
+class UserProxy(pb.Referenceable):
+
+    """lives in the front end. The worker calls the client through this"""
+
+    def __init__(self, server, user):
+        self.server = server
+        self.user = user
+
+    def remote_call(self, *args, **kwargs):
+        """forward to the client"""
+        self.user.pinged()
+        return self.server.callRemote(self.user, *args, **kwargs)
+
+
+class WorkerHandle(pb.Referenceable):
+
+    """the front end view of a worker process. The worker gets
+    this after registering and talks to the front end through it"""
+
+    def __init__(self, workers, reference):
+        self.workers = workers
+        self.reference = reference
+        self.tableIds = set()
+
+    def callRemote(self, *args):
+        """ignore a lost worker, its tables are lost anyway"""
+        try:
+            return self.reference.callRemote(*args)
+        except pb.DeadReferenceError:
+            return succeed(None)
+
+    def remote_query(self, statement, args):
+        """we are the only writer"""
+        if statement not in Workers.statements:
+            logWarning('a worker wanted to execute {}'.format(statement))
+            return
+        Query(statement, args, mayDelay=True)
+
+    def remote_tableRemoved(self, tableid, reason, message, *args):
+        """the worker is done with the table"""
+        if tableid not in self.tableIds:
+            return
+        self.tableIds.discard(tableid)
+        server = self.workers.server
+        table = server.tables.get(tableid)
+        if table:
+            table.worker = None
+            server.removeTable(table, reason, message, *args)
+
+
+class Workers(pb.Root):
+
+    """lives in the front end: starts the workers. This is the
+    root object for them, they may only register"""
+
+    # the changes a worker may pass to the front end
+    statements = frozenset([
+        Game.scoreStatement, Game.startTimeStatement, Game.endTimeStatement,
+        Players.insertStatement])
+
+    def __init__(self, server, count):
+        self.server = server
+        self.count = count
+        self.token = uuid.uuid4().hex
+        self.handles = []
+        self.processes = []
+
+    def start(self):
+        """listen for workers and start them"""
+        factory = pb.PBServerFactory(self)
+        factory.protocol = CountingBroker
+        port = Internal.reactor.listenTCP(0, factory, interface='127.0.0.1').getHost().port
+        if sys.argv[0].endswith('.py'):
+            args = [sys.executable, os.path.abspath(sys.argv[0])]
+        else:
+            args = [sys.argv[0]]
+        args.append('--worker={}'.format(port))
+        if Options.dbPath:
+            args.append('--db={}'.format(Options.dbPath))
+        args.append('--dbprofile={}'.format(Options.dbProfile))
+        if Debug.argString:
+            args.append('--debug={}'.format(Debug.argString))
+        env = dict(os.environ)
+        env[TOKENVAR] = self.token
+        for _ in range(self.count):
+            self.processes.append(subprocess.Popen(args, env=env))
+        if Debug.connections:
+            logDebug('started {} workers: {}'.format(self.count, ' '.join(args)))
+
+    def stop(self):
+        """terminate all workers"""
+        for process in self.processes:
+            process.terminate()
+        self.processes = []
+
+    def remote_register(self, token, reference):
+        """a worker is ready. Returns the handle it may use"""
+        if not isinstance(token, str) or not hmac.compare_digest(token, self.token):
+            logWarning('a worker with a wrong token tried to register')
+            return None
+        handle = WorkerHandle(self, reference)
+        self.handles.append(handle)
+        reference.notifyOnDisconnect(self.__lost)
+        if Debug.connections:
+            logDebug('worker {} registered'.format(len(self.handles)))
+        return handle
+
+    def __lost(self, reference):
+        """a worker died. Abort its tables"""
+        for handle in self.handles[:]:
+            if handle.reference is reference:
+                self.handles.remove(handle)
+                for tableid in handle.tableIds:
+                    table = self.server.tables.get(tableid)
+                    if table:
+                        table.worker = None
+                        table.abort(i18nE('The game server lost its worker for table %1'), tableid)
+
+    def handOff(self, table):
+        """let a worker play table. Returns False if we cannot"""
+        if not self.handles or table.suspendedAt:
+            return False
+        handle = min(self.handles, key=lambda x: len(x.tableIds))
+        users = list(
+            (x.name, x.dbIdent, x.voiceId, x.wireVersion, UserProxy(self.server, x))
+            for x in table.users)
+        handle.callRemote(
+            'runTable', table.tableid, table.ruleset.toList(), table.playOpen,
+            table.autoPlay, table.game.wantedGame, table.game.gameid,
+            list(x.name for x in table.game.players), users)
+        handle.tableIds.add(table.tableid)
+        table.worker = handle
+        if Debug.table:
+            logDebug('table {} handed over to a worker'.format(table))
+        return True
+
+
+class ProxyMind:
+
+    """lives in a worker: stands in for the pb reference to a client"""
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+
+    def callRemote(self, *args, **kwargs):
+        """pass through the front end"""
+        return self.proxy.callRemote('call', *args, **kwargs)
+
+
+class WorkerUser(User):
+
+    """lives in a worker: a user of the front end"""
+
+    def __init__(self, name, dbIdent, voiceId, wireVersion, proxy):  # pylint: disable=super-init-not-called
+        self.name = name
+        self.mind = ProxyMind(proxy)
+        self.server = None
+        self.dbIdent = dbIdent
+        self.voiceId = voiceId
+        self.maxGameId = None
+        self.wireVersion = wireVersion
+        self.lastPing = None
+
+    def pinged(self):
+        """the front end knows"""
+        pass
+
+
+class WorkerServer(MJServer, pb.Referenceable):
+
+    """lives in a worker: the game server for the tables we got.
+    frontEnd is our WorkerHandle in the front end, we get it by registering"""
+
+    def __init__(self, frontEnd):  # pylint: disable=super-init-not-called
+        self.frontEnd = frontEnd
+        self.tables = {}
+        self.srvUsers = []
+        self.workers = None
+
+    def remote_runTable(self, tableid, rulesetList, playOpen, autoPlay, wantedGame, gameid, names, users):
+        """play this table"""
+        table = ServerTable(
+            self, None, Ruleset.cached(rulesetList), None,
+            playOpen, autoPlay, wantedGame, tableId=tableid)
+        table.users = list(WorkerUser(*x) for x in users)
+        table.owner = table.users[0] if table.users else None
+        table.runInWorker(names, gameid)
+
+    def remote_delUser(self, tableid, userName):
+        """the user left the table"""
+        table = self.tables.get(tableid)
+        if table:
+            for user in table.users[:]:
+                if user.name == userName:
+                    table.delUser(user)
+                    for block in DeferredBlock.blocks:
+                        for request in block.requests:
+                            if request.user == user:
+                                request.answer = Message.Abort
+
+    def remote_removeTable(self, tableid):
+        """the front end removed the table"""
+        table = self.tables.pop(tableid, None)
+        if table:
+            table.running = False
+            if table.game:
+                table.game.close()
+
+    def removeTable(self, table, reason, message=None, *args):
+        """the table is done, the front end tells the users"""
+        if self.tables.pop(table.tableid, None):
+            self.frontEnd.callRemote('tableRemoved', table.tableid, reason, message or '', *args)
+        table.running = False
+        if table.game:
+            table.game.close()
+
+    def leaveTable(self, user, tableid, message=None, *args):
+        """only the front end knows other tables"""
+        return True
+
+    def logout(self, user):
+        """the front end does that"""
+        pass
+
+
+def workerMain(port):
+    """run as worker for the front end listening on port"""
+    from query import DBHandle
+    import predefined
+    DBHandle(DBHandle.dbPath())
+    predefined.load()
+    factory = pb.PBClientFactory()
+    factory.protocol = CountingBroker
+
+    def connected(root):
+        """register with the front end"""
+        root.notifyOnDisconnect(stop)
+        server = WorkerServer(None)
+        return root.callRemote(
+            'register', os.environ.get(TOKENVAR), server).addCallback(registered, server)
+
+    def registered(frontEnd, server):
+        """All data base changes go to the front end"""
+        if frontEnd is None:
+            logError('the front end does not accept us')
+            stop()
+            return
+
+        def writer(statement, args):
+            """the front end writes"""
+            frontEnd.callRemote('query', statement, args).addErrback(logError)
+        Query.writer = writer
+        server.frontEnd = frontEnd
+
+    def stop(dummy=None):
+        """without front end, we are useless"""
+        if Internal.reactor.running:
+            Internal.reactor.stop()
+    Internal.reactor.connectTCP('127.0.0.1', port, factory)
+    factory.getRootObject().addCallback(connected).addErrback(stop)
+    Internal.reactor.run()
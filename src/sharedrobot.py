@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Wolfgang Rohdewald <wolfgang@rohdewald.de>
+
+Kajongg is free software you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+Robot clients running within the game server normally mirror every
+move in their own PlayingGame. A SharedRobotClient does not: it looks
+at the ServerGame through a GameView and only answers the questions
+of the server.
+"""
+
+import weakref
+
+from twisted.internet.defer import Deferred, succeed
+
+from message import Message
+from client import Client
+from game import Game
+from tile import Tile, TileList
+from rand import CountingRandom
+from intelligence import AIDefault
+
+
+class PlayerView:
+
+    """a read only view on a player of the server game, as seen by
+    the robot owning the GameView. Concealed tiles of other players
+    are unknown unless we play open"""
+
+    def __init__(self, player, gameView):
+        object.__setattr__(self, '_player', weakref.ref(player))
+        object.__setattr__(self, '_gameView', weakref.ref(gameView))
+
+    @property
+    def player(self):
+        """hide weakref"""
+        return self._player()
+
+    @property
+    def game(self):
+        """the view, not the server game"""
+        return self._gameView()
+
+    @property
+    def isViewer(self):
+        """is this the robot looking at the game?"""
+        return self.player.name == self.game.viewerName
+
+    @property
+    def concealedTiles(self):
+        """only the viewer knows them"""
+        tiles = self.player.concealedTiles
+        if self.isViewer or self.game.playOpen:
+            return tiles
+        return TileList([Tile.unknown] * len(tiles))
+
+    @property
+    def hand(self):
+        """only the viewer knows it"""
+        if self.isViewer or self.game.playOpen:
+            return self.player.hand
+        return None
+
+    def others(self):
+        """views on the other players"""
+        return list(self.game.playerView(x) for x in self.player.others())
+
+    def __getattr__(self, name):
+        return getattr(self.player, name)
+
+    def __setattr__(self, name, value):
+        raise TypeError
+
+    def __eq__(self, other):
+        return self.player is getattr(other, 'player', other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.player)
+
+    def __str__(self):
+        return str(self.player)
+
+
+class GameView:
+
+    """a read only view on the server game for one robot player.
+    Only the random generator and the moves are our own: the robot
+    must make the same random choices as if it had its own game,
+    and it must see the notifications sent to it"""
+
+    # those use our own random generator and our own moves
+    lastMoves = Game.lastMoves
+    _setHandSeed = Game._setHandSeed
+
+    def __init__(self, game, viewerName):
+        object.__setattr__(self, '_game', weakref.ref(game))
+        object.__setattr__(self, 'viewerName', viewerName)
+        object.__setattr__(self, 'moves', [])
+        object.__setattr__(self, '_views', {})
+        object.__setattr__(self, 'randomGenerator', CountingRandom(self))
+        myself = self.playerView(game.players.byName(viewerName))
+        object.__setattr__(myself, 'intelligence', AIDefault(myself))
+        object.__setattr__(self, 'myself', myself)
+
+    @property
+    def game(self):
+        """hide weakref"""
+        return self._game()
+
+    def playerView(self, player):
+        """the view on player, always the same one"""
+        if player.name not in self._views:
+            self._views[player.name] = PlayerView(player, self)
+        return self._views[player.name]
+
+    def __getattr__(self, name):
+        return getattr(self.game, name)
+
+    def __setattr__(self, name, value):
+        raise TypeError
+
+    def __bool__(self):
+        return self.game is not None
+
+
+class SharedRobotClient(Client):
+
+    """a robot client within the game server, looking at the
+    server game instead of mirroring it"""
+
+    def readyForGameStart(
+            self, tableid, gameid, wantedGame, playerNames, shouldSave=True, gameClass=None):
+        """a robot is always ready"""
+        self.game = GameView(self.table.game, self.name)
+        return succeed(Message.OK)
+
+    def readyForHandStart(self, playerNames, rotateWinds):
+        """the server game already did this"""
+        pass
+
+    def exec_move(self, move):
+        """the server game already knows about the move,
+        we only need to answer"""
+        message = move.message
+        if not message.needsGame:
+            answer = message.clientAction(self, move)
+        elif not self.game:
+            answer = Message.OK
+        else:
+            self.game.moves.append(move)
+            if move.notifying:
+                self.notifyClaimWindow(move)
+                answer = None
+            else:
+                answer = self.__answer(move)
+        if not isinstance(answer, Deferred):
+            answer = succeed(answer)
+        return answer
+
+    def __answer(self, move):
+        """what the robot has to say about move"""
+        # pylint: disable=too-many-return-statements
+        message = move.message
+        isMe = self.thatWasMe(move.player)
+        if message == Message.InitHand:
+            self.game._setHandSeed()  # pylint: disable=protected-access
+        elif message == Message.AskForClaims:
+            return self.ask(move, [Message.NoClaim, Message.Chow, Message.Pung, Message.Kong, Message.MahJongg])
+        elif message == Message.PickedTile:
+            if isMe:
+                if move.tile.isBonus:
+                    return Message.Bonus, move.tile
+                return self.myAction(move)
+        elif message in (Message.Pung, Message.Chow):
+            if isMe:
+                return self.myAction(move)
+        elif message == Message.DeclaredKong:
+            if not isMe:
+                return self.ask(move, [Message.NoClaim, Message.MahJongg])
+        elif message == Message.OriginalCall:
+            if isMe:
+                move.player.originalCallingHand = move.player.hand
+            return self.ask(move, [Message.OK])
+        elif message in (Message.ViolatesOriginalCall, Message.Calling,
+                         Message.DangerousGame, Message.NoChoice):
+            return self.ask(move, [Message.OK])
+        return None
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Wolfgang Rohdewald <wolfgang@rohdewald.de>
+
+Kajongg is free software you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+Play robot games within one process: no network, no data base,
+no reactor. The game server table and four robot clients talk
+directly with each other. The CSV rows are the same as those written
+by kajonggtest.py for the same ruleset, AI and seed.
+"""
+
+from __future__ import print_function
+
+import signal
+signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+import sys
+import time
+
+from optparse import OptionParser
+
+from common import Internal, Options, Debug
+Internal.isServer = True
+Internal.logPrefix = 'S'
+from util import gitHead
+
+
+class SimulatedServer:
+
+    """stands in for the game server. It only knows one table."""
+
+    def __init__(self):
+        self.tables = {}
+        self.srvUsers = []
+        self.workers = None
+        self.aborted = None
+
+    def generateTableId(self):
+        """there is only one table per server"""
+        return len(self.tables) + 1
+
+    @staticmethod
+    def tablesWith(dummyUser):
+        """there are no human users"""
+        return []
+
+    def removeTable(self, table, reason, message=None, *args):
+        """the game is over or aborted"""
+        if reason == 'abort':
+            from log import i18n
+            self.aborted = i18n(message or '', *args)
+        self.tables.pop(table.tableid, None)
+        table.running = False
+        if table.game:
+            table.game.close()
+
+
+def simulatedGameClass():
+    """we only import game stuff after the options are set"""
+    from game import PlayingGame
+
+    class SimulatedGame(PlayingGame):
+
+        """the game of the tester: nobody else can see the tags, and there is
+        no data base for saving the scores"""
+
+        def addCsvTag(self, tag, forAllPlayers=False):
+            """all tags go into the csv row"""
+            PlayingGame.addCsvTag(self, tag, forAllPlayers=True)
+
+        def _saveScores(self):
+            """only the tags, there is no data base"""
+            self._tagLimitHands()
+
+    return SimulatedGame
+
+
+def testerClientClass():
+    """we only import client stuff after the options are set"""
+    from client import Client
+
+    class TesterClient(Client):
+
+        """plays the part of the human client started by kajonggtest.py"""
+
+        def readyForGameStart(
+                self, tableid, gameid, wantedGame, playerNames, shouldSave=True, gameClass=None):
+            """the tester plays with Options.AI"""
+            result = Client.readyForGameStart(
+                self, tableid, gameid, wantedGame, playerNames, shouldSave,
+                gameClass=simulatedGameClass())
+            aiClass = self.findAI(Options.AI)
+            if not aiClass:
+                raise Exception('intelligence %s is undefined' % Options.AI)
+            self.game.myself.intelligence = aiClass(self.game.myself)
+            return result
+
+    return TesterClient
+
+
+def playGame(ruleset, seed, testerName, csvName=None, playOpen=False):
+    """play one game and return the game of the tester.
+    Returns None if the game has been aborted."""
+    from client import Client
+    from sharedrobot import SharedRobotClient
+    from servertable import ServerTable
+    server = SimulatedServer()
+    table = ServerTable(
+        server, None, ruleset, None, playOpen, True, str(seed))
+    table.game = table.prepareNewGame([testerName])
+    table.game.shouldSave = False
+    testerClass = testerClientClass()
+    for player in table.game.players:
+        if player.name == testerName:
+            remote = testerClass(player.name)
+        elif Options.sharedRobots:
+            remote = SharedRobotClient(player.name)
+        else:
+            remote = Client(player.name)
+        remote.table = table
+        table.remotes[player] = remote
+        player.shouldSave = False
+    tester = list(x for x in table.remotes.values() if x.name == testerName)[0]
+    table.pendingCallbacks = []
+    table.initGame()
+    while table.pendingCallbacks and not server.aborted:
+        method, requests, args = table.pendingCallbacks.pop(0)
+        method(requests, *args)
+    if server.aborted:
+        print('%s: aborted: %s' % (seed, server.aborted))
+        return None
+    game = tester.game
+    game.rotateWinds()
+    if csvName:
+        game.writeCsv(csvName)
+    return game
+
+
+def parse_options():
+    """parse options"""
+    parser = OptionParser()
+    parser.add_option(
+        '', '--ruleset', dest='ruleset', default='DMJL',
+        help='play using RULESET', metavar='RULESET')
+    parser.add_option(
+        '', '--rounds', dest='rounds', type=int,
+        help='play only # ROUNDS per game',
+        metavar='ROUNDS')
+    parser.add_option(
+        '', '--ai', dest='aiVariant', default='Default',
+        help='the AI variant for the tester', metavar='AI')
+    parser.add_option(
+        '', '--game', dest='game',
+        help='start first game with GAMEID, increment for following games',
+        metavar='GAMEID', type=int, default=1)
+    parser.add_option(
+        '', '--count', dest='count',
+        help='play COUNT games. Default is 1',
+        metavar='COUNT', type=int, default=1)
+    parser.add_option(
+        '', '--playopen', dest='playopen', action='store_true',
+        help='all robots play with visible concealed tiles', default=False)
+    parser.add_option(
+        '', '--sharedrobots', dest='sharedrobots', action='store_true',
+        help='the robots look at the server game instead of mirroring it', default=False)
+    parser.add_option(
+        '', '--csv', dest='csv',
+        help='append the results to CSV', metavar='CSV')
+    parser.add_option(
+        '', '--debug', dest='debug',
+        help=Debug.help())
+    return parser.parse_args()
+
+
+def rulesetNames():
+    """the names of all selectable rulesets"""
+    import predefined
+    from rule import Ruleset, PredefinedRuleset
+    if not PredefinedRuleset.classes:
+        predefined.load()
+    return list(x.name for x in Ruleset.selectableRulesets())
+
+
+def findRuleset(name):
+    """returns the ruleset matching name, exits if there is none"""
+    import predefined
+    from rule import Ruleset, PredefinedRuleset
+    if not PredefinedRuleset.classes:
+        predefined.load()
+    rulesets = dict((x.name, x) for x in Ruleset.selectableRulesets())
+    if name in rulesets:
+        return rulesets[name]
+    matches = list(x for x in rulesets if name in x)
+    if len(matches) != 1:
+        if len(matches) == 0:
+            raise SystemExit('Ruleset %s is unknown' % name)
+        raise SystemExit('Ruleset %s is ambiguous: %s' % (name, ', '.join(matches)))
+    return rulesets[matches[0]]
+
+
+def main():
+    """play the games"""
+    if OPTIONS.debug:
+        msg = Debug.setOptions(OPTIONS.debug)
+        if msg:
+            print(msg)
+            sys.exit(2)
+    Options.AI = OPTIONS.aiVariant
+    Options.rounds = OPTIONS.rounds
+    Options.playOpen = OPTIONS.playopen
+    Options.sharedRobots = OPTIONS.sharedrobots
+    Options.fixed = True
+    if OPTIONS.csv and gitHead() == 'current':
+        print('Disabling CSV output: You have uncommitted changes')
+        OPTIONS.csv = None
+    ruleset = findRuleset(OPTIONS.ruleset)
+    start = time.time()
+    for seed in range(OPTIONS.game, OPTIONS.game + OPTIONS.count):
+        game = playGame(ruleset, seed, 'Tester 1', OPTIONS.csv, OPTIONS.playopen)
+        if game:
+            print('%s: %s' % (seed, ' '.join(
+                '%s:%d' % (x.name, x.balance) for x in sorted(game.players, key=lambda x: x.name))))
+    print('%d games in %.1f seconds' % (OPTIONS.count, time.time() - start))
+
+if __name__ == '__main__':
+    OPTIONS, ARGS = parse_options()
+    main()
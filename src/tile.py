@@ -20,6 +20,8 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
 from __future__ import print_function
 
+from operator import attrgetter
+
 from log import logException
 from mi18n import i18n, i18nc
 from common import IntDict, StrMixin
@@ -57,6 +59,21 @@ class Tile(str, StrMixin):
     # the // is needed as separator between too many w's
     # intelligence.py will define Tile('b0') or Tile('s:')
 
+    # key is the integer id of a tile, 1 + its index in hashTable.
+    # Those tables are indexed by key, 0 stands for no tile
+    byKey = [None] * (len(hashTable) // 2 + 1)
+    exposedKeys = [0] * len(byKey)
+    concealedKeys = [0] * len(byKey)
+    nextKeys = [0] * len(byKey)
+    # the flags of a tile as bits, see flagBit
+    flagNames = (
+        'isExposed', 'isConcealed', 'isBonus', 'isDragon', 'isWind', 'isHonor',
+        'isTerminal', 'isNumber', 'isReal', 'isMajor', 'isMinor', 'isKnown')
+    flagBit = dict((x, 1 << idx) for idx, x in enumerate(flagNames))
+    flags = [0] * len(byKey)
+    # (group, value) to key
+    keyOf = {}
+
     unknown = None
 
     # Groups:
@@ -133,9 +150,12 @@ class Tile(str, StrMixin):
                 (result[0], result[1])):
             cls.cache[key] = result
 
-        existing = list([x for x in cls.cache.values() if x.key == result.key])
-        existingIds = set(id(x) for x in existing)
-        assert len(existingIds) == 1, 'new is:{} existing are: {} with ids {}'.format(result, existing, existingIds)
+        assert cls.byKey[result.key] is None, 'new is:{} existing is: {}'.format(
+            result, cls.byKey[result.key])
+        cls.byKey[result.key] = result
+        cls.keyOf[(result.group, result.value)] = result.key
+        cls.flags[result.key] = sum(
+            bit for name, bit in cls.flagBit.items() if getattr(result, name))
 
         result.exposed = result.concealed = result.swapped = None
         result.single = result.pair = result.pung = None
@@ -168,6 +188,9 @@ class Tile(str, StrMixin):
                         result.group,
                         result.value +
                         1))
+                cls.nextKeys[result.key] = result.nextForChow.key
+        cls.exposedKeys[result.key] = result.exposed.key
+        cls.concealedKeys[result.key] = result.concealed.key
 
         return result
 
@@ -248,6 +271,9 @@ class TileList(list):
 
     """a list that can only hold tiles"""
 
+    # sorting with this is much faster than with Tile.__lt__
+    order = attrgetter('key')
+
     def __init__(self, newContent=None):
         list.__init__(self)
         if newContent is None:
@@ -272,7 +298,7 @@ class TileList(list):
 
     def sorted(self):
         """sort(TileList) would not keep TileList type"""
-        return TileList(sorted(self))
+        return TileList(sorted(self, key=self.order))
 
     def hasChows(self, tile):
         """returns my chows with tileName"""
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+
+"""Copyright (C) 2016 Wolfgang Rohdewald <wolfgang@rohdewald.de>
+
+Kajongg is free software you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+
+
+Read the user manual for a description of the interface to this scoring engine
+"""
+
+from tile import Tile
+
+
+class TileCounts:
+
+    """the concealed tiles of a hand as a vector of 34 counts,
+    one slot per tile kind: 9 stones, 9 bamboos, 9 characters,
+    4 winds and 3 dragons. Exposed and concealed tiles share
+    their slot, bonus tiles have none.
+
+    This is much cheaper than building Hand objects when we only
+    want to know if tiles can be grouped into the standard
+    Mah Jongg form: melds plus one pair.
+
+    The missing* methods tell how many tiles are missing for
+    a Mah Jongg form: the number of tiles we have to get, each
+    of them replacing a tile we do not need. 0 means complete."""
+
+    tiles = list(Tile(group, value) for group in Tile.colors for value in Tile.numbers)
+    tiles.extend(Tile(Tile.wind, x) for x in Tile.winds)
+    tiles.extend(Tile(Tile.dragon, x) for x in Tile.dragons)
+    slots = dict((x, idx) for idx, x in enumerate(tiles))
+    slots.update((x.concealed, idx) for idx, x in enumerate(tiles))
+
+    # (first slot, length, chows possible)
+    blocks = ((0, 9, True), (9, 9, True), (18, 9, True))
+    blocks += tuple((x, 1, False) for x in range(27, 34))
+
+    blockCache = {}
+    groupCache = {}
+    knittingCache = {}
+
+    def __init__(self, tiles=None):
+        self.counts = [0] * len(self.tiles)
+        self.isValid = True
+        for tile in tiles or []:
+            slot = self.slots.get(tile)
+            if slot is None:
+                # unknown or bonus tiles
+                self.isValid = False
+            else:
+                self.counts[slot] += 1
+
+    def __str__(self):
+        return ''.join(str(self.tiles[idx]) * count for idx, count in enumerate(self.counts))
+
+    @classmethod
+    def blockPairs(cls, values, chows):
+        """values is a tuple of counts for one block. Returns
+        a frozenset holding the number of pairs (0 or 1) with
+        which values can completely be split into pungs, chows and
+        at most one pair. Empty if there is no such split."""
+        cacheKey = (values, chows)
+        if cacheKey not in cls.blockCache:
+            result = set()
+            cls.__split(list(values), chows, 0, result)
+            cls.blockCache[cacheKey] = frozenset(result)
+        return cls.blockCache[cacheKey]
+
+    @classmethod
+    def __split(cls, values, chows, pairs, result):
+        """recursively remove melds from the lowest remaining value"""
+        for idx, count in enumerate(values):
+            if count:
+                break
+        else:
+            result.add(pairs)
+            return
+        if count >= 3:
+            values[idx] -= 3
+            cls.__split(values, chows, pairs, result)
+            values[idx] += 3
+        if count >= 2 and not pairs:
+            values[idx] -= 2
+            cls.__split(values, chows, 1, result)
+            values[idx] += 2
+        if chows and idx + 2 < len(values) and values[idx + 1] and values[idx + 2]:
+            values[idx] -= 1
+            values[idx + 1] -= 1
+            values[idx + 2] -= 1
+            cls.__split(values, chows, pairs, result)
+            values[idx] += 1
+            values[idx + 1] += 1
+            values[idx + 2] += 1
+
+    def __blockResults(self, chows):
+        """blockPairs for all blocks"""
+        return list(
+            self.blockPairs(tuple(self.counts[start:start + length]), chows and blockChows)
+            for start, length, blockChows in self.blocks)
+
+    @staticmethod
+    def __combine(blockResults, pairs):
+        """can all blocks together have exactly pairs pairs?"""
+        possible = {0}
+        for blockResult in blockResults:
+            if not blockResult:
+                return False
+            possible = set(x + y for x in possible for y in blockResult if x + y <= pairs)
+            if not possible:
+                return False
+        return pairs in possible
+
+    def isComplete(self, chows=True, pairs=1):
+        """can all tiles be grouped into pungs and chows plus pairs pairs?"""
+        return self.isValid and self.__combine(self.__blockResults(chows), pairs)
+
+    def completingTiles(self, chows=True, pairs=1):
+        """returns a set of exposed tiles: each of them completes the
+        tiles to melds plus pairs pairs. Only the block of the added
+        tile has to be split again."""
+        result = set()
+        if not self.isValid:
+            return result
+        blockResults = self.__blockResults(chows)
+        for blockIdx, (start, length, blockChows) in enumerate(self.blocks):
+            others = blockResults[:blockIdx] + blockResults[blockIdx + 1:]
+            if not self.__combine(others + [frozenset([0, 1])], pairs):
+                # adding to this block cannot help
+                continue
+            values = self.counts[start:start + length]
+            for offset in range(length):
+                if values[offset] >= 4:
+                    continue
+                values[offset] += 1
+                blockResult = self.blockPairs(tuple(values), chows and blockChows)
+                values[offset] -= 1
+                if self.__combine(others + [blockResult], pairs):
+                    result.add(self.tiles[start + offset])
+        return result
+
+    @classmethod
+    def blockGroups(cls, values, chows):
+        """values is a tuple of counts for one block. Returns a
+        frozenset of tuples (melds, partials, pairs): all ways of
+        picking complete melds, partial melds needing one more tile
+        and at most one pair for Mah Jongg from values. Ways which
+        are not better than another one are left out."""
+        cacheKey = (values, chows)
+        if cacheKey not in cls.groupCache:
+            cls.groupCache[cacheKey] = cls.__groups(values, chows)
+        return cls.groupCache[cacheKey]
+
+    @classmethod
+    def __groups(cls, values, chows):
+        """the lowest remaining value is either dropped or starts a group"""
+        for idx, count in enumerate(values):
+            if count:
+                break
+        else:
+            return frozenset([(0, 0, 0)])
+        size = len(values)
+        groups = [((idx,), (0, 0, 0))]
+        if count >= 3:
+            groups.append(((idx, idx, idx), (1, 0, 0)))
+        if count >= 2:
+            groups.append(((idx, idx), (0, 1, 0)))
+            groups.append(((idx, idx), (0, 0, 1)))
+        if chows and idx + 1 < size and values[idx + 1]:
+            groups.append(((idx, idx + 1), (0, 1, 0)))
+            if idx + 2 < size and values[idx + 2]:
+                groups.append(((idx, idx + 1, idx + 2), (1, 0, 0)))
+        if chows and idx + 2 < size and values[idx + 2]:
+            groups.append(((idx, idx + 2), (0, 1, 0)))
+        result = set()
+        for used, (melds, partials, pairs) in groups:
+            rest = list(values)
+            for slot in used:
+                rest[slot] -= 1
+            for restMelds, restPartials, restPairs in cls.blockGroups(tuple(rest), chows):
+                if pairs + restPairs <= 1:
+                    result.add((melds + restMelds, partials + restPartials, pairs + restPairs))
+        return cls.__best(result)
+
+    @staticmethod
+    def __best(groups):
+        """only those which are not worse than another one in every respect"""
+        return frozenset(
+            x for x in groups
+            if not any(y != x and all(a >= b for a, b in zip(y, x)) for y in groups))
+
+    def missing(self, melds=4, pairs=1, chows=True):
+        """how many tiles are missing for melds melds plus pairs pairs
+        (0 or 1), the standard Mah Jongg form? Every missing meld can
+        use one single tile, every partial meld needs one more tile.
+        Returns None for unknown or bonus tiles."""
+        if not self.isValid:
+            return None
+        possible = {(0, 0, 0)}
+        for start, length, blockChows in self.blocks:
+            blockResult = self.blockGroups(
+                tuple(self.counts[start:start + length]), chows and blockChows)
+            possible = self.__best(set(
+                (min(x[0] + y[0], melds), min(x[1] + y[1], melds), x[2] + y[2])
+                for x in possible for y in blockResult if x[2] + y[2] <= pairs))
+        tileCount = sum(self.counts)
+        used = 0
+        for meldCount, partials, pairCount in possible:
+            partials = min(partials, melds - meldCount)
+            used = max(used, min(
+                tileCount, melds + pairs + 2 * meldCount + partials + pairCount))
+        return 3 * melds + 2 * pairs - used
+
+    def __colorCounts(self, color):
+        """the 9 counts for color"""
+        start = self.slots[Tile(color, 1)]
+        return self.counts[start:start + 9]
+
+    def __honorCounts(self, group):
+        """the counts for all winds or all dragons"""
+        return list(self.counts[self.slots[x]] for x in self.tiles if x.group == group)
+
+    def __majorCounts(self):
+        """the counts for all terminals and honors"""
+        return list(self.counts[self.slots[x]] for x in self.tiles if x.isMajor)
+
+    def missingOrphans(self):
+        """one of each terminal and honor, one of them twice"""
+        if not self.isValid:
+            return None
+        counts = self.__majorCounts()
+        return 14 - sum(bool(x) for x in counts) - any(x >= 2 for x in counts)
+
+    def missingHonorPairs(self):
+        """seven different pairs of terminals and honors"""
+        if not self.isValid:
+            return None
+        return 14 - sum(sorted((min(x, 2) for x in self.__majorCounts()), reverse=True)[:7])
+
+    def missingSnake(self):
+        """a pair of 1, 2..9 and all winds, all in one suit"""
+        if not self.isValid:
+            return None
+        winds = sum(bool(x) for x in self.__honorCounts(Tile.wind))
+        return 14 - winds - max(
+            min(values[0], 2) + sum(bool(x) for x in values[1:])
+            for values in (self.__colorCounts(x) for x in Tile.colors))
+
+    def missingGates(self, surplusValues=Tile.minors):
+        """1 and 9 three times, 2..8 once, all in one suit. Plus one more
+        tile with one of surplusValues"""
+        if not self.isValid:
+            return None
+        best = 0
+        for color in Tile.colors:
+            values = self.__colorCounts(color)
+            found = min(values[0], 3) + min(values[8], 3) + sum(bool(x) for x in values[1:8])
+            surplus = any(values[x - 1] - (3 if x in (1, 9) else 1) > 0 for x in surplusValues)
+            best = max(best, found + surplus)
+        return 14 - best
+
+    def missingKnitting(self):
+        """seven couples, each with the same value in two suits. The
+        two suits are the same for all couples"""
+        if not self.isValid:
+            return None
+        cacheKey = (False, tuple(self.counts[:27]))
+        if cacheKey not in self.knittingCache:
+            self.knittingCache[cacheKey] = self.__knitting()
+        return self.knittingCache[cacheKey]
+
+    def __knitting(self):
+        """see missingKnitting"""
+        colors = list(self.__colorCounts(x) for x in Tile.colors)
+        best = 0
+        for first, second in ((0, 1), (0, 2), (1, 2)):
+            # found[x] is the best with x couples
+            found = [0] + [None] * 7
+            for value in range(9):
+                newFound = found[:]
+                for couples in range(1, 8):
+                    gain = min(colors[first][value], couples) + min(colors[second][value], couples)
+                    for before in range(8 - couples):
+                        if found[before] is not None:
+                            total = found[before] + gain
+                            if newFound[before + couples] is None or newFound[before + couples] < total:
+                                newFound[before + couples] = total
+                found = newFound
+            best = max(best, max(x for x in found if x is not None))
+        return 14 - best
+
+    def missingTripleKnitting(self):
+        """four triples, each with the same value in all three suits,
+        plus one couple with the same value in two suits"""
+        if not self.isValid:
+            return None
+        cacheKey = (True, tuple(self.counts[:27]))
+        if cacheKey not in self.knittingCache:
+            self.knittingCache[cacheKey] = self.__tripleKnitting()
+        return self.knittingCache[cacheKey]
+
+    def __tripleKnitting(self):
+        """see missingTripleKnitting"""
+        colors = list(self.__colorCounts(x) for x in Tile.colors)
+        couples = ((), (0, 1), (0, 2), (1, 2))
+        # found[(triples, couple)] is the best for so many triples and couples
+        found = {(0, 0): 0}
+        for value in range(9):
+            counts = list(x[value] for x in colors)
+            newFound = dict(found)
+            for (triples, couple), before in found.items():
+                for moreTriples in range(5 - triples):
+                    for suits in couples[:1 if couple else 4]:
+                        if not moreTriples and not suits:
+                            continue
+                        gain = sum(
+                            min(count, moreTriples + (idx in suits))
+                            for idx, count in enumerate(counts))
+                        key = (triples + moreTriples, couple + bool(suits))
+                        newFound[key] = max(newFound.get(key, 0), before + gain)
+            found = newFound
+        return 14 - max(found.values())
@@ -32,6 +32,7 @@ from servercommon import srvError
 from log import logDebug
 from mi18n import i18nE
 from query import Query
+from wire import Wire
 
 class User(pb.Avatar, StrMixin):
 
@@ -47,6 +48,7 @@ class User(pb.Avatar, StrMixin):
         self.dbIdent = None
         self.voiceId = None
         self.maxGameId = None
+        self.wireVersion = 0
         self.lastPing = None
         self.pinged()
 
@@ -110,13 +112,23 @@ class User(pb.Avatar, StrMixin):
                 self.dbIdent, self.voiceId, self.maxGameId, clientVersion))
         self.server.sendTables(self)
 
+    def perspective_setWire(self, wireVersion, digest):
+        """perspective_* methods are to be called remotely"""
+        self.wireVersion = Wire.negotiate(wireVersion, digest)
+        if Debug.connections:
+            logDebug('{} uses wire version {}'.format(self, self.wireVersion))
+        return self.wireVersion
+
     def perspective_ping(self):
         """perspective_* methods are to be called remotely"""
         return self.pinged()
 
     def perspective_needRulesets(self, rulesetHashes):
         """perspective_* methods are to be called remotely"""
-        return self.server.needRulesets(rulesetHashes)
+        result = self.server.needRulesets(rulesetHashes)
+        if self.wireVersion:
+            result = Wire.zipValue(result)
+        return result
 
     def perspective_joinTable(self, tableid):
         """perspective_* methods are to be called remotely"""
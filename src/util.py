@@ -144,6 +144,9 @@ class Duration:
 
     """a helper class for checking code execution duration"""
 
+    # if a dict, we sum up count and seconds per name
+    totals = None
+
     def __init__(self, name, threshold=None, bug=False):
         """name describes where in the source we are checking
         threshold in seconds: do not warn below
@@ -158,6 +161,10 @@ class Duration:
 
     def __exit__(self, exc_type, exc_value, trback):
         """now check time passed"""
+        if Duration.totals is not None:
+            diff = datetime.datetime.now() - self.__start
+            count, seconds = Duration.totals.get(self.name, (0, 0.0))
+            Duration.totals[self.name] = (count + 1, seconds + diff.total_seconds())
         if not Debug.neutral:
             diff = datetime.datetime.now() - self.__start
             if diff > datetime.timedelta(seconds=self.threshold):
@@ -170,6 +177,15 @@ class Duration:
                 else:
                     print(msg)
 
+    @staticmethod
+    def report(limit=20):
+        """the names with the most time spent, one line each"""
+        if not Duration.totals:
+            return []
+        result = sorted(Duration.totals.items(), key=lambda x: -x[1][1])[:limit]
+        return list('{:8.3f}s {:6d}x {}'.format(seconds, count, name)
+                    for name, (count, seconds) in result)
+
 
 def checkMemory():
     """as the name says"""
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Wolfgang Rohdewald <wolfgang@rohdewald.de>
+
+Kajongg is free software you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+The compact encoding of moves between game server and clients.
+Message.jelly sends message names and tiles as strings. With the
+compact encoding, a message is a small int and every tile is
+one byte. Large payloads like voice data and rulesets are compressed.
+Since version 2, the server may send several moves at once.
+
+Client and server agree on the encoding with setWire after login.
+The encoding is only used if both know the same version and the
+same messages.
+"""
+
+import hashlib
+import json
+import zlib
+
+from twisted.spread import pb
+
+from common import Debug
+from log import logDebug
+from message import Message
+from tile import Tile
+
+
+class Wire:
+
+    """encodes and decodes moves and answers. 0 means we use
+    the old encoding with Message.jelly"""
+
+    version = 2
+
+    # values longer than this are compressed if that helps
+    zipLimit = 1024
+
+    messageNames = sorted(Message.defined)
+    messageIds = dict((x, idx) for idx, x in enumerate(messageNames))
+
+    # Tile.key starts with 1, we use 0 as separator between melds
+    tileNames = list(Tile.hashTable[x:x + 2] for x in range(0, len(Tile.hashTable), 2))
+    tileCodes = dict((x, idx + 1) for idx, x in enumerate(tileNames) if x != '//')
+    tileNames.insert(0, ' ')
+
+    tileSuffixes = ('tile', 'tiles', 'meld', 'melds')
+
+    @classmethod
+    def digest(cls):
+        """both sides must number the messages the same way"""
+        return hashlib.md5(' '.join(cls.messageNames).encode()).hexdigest()
+
+    @classmethod
+    def negotiate(cls, wireVersion, digest):
+        """the best version for us and the client"""
+        if not wireVersion or digest != cls.digest():
+            return 0
+        return min(wireVersion, cls.version)
+
+    @classmethod
+    def isTileKey(cls, key):
+        """does the value of key hold tiles?"""
+        return key.lower().endswith(cls.tileSuffixes)
+
+    @classmethod
+    def encodeTiles(cls, value):
+        """a string with tiles and melds to bytes"""
+        codes = cls.tileCodes
+        return b'\0'.join(
+            bytes(codes[meld[x:x + 2]] for x in range(0, len(meld), 2))
+            for meld in value.split(' '))
+
+    @classmethod
+    def decodeTiles(cls, value):
+        """bytes to a string with tiles and melds"""
+        names = cls.tileNames
+        return ''.join(names[x] for x in value)
+
+    @staticmethod
+    def zipValue(value):
+        """returns compressed bytes. The first byte tells what value was"""
+        if isinstance(value, bytes):
+            return b'b' + zlib.compress(value)
+        if isinstance(value, str):
+            return b's' + zlib.compress(value.encode('utf-8'))
+        return b'j' + zlib.compress(json.dumps(value).encode('utf-8'))
+
+    @staticmethod
+    def unzipValue(value):
+        """reverse of zipValue"""
+        kind, content = value[:1], zlib.decompress(value[1:])
+        if kind == b'b':
+            return content
+        if kind == b's':
+            return content.decode('utf-8')
+        return json.loads(content.decode('utf-8'))
+
+    @classmethod
+    def zipped(cls, value):
+        """compress value if it is big and if that saves something.
+        Returns the value and a flag"""
+        if isinstance(value, (bytes, str)) and len(value) > cls.zipLimit:
+            result = cls.zipValue(value)
+            if len(result) < len(value):
+                return result, True
+        return value, False
+
+    @classmethod
+    def encodeMove(cls, command, kwargs):
+        """command is a Message, kwargs as prepared by DeferredBlock.tell.
+        Returns the message id, kwargs and a list with the
+        names of the compressed kwargs"""
+        result = {}
+        zipped = []
+        for key, value in kwargs.items():
+            if value is None:
+                pass
+            elif cls.isTileKey(key):
+                value = cls.encodeTiles(str(value))
+            else:
+                value, isZipped = cls.zipped(Message.jelly(key, value))
+                if isZipped:
+                    zipped.append(key)
+            result[key] = value
+        return cls.messageIds[command.name], result, zipped
+
+    @classmethod
+    def decodeMove(cls, messageId, kwargs, zipped):
+        """reverse of encodeMove: returns the Message and kwargs for Move"""
+        result = {}
+        for key, value in kwargs.items():
+            if value is None:
+                pass
+            elif key in zipped:
+                value = cls.unzipValue(value)
+            elif cls.isTileKey(key):
+                value = cls.decodeTiles(value)
+            result[key] = value
+        return Message.defined[cls.messageNames[messageId]], result
+
+    @classmethod
+    def encodeAnswer(cls, answer):
+        """the answer of a client: the message as int, the args as with Message.jelly"""
+        if isinstance(answer, tuple) and isinstance(answer[0], Message):
+            if answer[1] is None or answer[1] == []:
+                return cls.messageIds[answer[0].name]
+            return tuple([cls.messageIds[answer[0].name], Message.jelly('args', answer[1])])
+        if isinstance(answer, Message):
+            return cls.messageIds[answer.name]
+        return Message.jelly(answer, answer)
+
+    @classmethod
+    def messageName(cls, answer):
+        """answers may use message ids"""
+        if isinstance(answer, bool):
+            return answer
+        if isinstance(answer, int) and 0 <= answer < len(cls.messageNames):
+            return cls.messageNames[answer]
+        return answer
+
+
+class CountingTransport:
+
+    """passes everything to transport, counts the bytes written"""
+
+    def __init__(self, transport, broker):
+        self.transport = transport
+        self.broker = broker
+
+    def write(self, data):
+        """count and write"""
+        self.broker.bytesSent += len(data)
+        self.transport.write(data)
+
+    def writeSequence(self, data):
+        """count and write"""
+        self.broker.bytesSent += sum(len(x) for x in data)
+        self.transport.writeSequence(data)
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+
+class CountingBroker(pb.Broker):
+
+    """counts traffic for one connection"""
+
+    def __init__(self, *args, **kwargs):
+        pb.Broker.__init__(self, *args, **kwargs)
+        self.messagesSent = 0
+        self.messagesReceived = 0
+        self.bytesSent = 0
+        self.bytesReceived = 0
+
+    def makeConnection(self, transport):
+        pb.Broker.makeConnection(self, CountingTransport(transport, self))
+
+    def sendEncoded(self, obj):
+        self.messagesSent += 1
+        pb.Broker.sendEncoded(self, obj)
+
+    def dataReceived(self, chunk):
+        self.bytesReceived += len(chunk)
+        pb.Broker.dataReceived(self, chunk)
+
+    def expressionReceived(self, sexp):
+        self.messagesReceived += 1
+        pb.Broker.expressionReceived(self, sexp)
+
+    def connectionLost(self, reason):
+        if Debug.traffic or Debug.connections:
+            logDebug('connection {}: {}'.format(self.transport.getPeer(), self.stats()))
+        pb.Broker.connectionLost(self, reason)
+
+    def stats(self):
+        """for debug output"""
+        return 'sent {} messages with {} bytes, received {} messages with {} bytes'.format(
+            self.messagesSent, self.bytesSent, self.messagesReceived, self.bytesReceived)